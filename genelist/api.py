@@ -1,9 +1,42 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import io
+import sys
+import gzip
+import json
+import mmap
+import array
+import struct
+from itertools import chain
+from operator import itemgetter
+
+from .utils.bgzf import is_gzipped, read_region
+
+try:
+    import numpy as np
+except ImportError: # only IntervalIndex needs numpy
+    np = None
+
+def open_list(path):
+    """Opens a gene list for reading, plain or gzip compressed, e.g. written with --bgzip.
+
+    Args:
+        path (str): path to the gene list.
+
+    Returns (file): the gene list, in text mode
+    """
+    if is_gzipped(path):
+        return io.TextIOWrapper(gzip.open(path), encoding='utf-8')
+    return open(path)
+
 def readlist(lines):
     """ """
 
+    # a path is opened, compressed or not
+    if isinstance(lines, str):
+        lines = open_list(lines)
+
     # slurp and make a line
     raw_data = (line.strip() for line in lines) # sluuuurp
     parsable_data = (line.split("\t") for line in raw_data)
@@ -24,3 +57,283 @@ def readlist(lines):
     dict_data = ( dict(zip(header, line)) for line in parsable_data )
 
     return comments, dict_data
+
+def readcolumns(lines, columns):
+    """Reads only some columns of a gene list. The header is parsed once and each row is split
+    and projected on the columns, without building a dict per row.
+
+    Args:
+        lines (iterable): the lines of a gene list.
+        columns (list): the names of the columns to read. Columns not in the header read as ''.
+                        None reads all columns of the header.
+
+    Returns (tuple): (comments, header, rows). comments are the leading ## comments, split on tab,
+                     without the contigs, as readlist. header is the list of all column names.
+                     rows yields a tuple with the values of the columns for each line.
+    """
+    lines = iter(lines)
+
+    # skip parsing of leading comments
+    comments = []
+    header = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith('##'):
+            if not line.startswith('##contig'):
+                comments.append(line.strip().split('\t')) # skip all contig comments
+            continue
+        header = line.strip().split('\t') # get the header
+        header[0] = header[0].lstrip('#')
+        break
+
+    # as dict(zip(header, line)), the last of duplicate columns wins
+    positions = dict((column, i) for i, column in enumerate(header))
+    width = len(header)
+    if columns is None:
+        indexes = list(range(width))
+    else:
+        indexes = [positions.get(column, width) for column in columns] # width is the '' padding
+    project = itemgetter(*indexes) if indexes else lambda fields: ()
+    if len(indexes) == 1:
+        single = project
+        project = lambda fields: (single(fields), )
+
+    def rows():
+        padding = [''] * (width + 1)
+        for line in lines:
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) != width:
+                fields = (fields + padding)[:width]
+            fields.append('')
+            yield project(fields)
+
+    return comments, header, rows()
+
+COLUMNAR_MAGIC = b'GLCOLUMN'
+COLUMNAR_VERSION = 2
+
+def array_typecode(dtype):
+    """Returns (str): the array typecode of the width and signedness of a little endian dtype of
+    the columnar format: '<u1', '<u2', '<u4', '<u8' or '<i8'. The typecodes of array differ in
+    width per platform, the dtypes don't."""
+    if len(dtype) < 3 or dtype[0] != '<' or dtype[1] not in 'ui' or not dtype[2:].isdigit():
+        raise ValueError("Unknown dtype '{}'".format(dtype))
+    itemsize = int(dtype[2:])
+    for typecode in ('BHIQL' if dtype[1] == 'u' else 'bhiql'):
+        if array.array(typecode).itemsize == itemsize:
+            return typecode
+    raise ValueError("No array typecode of {} bytes for dtype '{}'".format(itemsize, dtype))
+
+class ColumnarList(object):
+    """A gene list in the columnar format of genelist export, memory-mapped.
+    Integer columns are arrays over the mapped file, string columns are dictionary encoded:
+    an array of codes into the distinct values of the column, stored as one \0 terminated blob.
+    Close it, or use it as a context manager, to unmap the file. The arrays it returned can't
+    be used after.
+
+    Args:
+        path (str): path to the columnar file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self.mmap)
+
+        magic, version, meta_length = struct.unpack_from('<8sII', buf)
+        if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+            raise ValueError("'{}' is not a columnar gene list of version {}".format(path, COLUMNAR_VERSION))
+        meta_start = struct.calcsize('<8sII')
+        meta = json.loads(bytes(buf[meta_start:meta_start + meta_length]).decode('utf-8'))
+        data_start = meta_start + meta_length
+        data_start += -data_start % 8
+
+        self.comments = [comment.split('\t') for comment in meta['comments']] # as readlist
+        self.header = [column['name'] for column in meta['columns']]
+        self.nr_rows = meta['nr_rows']
+        self._buf = buf[data_start:]
+        self._views = [buf, self._buf] # views on the mmap, released by close
+        self._meta = dict((column['name'], column) for column in meta['columns'])
+        self._columns = {}
+        self._values = {}
+        self._codes = {}
+
+    def __len__(self):
+        return self.nr_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Releases the arrays over the file and unmaps it."""
+        if self.mmap.closed:
+            return
+        self._columns = {}
+        self._codes = {}
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self.mmap.close()
+
+    def _array(self, offset, dtype, length):
+        """Returns (memoryview|array): the array of a little endian dtype at offset."""
+        typecode = array_typecode(dtype)
+        itemsize = array.array(typecode).itemsize
+        data = self._buf[offset:offset + itemsize * length]
+        if sys.byteorder == 'little':
+            view = data.cast(typecode)
+            self._views.extend((data, view))
+            return view
+        values = array.array(typecode, data.tobytes())
+        data.release()
+        values.byteswap()
+        return values
+
+    def column(self, name):
+        """Returns the values of a column: an array of int for integer columns, a list of str
+        for string columns."""
+        if name not in self._columns:
+            meta = self._meta[name]
+            if meta['type'] == 'int':
+                self._columns[name] = self._array(meta['offset'], meta['dtype'], self.nr_rows)
+            else:
+                values = self.values(name)
+                self._columns[name] = [values[code] for code in self.codes(name)]
+        return self._columns[name]
+
+    def values(self, name):
+        """Returns (list): the distinct values of a string column, indexed by code."""
+        if name not in self._values:
+            meta = self._meta[name]
+            blob = bytes(self._buf[meta['values_offset']:meta['values_offset'] + meta['values_length']])
+            self._values[name] = blob.decode('utf-8').split('\0')[:-1] # each value ends with \0
+        return self._values[name]
+
+    def codes(self, name):
+        """Returns (memoryview|array): the codes of a string column, see values."""
+        if name not in self._codes:
+            meta = self._meta[name]
+            self._codes[name] = self._array(meta['codes_offset'], meta['dtype'], self.nr_rows)
+        return self._codes[name]
+
+    def rows(self, columns=None):
+        """Yields (tuple): the values of the columns, all columns by default, for each row.
+        Integer columns are yielded as str, as in the gene list."""
+        columns = columns or self.header
+        values = [self.column(column) for column in columns]
+        for row in zip(*values):
+            yield tuple(str(value) for value in row)
+
+def readcolumnar(path):
+    """Loads a gene list written by genelist export --format columnar.
+
+    Args:
+        path (str): path to the columnar file.
+
+    Returns (ColumnarList): the memory-mapped gene list
+    """
+    return ColumnarList(path)
+
+def normalize_chromosome(chromosome):
+    """Returns (str): the chromosome without a chr prefix and M as MT, as in the gene lists."""
+    if chromosome[:3].lower() == 'chr':
+        chromosome = chromosome[3:]
+    return 'MT' if chromosome == 'M' else chromosome
+
+class IntervalIndex(object):
+    """Per chromosome index of gene coordinates for bulk overlap queries. The intervals of a
+    chromosome are kept as NumPy arrays sorted on start, so a batch of queries is answered with
+    two binary searches per query and vectorized filtering. Needs numpy.
+
+    Args:
+        rows (iterable): (chromosome, start, stop) of each gene, coordinates 1-based and inclusive.
+                         The row id of a gene is its position in rows, rows with coordinates
+                         that are not integers are left out.
+    """
+
+    def __init__(self, rows):
+        if np is None:
+            raise ImportError('IntervalIndex needs numpy, install genelist[intervals]')
+
+        row_ids = {} # chromosome: [(start, stop, row id), ]
+        for row_id, (chromosome, start, stop) in enumerate(rows):
+            try:
+                start, stop = int(start), int(stop)
+            except ValueError:
+                continue
+            row_ids.setdefault(normalize_chromosome(chromosome.strip()), []).append((start, stop, row_id))
+
+        self.chromosomes = {} # chromosome: (starts, stops, row ids, max length), sorted on start
+        for chromosome, intervals in row_ids.items():
+            intervals = np.array(sorted(intervals), dtype=np.int64)
+            starts, stops, ids = intervals[:, 0].copy(), intervals[:, 1].copy(), intervals[:, 2].copy()
+            self.chromosomes[chromosome] = (starts, stops, ids, int((stops - starts).max()))
+
+    @classmethod
+    def from_genelist(cls, lines):
+        """Returns (IntervalIndex): the index of the Chromosome, Gene_start and Gene_stop columns,
+        the row ids count the data lines of the gene list from 0."""
+        comments, header, rows = readcolumns(lines, ['Chromosome', 'Gene_start', 'Gene_stop'])
+        return cls(rows)
+
+    def query(self, chromosomes, starts, stops=None):
+        """Finds the genes that overlap each query.
+
+        Args:
+            chromosomes (sequence): the chromosome of each query.
+            starts (sequence): the start of each query, 1-based.
+            stops (sequence, optional): the inclusive stop of each query, defaults to starts
+                                        for position queries.
+
+        Returns (tuple): (query ids, row ids), two int arrays of the same length with a pair
+                         for each overlap, sorted on query id and row id.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        stops = starts if stops is None else np.asarray(stops, dtype=np.int64)
+        chromosomes = np.array([normalize_chromosome(chromosome) for chromosome in chromosomes])
+
+        query_ids, row_ids = [], []
+        for chromosome in np.unique(chromosomes):
+            if chromosome not in self.chromosomes:
+                continue
+            gene_starts, gene_stops, gene_ids, max_length = self.chromosomes[chromosome]
+            queries = np.flatnonzero(chromosomes == chromosome)
+            query_starts = starts[queries]
+
+            # the genes that start after start - max length and on or before stop are candidates
+            first = np.searchsorted(gene_starts, query_starts - max_length, 'left')
+            last = np.searchsorted(gene_starts, stops[queries], 'right')
+            counts = last - first
+            total = int(counts.sum())
+            if not total:
+                continue
+
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            candidates = np.repeat(first, counts) + offsets
+            hits = gene_stops[candidates] >= np.repeat(query_starts, counts)
+            query_ids.append(np.repeat(queries, counts)[hits])
+            row_ids.append(gene_ids[candidates[hits]])
+
+        if not query_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        query_ids, row_ids = np.concatenate(query_ids), np.concatenate(row_ids)
+        order = np.lexsort((row_ids, query_ids))
+        return query_ids[order], row_ids[order]
+
+def readregion(path, chromosome, start=None, stop=None):
+    """Reads the lines of a contig, or of a region of it, from a gene list written with --bgzip.
+    Seeks to the region with the index of the gene list instead of reading the whole list.
+
+    Args:
+        path (str): path to the gene list.
+        chromosome (str): the contig.
+        start (int, optional): 1-based start of the region.
+        stop (int, optional): inclusive stop of the region.
+
+    Returns (tuple): (comments, dict_data) as readlist, with the lines that overlap the region.
+    """
+    header_lines, lines = read_region(path, chromosome, start, stop)
+    return readlist(chain(header_lines, lines))
@@ -1,14 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import sys
+import json
 import logging
+import multiprocessing
 import click
+import yaml
 
 from .modules.fetch import Fetch
 from .modules.mans import Mans
-from .modules.sanity import Sanity
+from .modules.sanity import expand_genelists, validate_lists
 from .modules.panels import get_panels
-from .modules.merge import merge_panels
+from .modules.merge import merge_panels, merge_panels_sorted
+from .modules.index import GeneIndex, INDEX_FILE
+from .modules.setop import setop_report, parse_expression
+from .modules.export import write_columnar
+from .modules.overlap import overlap as overlap_records
+from .utils.bgzf import write_indexed
 
 #logger = logging.getLogger(__name__)
 
@@ -38,12 +48,24 @@ def run():
               help='Will download a new version of mim2gene.txt, used to check the OMIM type.')
 @click.option('--config', '-c', required=True, type=click.File('r'),
               help='YAML config file.')
-def fetch(infile, outfile, leave_na, remove_non_genes, warn, error, info, download_mim2gene, report_empty, config):
+@click.option('--bgzip', is_flag=True, default=False, show_default=True,
+              help='Write OUTFILE sorted on contig and start, block compressed, '
+                   'with an index in OUTFILE.gli.json.')
+@click.option('--pipelined', is_flag=True, default=False, show_default=True,
+              help='Query the services at the same time, each for another line.')
+def fetch(infile, outfile, leave_na, remove_non_genes, warn, error, info, download_mim2gene, report_empty, config, bgzip, pipelined):
     """Fetch all annotations."""
 
     fetch = Fetch(config, download_mim2gene=download_mim2gene)
 
-    for line in fetch.annotate(lines=infile, leave_na=leave_na, remove_non_genes=remove_non_genes, info=info, error=error, warn=warn, report_empty=report_empty):
+    lines = fetch.annotate(lines=infile, leave_na=leave_na, remove_non_genes=remove_non_genes, info=info, error=error, warn=warn, report_empty=report_empty, pipelined=pipelined)
+    if bgzip:
+        if outfile.name == '-':
+            raise click.BadParameter('--bgzip needs a file to write to', param_hint='OUTFILE')
+        write_indexed(lines, outfile.name)
+        return
+
+    for line in lines:
         outfile.write(line + '\n')
 
 @run.command()
@@ -71,12 +93,41 @@ def mans(infile, outfile, warn, error, info, report_empty, config):
         outfile.write(line + '\n')
 
 @run.command()
-@click.argument('genelist', nargs=1, type=click.Path(exists=True))
-def validate(genelist):
-    """Validate a genelist. Will print out messages as to what is wrong."""
+@click.argument('genelists', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--jobs', '-j', default=multiprocessing.cpu_count(), show_default=True,
+              help='Nr of gene lists to validate in parallel.')
+@click.option('--split', is_flag=True, default=False, show_default=True,
+              help='Split each gene list in chunks that are validated in parallel. '
+                   'For very large gene lists.')
+@click.option('--overlaps', is_flag=True, default=False, show_default=True,
+              help='Also report genes that overlap on the same chromosome.')
+@click.option('--report', type=click.File('w'),
+              help='Write a JSON report of all messages to this file.')
+def validate(genelists, jobs, split, overlaps, report):
+    """Validate gene lists. Will print out messages as to what is wrong.
+    GENELISTS can also be directories, all *.txt files below them are validated.
+    Exits with 1 if any gene list has messages.
+    """
+
+    genelists = expand_genelists(genelists)
+    several = len(genelists) > 1
 
-    sanity = Sanity()
-    sanity.check(genelist)
+    results = []
+    for result in validate_lists(genelists, jobs=jobs, split=split,
+                                 check_overlaps=overlaps):
+        for message in result['messages']:
+            line = '#{}: {}'.format(message['line_nr'], message['message'])
+            print('{}: {}'.format(result['genelist'], line) if several else line)
+        if result['error']:
+            click.echo('{}: {}'.format(result['genelist'], result['error']), err=True)
+        results.append(result)
+
+    exit_code = max([result['exit_code'] for result in results] + [0])
+    if report:
+        json.dump({'exit_code': exit_code, 'genelists': results}, report, indent=2)
+        report.write('\n')
+
+    sys.exit(exit_code)
 
 @run.command()
 @click.argument('genelist', nargs=1, type=click.Path(exists=True))
@@ -88,15 +139,142 @@ def panels(genelist):
 @run.command()
 @click.argument('infiles', nargs=-1, required=True, type=click.File('r'))
 @click.option('--database', '-d', multiple=True, help='only take HGNC_symbols from this database.')
-def merge(infiles, database):
+@click.option('--sort', is_flag=True, default=False, show_default=True,
+              help='Sort on chromosome, start and HGNC_symbol. Streams the merge with bounded memory, '
+                   'genes are only merged when their coordinates match as well.')
+@click.option('--max-lines', default=100000, show_default=True,
+              help='The maximum nr of lines to sort in memory before spilling to disk.')
+@click.option('--bgzip', type=click.Path(dir_okay=False),
+              help='Write to this file instead, sorted on contig and start, block compressed, '
+                   'with an index in BGZIP.gli.json. Adds the Gene_start and Gene_stop columns.')
+def merge(infiles, database, sort, max_lines, bgzip):
     """ Merge gene lists. Will only output HGNC_symbol, EnsEMBL_gene_id and Database columns.
 
     Args:
         infiles: paths to gene lists.
     """
-    for line in merge_panels(infiles, database):
+    coordinates = bool(bgzip) # the index needs them
+    if sort:
+        lines = merge_panels_sorted(infiles, database, max_lines=max_lines, coordinates=coordinates)
+    else:
+        lines = merge_panels(infiles, database, coordinates=coordinates)
+
+    if bgzip:
+        write_indexed(lines, bgzip, max_lines=max_lines)
+        return
+
+    for line in lines:
         print(line)
 
+@run.command()
+@click.argument('base_dir', nargs=1, type=click.Path(exists=True, file_okay=False))
+@click.option('--db', type=click.Path(dir_okay=False),
+              help='Path to the index. Defaults to .genelist-index.sqlite in BASE_DIR.')
+def index(base_dir, db):
+    """Index the genes and panels of all gene lists in BASE_DIR/*/cust*txt.
+    Only gene lists that changed since the last run are read.
+    """
+    with GeneIndex(base_dir, db) as gene_index:
+        counts = gene_index.update()
+    print('{indexed} indexed, {unchanged} unchanged, {removed} removed'.format(**counts))
+
+@run.group()
+@click.argument('base_dir', nargs=1, type=click.Path(exists=True, file_okay=False))
+@click.option('--db', type=click.Path(dir_okay=False, exists=True),
+              help='Path to the index. Defaults to .genelist-index.sqlite in BASE_DIR.')
+@click.pass_context
+def query(ctx, base_dir, db):
+    """Query the index of BASE_DIR, see genelist index."""
+    if not os.path.exists(db or os.path.join(base_dir, INDEX_FILE)):
+        raise click.UsageError('No index of {}, run genelist index first'.format(base_dir))
+    ctx.obj = GeneIndex(base_dir, db)
+    ctx.call_on_close(ctx.obj.close)
+
+def print_genes(genes):
+    """Prints the genes of a query as a tab separated table."""
+    columns = ['customer', 'name', 'panel', 'version', 'hgnc_symbol', 'ensembl_gene_id', 'line_nr']
+    print('#' + '\t'.join(columns))
+    for gene in genes:
+        print('\t'.join(str(gene[column]) if gene[column] is not None else '' for column in columns))
+
+@query.command('gene')
+@click.argument('hgnc_symbol', nargs=1)
+@click.pass_obj
+def query_gene(gene_index, hgnc_symbol):
+    """Lists and panels that contain HGNC_SYMBOL."""
+    print_genes(gene_index.gene(hgnc_symbol))
+
+@query.command('panel')
+@click.argument('panel', nargs=1)
+@click.pass_obj
+def query_panel(gene_index, panel):
+    """Genes of PANEL across all customers and lists."""
+    print_genes(gene_index.panel(panel))
+
+@query.command('list')
+@click.argument('name', nargs=1)
+@click.option('--customer', help='Only the gene list of this customer, e.g. cust000.')
+@click.pass_obj
+def query_list(gene_index, name, customer):
+    """Genes of gene list NAME, e.g. CMMS."""
+    print_genes(gene_index.genelist(name, customer))
+
+@run.command()
+@click.argument('genelists', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--expression', '-e', multiple=True, required=True,
+              help='[NAME=]EXPRESSION on LIST or LIST:PANEL operands with | (union), & (intersection), '
+                   '- (difference) and parentheses, e.g. "CMMS:EP - FullList:EP". '
+                   'LIST is the name of the list, e.g. CMMS for cust000-CMMS.txt, or its path.')
+@click.option('--format', 'output_format', type=click.Choice(['yaml', 'tsv']), default='yaml', show_default=True,
+              help='YAML as faulty_gl.py or a table of the genes and the operands they are in.')
+def setop(genelists, expression, output_format):
+    """Union, intersection and difference of the panels of GENELISTS.
+    Each gene list is read once for all expressions.
+    """
+    try:
+        panel_sets, report = setop_report(genelists, expression)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--expression')
+
+    if output_format == 'yaml':
+        print(yaml.dump(dict(report), default_flow_style=False))
+        return
+
+    print('#Name\tHGNC_symbol\tOperands')
+    for (name, entry), current in zip(report.items(), expression):
+        operands = parse_expression(current)[2]
+        for hgnc_symbol in entry['genes']:
+            print('\t'.join([name, hgnc_symbol, ','.join(panel_sets.members(hgnc_symbol, operands))]))
+
+@run.command()
+@click.argument('infile', nargs=1, type=click.File('r'))
+@click.argument('outfile', nargs=1, type=click.File('wb'))
+@click.option('--format', 'output_format', type=click.Choice(['columnar']), default='columnar', show_default=True,
+              help='columnar: dictionary encoded string columns and integer coordinates, '
+                   'load it with genelist.api.readcolumnar.')
+def export(infile, outfile, output_format):
+    """Export an annotated gene list for downstream loaders."""
+    write_columnar(infile, outfile)
+
+@run.command()
+@click.argument('genelist', nargs=1, type=click.File('r'))
+@click.argument('infile', nargs=1, type=click.File('r'))
+@click.option('--format', 'file_format', type=click.Choice(['vcf', 'bed']),
+              help='Format of INFILE. Defaults to the extension of INFILE.')
+@click.option('--all', 'report_all', is_flag=True, default=False, show_default=True,
+              help='Also print the records that overlap no gene.')
+@click.option('--batch-size', default=100000, show_default=True,
+              help='Nr of records to look up at once.')
+def overlap(genelist, infile, file_format, report_all, batch_size):
+    """Print the genes and panels of GENELIST that each record of a VCF or BED file overlaps."""
+    if file_format is None:
+        file_format = 'bed' if infile.name.endswith('.bed') else 'vcf'
+    try:
+        for line in overlap_records(genelist, infile, file_format, batch_size=batch_size, report_all=report_all):
+            print(line)
+    except ImportError as e:
+        raise click.ClickException(str(e))
+
 def setup_logging(level='INFO'):
     """Setup the loggin for this package
 
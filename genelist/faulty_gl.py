@@ -5,7 +5,7 @@ import os
 import sys
 import yaml
 
-from genelist import api
+from genelist.modules.setop import PanelSets
 from genelist.utils import git
 
 def get_customer_name(target_list):
@@ -27,30 +27,20 @@ def get_display_name(target_list, target_panel):
 
 
 def main(cml, target_list, target_panel):
-    comments, cml_lines = api.readlist(open(cml, 'r'))
-    comments, target_lines = api.readlist(open(target_list, 'r'))
+    panel_sets = PanelSets()
+    panel_sets.add(cml)
+    panel_sets.add(target_list)
 
-    cml_hgnc_symbols = set()
-    for line in cml_lines:
-        panels = line['Clinical_db_gene_annotation'].split(',')
-        if target_panel in panels:
-            cml_hgnc_symbols.update({ line['HGNC_symbol'] })
-
-    target_hgnc_symbols = set()
-    for line in target_lines:
-        panels = line['Clinical_db_gene_annotation'].split(',')
-        if target_panel in panels:
-            target_hgnc_symbols.update({ line['HGNC_symbol'] })
-
-    missing_hgnc_symbols = target_hgnc_symbols - cml_hgnc_symbols
+    missing = panel_sets.operand(target_list + ':' + target_panel) & ~panel_sets.operand(cml + ':' + target_panel)
 
+    git_metadata = git.GitMetadata()
     output = {
         target_panel: {
             'display': get_display_name(target_list, target_panel),
-            'version': git.getgittag(target_list),
-            'date': git.getgitlastmoddate(target_list),
+            'version': git_metadata.head_tag(target_list),
+            'date': git_metadata.lastmoddate(target_list),
             'customer': get_customer_name(target_list),
-            'genes': list(missing_hgnc_symbols)
+            'genes': panel_sets.to_genes(missing)
         }
     }
 
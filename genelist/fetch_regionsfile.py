@@ -6,11 +6,23 @@ import os
 import sys
 import re
 import argparse
+import shutil
+import tempfile
+import multiprocessing
+from functools import partial
 from time import sleep, strftime
+try:
+    from time import monotonic
+except ImportError: # python 2
+    from time import time as monotonic
 
-from .omim import OMIM
-from .ensembl import Ensembl
-from .git import getgittag
+from .services.omim import OMIM
+from .services.ensembl import Ensembl
+from .utils.git import getgittag
+
+CHROMOSOMES = [str(chromosome) for chromosome in range(1, 23)] + ['X', 'Y', 'MT'] # karyotype order
+
+OMIM_INTERVAL = 0.25 # wait for 250ms between OMIM calls as according to OMIM specs
 
 header = ['Chromosome', 'Gene_start', 'Gene_stop', 'Ensembl_gene_id', 'HGNC_symbol', 'Phenotypic_disease_model', 'OMIM_morbid', 'Ensembl_transcript_to_refseq_transcript', 'Gene_description']
 
@@ -31,34 +43,75 @@ def fill_line(row):
     line = [ str(row.get(column_header, '')) for column_header in header ]
     return '\t'.join(line)
 
-def query_ensembl(ensembl_gene_id=None):
-    """Queries EnsEMBL to get all genes with transcripts
+def query_ensembl(ensembl_gene_id=None, chromosome=None):
+    """Queries EnsEMBL to get all genes with transcripts. Genome-wide, the genes are streamed
+    from EnsEMBL one by one.
+
+    Args:
+        ensembl_gene_id (str, optional): only this gene.
+        chromosome (str, optional): only the genes on this chromosome.
 
     Yields:
         dict: with added ensembl information
     """
     with Ensembl() as ensembldb:
-        data = [ ensembldb.query_transcripts(ensembl_gene_id) ]
+        if ensembl_gene_id:
+            data = [ ensembldb.query_transcripts(ensembl_gene_id=ensembl_gene_id) ]
+            data = [ line for line in data if line ]
+        else:
+            data = ensembldb.stream_transcripts(chromosome)
+
         for line in data:
 
             if len(line['Gene_description']) > 0:
-                line['Gene_description'] = '%s:%s' % (line['HGNC_symbol'], line['Gene_description'])
+                line['Gene_description'] = '%s:%s' % (line.get('HGNC_symbol', ''), line['Gene_description'])
 
             yield line
 
-def query_omim(data):
+class Throttle(object):
+    """Spaces calls at least interval seconds apart, also across processes: pass it to the
+    workers when they start, e.g. with the initializer of multiprocessing.Pool.
+
+    Args:
+        interval (float): seconds between the starts of two calls.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = multiprocessing.Value('d', -interval) # monotonic time of the last call
+
+    def wait(self):
+        """Blocks until interval seconds passed since the last call of any process."""
+        with self.last.get_lock():
+            delay = self.last.value + self.interval - monotonic()
+            if delay > 0:
+                sleep(delay)
+            self.last.value = monotonic()
+
+omim_throttle = None # the Throttle shared by the workers of query_sharded
+
+def init_worker(throttle):
+    """Sets the OMIM throttle of a worker of query_sharded."""
+    global omim_throttle
+    omim_throttle = throttle
+
+def query_omim(data, throttle=None):
     """Queries OMIM to fill in the inheritance models
 
     Args:
         data (list of dicts): Inner dict represents a row in a gene list
+        throttle (Throttle, optional): paces the OMIM calls. Defaults to the one shared by the
+                                       workers of query_sharded, or one of this call.
 
     Yields:
         dict: with the added HGNC symbol prepended to the HGNC_symbol column.
     """
 
+    throttle = throttle or omim_throttle or Throttle(OMIM_INTERVAL)
     omim = OMIM(api_key='<fill in key>')
     for line in data:
         if 'HGNC_symbol' in line:
+            throttle.wait()
             entry = omim.gene(line['HGNC_symbol'])
 
             phenotypic_disease_model = omim.parse_phenotypic_disease_model(entry['phenotypes'])
@@ -70,16 +123,15 @@ def query_omim(data):
             if entry['mim_number'] != None:
                 line['OMIM_morbid'] = '%s:%s' % (line['HGNC_symbol'], entry['mim_number'])
 
-            sleep(0.25) # wait for 250ms as according to OMIM specs
         yield line
 
-def get_lines(transcripts, repodir):
-    """Generate the regions file, line by line, including header
+def get_header(repodir):
+    """Generate the header lines of the regions file
 
     Args:
-        transcripts (list): list of dicts. Dict keys are equal to the header keys.
+        repodir (str): the git repo where the research list will be stored.
 
-    Yield: all lines, including header, of the regions file
+    Yield: the ## and # header lines of the regions file
     """
 
     version = getgittag(repodir)
@@ -88,20 +140,81 @@ def get_lines(transcripts, repodir):
     # yield some headers
     yield '##Database=<ID=cust000-Research.txt,Version=%s,Date=%s,Acronym=Research,Complete_name=Research,Clinical_db_genome_build=GRCh37.p13' % (version, mod_date)
     yield '#' + '\t'.join(header)
+
+def get_lines(transcripts, repodir):
+    """Generate the regions file, line by line, including header
+
+    Args:
+        transcripts (list): list of dicts. Dict keys are equal to the header keys.
+
+    Yield: all lines, including header, of the regions file
+    """
+
+    for line in get_header(repodir):
+        yield line
     for transcript in transcripts:
         yield fill_line(transcript)
 
+def fetch_shard(chromosome, directory=None):
+    """Fetches the genes of one chromosome from EnsEMBL and OMIM and writes their lines to a
+    temporary file. Runs in a worker, with its own EnsEMBL connection and OMIM client. The
+    OMIM calls of all workers share one throttle, see init_worker.
+
+    Args:
+        chromosome (str): the chromosome of the shard.
+        directory (str, optional): where to write the temporary file, the default temporary
+                                   directory if not given.
+
+    Returns (str): the path to the temporary file
+    """
+    handle, path = tempfile.mkstemp(prefix='regions-%s-' % chromosome, suffix='.txt', dir=directory)
+    try:
+        with os.fdopen(handle, 'w') as shard:
+            for transcript in query_omim(query_ensembl(chromosome=chromosome)):
+                shard.write(fill_line(transcript) + '\n')
+    except:
+        os.remove(path)
+        raise
+    return path
+
+def query_sharded(chromosomes=CHROMOSOMES, jobs=4):
+    """Fetches the genes of each chromosome in parallel, see fetch_shard, and concatenates the
+    shards in karyotype order. A shard is yielded as soon as it and the shards before it are done.
+    The workers share one OMIM throttle, so together they stay within the rate OMIM allows.
+
+    Args:
+        chromosomes (list): the chromosomes, in the order to yield them.
+        jobs (int): nr of chromosomes to fetch at the same time.
+
+    Yield: the lines of all genes, without header
+    """
+    throttle = Throttle(OMIM_INTERVAL)
+    directory = tempfile.mkdtemp(prefix='regions-')
+    pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(throttle, ))
+    try:
+        for path in pool.imap(partial(fetch_shard, directory=directory), chromosomes):
+            with open(path) as shard:
+                for line in shard:
+                    yield line.rstrip('\n')
+            os.remove(path)
+        pool.close()
+    finally:
+        # stop the workers and clean up the shards that were not yielded
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
 def main(argv):
     parser = argparse.ArgumentParser(description='Queries EnsEMBL to retrieve all protein coding genes, their transcripts and RefSeqIDs. Outputs a research gene list.')
     parser.add_argument('repodir', default=None, help='The path to the git repo where the research list will be stored. Used to retrieve tag/version number')
+    parser.add_argument('--chromosome', action='append', help='Only the genes on this chromosome, can be repeated')
+    parser.add_argument('--jobs', '-j', type=int, default=4, help='Nr of chromosomes to fetch in parallel. Each opens its own EnsEMBL connection, the OMIM calls are paced together.')
     args = parser.parse_args(argv)
 
-    transcripts = \
-        query_omim(
-        query_ensembl()
-    )
+    for line in get_header(args.repodir):
+        print(line)
 
-    for line in get_lines(transcripts, args.repodir):
+    for line in query_sharded(args.chromosome or CHROMOSOMES, args.jobs):
         print(line)
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+""" Export gene lists to other formats """
+# encoding: utf-8
+
+from __future__ import print_function
+import sys
+import json
+import array
+import struct
+
+from ..api import readcolumns, array_typecode, COLUMNAR_MAGIC, COLUMNAR_VERSION
+
+INT_COLUMNS = ('Gene_start', 'Gene_stop')
+
+def to_ints(values):
+    """Returns (list): the values as int, None when one of them is not an int."""
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        return None
+
+def code_dtype(nr_values):
+    """Returns (str): the smallest unsigned little endian dtype that holds codes up to nr_values."""
+    for itemsize in (1, 2, 4):
+        if nr_values <= 1 << (8 * itemsize):
+            return '<u{}'.format(itemsize)
+    return '<u8'
+
+def write_columnar(lines, outfile):
+    """Writes a gene list in a columnar format, see api.ColumnarList.
+
+    The file starts with the magic, the format version and the length of a JSON header with the
+    comments, the nr of rows and the layout of the columns. The column data follows, each array
+    8 byte aligned and little endian, its dtype ('<u1', '<u2', '<u4', '<u8' or '<i8') in the
+    header. The coordinate columns are int64 arrays when all their values are integers. The other columns are dictionary encoded: the distinct values as a blob
+    of \\0 terminated UTF-8 strings and an array of codes, one per row.
+
+    Args:
+        lines (iterable): the lines of a gene list.
+        outfile (file): a file opened in binary mode.
+    """
+    comments, header, rows = readcolumns(lines, None)
+    rows = list(rows)
+    columns = list(zip(*rows)) if rows else [() for column in header]
+
+    chunks = []
+    offset = [0]
+    def add(data):
+        """Adds data to the data section, returns its offset."""
+        start = offset[0]
+        padding = -len(data) % 8
+        chunks.append(data + b'\0' * padding)
+        offset[0] += len(data) + padding
+        return start
+
+    def add_array(dtype, values):
+        values = array.array(array_typecode(dtype), values)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return add(values.tobytes())
+
+    meta_columns = []
+    for name, values in zip(header, columns):
+        ints = to_ints(values) if name in INT_COLUMNS else None
+        if ints is not None:
+            meta_columns.append({'name': name, 'type': 'int', 'dtype': '<i8',
+                                 'offset': add_array('<i8', ints)})
+            continue
+
+        codes = {} # value: code
+        for value in values:
+            codes.setdefault(value, len(codes))
+        blob = ''.join(value + '\0' for value in codes).encode('utf-8')
+        dtype = code_dtype(len(codes))
+        meta_columns.append({'name': name, 'type': 'str', 'dtype': dtype, 'nr_values': len(codes),
+                             'values_offset': add(blob), 'values_length': len(blob),
+                             'codes_offset': add_array(dtype, [codes[value] for value in values])})
+
+    meta = json.dumps({'comments': ['\t'.join(comment) for comment in comments],
+                       'nr_rows': len(rows), 'columns': meta_columns}).encode('utf-8')
+    preamble = struct.pack('<8sII', COLUMNAR_MAGIC, COLUMNAR_VERSION, len(meta)) + meta
+    outfile.write(preamble + b'\0' * (-len(preamble) % 8))
+    for chunk in chunks:
+        outfile.write(chunk)
@@ -7,16 +7,22 @@ import re
 import os
 import logging
 import copy
+import time
+import threading
 from io import StringIO
+from functools import partial
+from itertools import islice
+from collections import Counter
 
 import yaml
 
 from genelist import api
 from ..services.omim import OMIM
-from ..services.ensembl import Ensembl
+from ..services.ensembl import Ensembl, filter_candidates
 from ..services.genenames import Genenames
 from ..services.uniprot import Uniprot
 from ..services.mim2gene import Mim2gene
+from ..utils.pipeline import Pipeline
 
 def there(line, key):
     """ Checks if the key is in the line and has a value that doesn't resolve to False.
@@ -36,10 +42,69 @@ def there(line, key):
 
     return line[key]
 
+class LineContext(object):
+    """ An attribute of Fetch about the line at hand, with a value per thread, so the stages
+    of a pipelined Fetch.annotate each log about their own line. """
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return getattr(instance.line_context, self.name, self.default)
+
+    def __set__(self, instance, value):
+        setattr(instance.line_context, self.name, value)
+
+class ResolutionStats(object):
+    """Counts, per resolver, which query of the E! cascade resolved the lines, see
+    Fetch.resolve_ensembl, and how many queries and seconds that took."""
+
+    BRANCHES = ['E!+OMIM', 'E!+HGNC', 'OMIM', 'OMIM+HGNC', 'HGNC', None]
+
+    def __init__(self):
+        self.branches = Counter() # (resolver, branch): nr of lines
+        self.lines = Counter() # resolver: nr of lines
+        self.queries = Counter() # resolver: nr of queries
+        self.seconds = Counter() # resolver: seconds
+
+    def add(self, resolver, branch, queries, seconds):
+        """Counts one resolved line, branch is None when nothing was found."""
+        self.branches[(resolver, branch)] += 1
+        self.lines[resolver] += 1
+        self.queries[resolver] += queries
+        self.seconds[resolver] += seconds
+
+    def mean_seconds(self, resolver):
+        """Returns (float): the mean seconds per line of a resolver."""
+        return self.seconds[resolver] / self.lines[resolver] if self.lines[resolver] else 0.0
+
+    def report(self):
+        """Yields (str): per resolver a summary line, then a line per branch."""
+        for resolver in sorted(self.lines):
+            lines = self.lines[resolver]
+            yield '{}: {} lines, {:.2f} queries and {:.1f}ms per line'.\
+                  format(resolver, lines, float(self.queries[resolver]) / lines,
+                         1000 * self.mean_seconds(resolver))
+            for branch in self.BRANCHES:
+                count = self.branches[(resolver, branch)]
+                if count:
+                    yield '{}: {} {} ({:.0%})'.format(resolver, branch or 'not found', count, float(count) / lines)
+
 class Fetch(object):
 
     """Provide all annotation functionality in one class. """
 
+    ADAPTIVE_WARMUP = 20 # nr of lines to time each resolver before the adaptive resolver picks one
+    PIPELINE_QUEUE_SIZE = 16 # nr of lines in between two stages of a pipelined annotate
+
+    line_nr = LineContext('line_nr', 0)
+    current_hgnc_id = LineContext('current_hgnc_id', '')
+    current_line = LineContext('current_line', {})
+    original_line = LineContext('original_line', {})
+
     def __init__(self, config, download_mim2gene):
         self.header = ['Chromosome', 'Gene_start', 'Gene_stop', 'HGNC_symbol', 'Protein_name',
                        'Symptoms', 'Biochemistry', 'Imaging', 'Disease_trivial_name',
@@ -59,6 +124,7 @@ class Fetch(object):
                               'HGNC_RefSeq_NM', 'Uniprot_protein_name']
 
         self.config = yaml.load(config)
+        self.line_context = threading.local()
         self.logger = logging.getLogger(__name__)
         self.setup_logging(level='DEBUG')
 
@@ -70,9 +136,27 @@ class Fetch(object):
             host=self.config['ensembl']['host'],
             port=self.config['ensembl']['port'],
             user=self.config['ensembl']['user'],
-            db=self.config['ensembl']['db']
+            db=self.config['ensembl']['db'],
+            pool_size=self.config['ensembl'].get('pool_size', 1),
+            cache_path=self.config['ensembl'].get('cache_path')
         )
-        self.genenames = Genenames()
+        self.ensembl_resolver = self.config['ensembl'].get('resolver', 'cascade')
+        self.genenames = self.service(Genenames, 'AsyncGenenames')
+
+    def service(self, client, async_client, **kwargs):
+        """ Returns the client of a service. With client: asyncio in the http section of the
+        config, the blocking facade of its asyncio variant, so all lookups share one event loop.
+
+        Args:
+            client (class): e.g. Genenames.
+            async_client (str): e.g. 'AsyncGenenames', imported from services.aio only when
+                asked for, as it needs python 3.
+            kwargs: passed on to the client.
+        """
+        if (self.config.get('http') or {}).get('client') == 'asyncio':
+            from ..services import aio
+            return aio.Blocking(getattr(aio, async_client)(**kwargs))
+        return client(**kwargs)
 
     def reset(self):
         """ Reset state for a next genelist to annotate """
@@ -89,6 +173,7 @@ class Fetch(object):
         self.report_empty = False
         self.remove_non_genes = False
         self.leave_na = False
+        self.resolution_stats = ResolutionStats()
 
         # reset the StringIO
         self.log_buffer.truncate(0)
@@ -226,6 +311,14 @@ class Fetch(object):
 
             yield line
 
+    def get_line_context(self):
+        """ Returns (tuple): the line nr, HGNC symbol, line and original line of this thread """
+        return self.line_nr, self.current_hgnc_id, self.current_line, self.original_line
+
+    def set_line_context(self, context):
+        """ Sets the context of get_line_context in this thread """
+        self.line_nr, self.current_hgnc_id, self.current_line, self.original_line = context
+
     def remove_hgnc_prefix(self, line):
         """ Removes the prefixed HGNC symbol from all fields
 
@@ -482,6 +575,11 @@ class Fetch(object):
         - HGNC
         All queries include the chromosome.
 
+        With the resolver 'combined' in the ensembl section of the config, all candidate genes
+        of a line are fetched in one query and the cascade is answered from those,
+        see Ensembl.query_candidates. The resolver 'adaptive' times both on the first lines and
+        then keeps to the fastest, see pick_resolver. Both resolvers give the same results.
+
         Method will warn when any value is overwritten.
 
         Args:
@@ -494,38 +592,27 @@ class Fetch(object):
         func_name = sys._getframe().f_code.co_name
         for line in data:
             omim_morbid = there(line, 'OMIM_morbid')
-            hgnc_symbol = there(line, 'HGNC_symbol')
-            chromosome = there(line, 'Chromosome')
-            ensembl_gene_id = there(line, 'Ensembl_gene_id')
-
-            ensembl_lines = []
-
-            if ensembl_gene_id and omim_morbid:
-                ensembl_lines = self.ensembldb.query(ensembl_gene_id=ensembl_gene_id, omim_morbid=omim_morbid, chromosome=chromosome)
-                if ensembl_lines:
-                    self.info('[{}] Found E! with {} {} {}'.format(func_name, ensembl_gene_id, omim_morbid, chromosome))
-
-            if not ensembl_lines:
-                if ensembl_gene_id and hgnc_symbol:
-                    ensembl_lines = self.ensembldb.query(ensembl_gene_id=ensembl_gene_id, hgnc_symbol=hgnc_symbol, chromosome=chromosome)
-                    if ensembl_lines:
-                        self.info('[{}] Found E! with {} {} {}'.format(func_name, ensembl_gene_id, hgnc_symbol, chromosome))
-
-            if not ensembl_lines and omim_morbid:
-                ensembl_lines = self.ensembldb.query(omim_morbid=omim_morbid, chromosome=chromosome)
-                if ensembl_lines:
-                    self.info('[{}] Found E! with {}'.format(func_name, omim_morbid, chromosome))
-
-                # multiple hits? WTF. Check with the hgnc symbol and omim morbid
-                if len(ensembl_lines) > 1 and hgnc_symbol:
-                    ensembl_lines = self.ensembldb.query(hgnc_symbol=hgnc_symbol, omim_morbid=omim_morbid, chromosome=chromosome)
-                    self.info('[{}] Found E! with {} {} {}'.format(func_name, omim_morbid, hgnc_symbol, chromosome))
-
-            if not ensembl_lines and hgnc_symbol:
-                # then with the HGNC symbol only
-                ensembl_lines = self.ensembldb.query(hgnc_symbol=hgnc_symbol, chromosome=chromosome)
-                if ensembl_lines:
-                    self.info('[{}] Found E! with {}'.format(func_name, hgnc_symbol))
+            resolver = self.pick_resolver()
+
+            queries = []
+            def count(query):
+                def counted(**identifiers):
+                    queries.append(identifiers)
+                    return query(**identifiers)
+                return counted
+
+            start = time.time()
+            if resolver == 'combined':
+                candidates = count(self.ensembldb.query_candidates)(
+                    omim_morbid=omim_morbid,
+                    ensembl_gene_id=there(line, 'Ensembl_gene_id'),
+                    hgnc_symbol=there(line, 'HGNC_symbol'),
+                    chromosome=there(line, 'Chromosome')
+                )
+                ensembl_lines, branch = self.resolve_ensembl(line, partial(filter_candidates, candidates))
+            else:
+                ensembl_lines, branch = self.resolve_ensembl(line, count(self.ensembldb.query))
+            self.resolution_stats.add(resolver, branch, len(queries), time.time() - start)
 
             if ensembl_lines:
                 if len(ensembl_lines) > 1:
@@ -538,6 +625,75 @@ class Fetch(object):
                 self.warn('[{}] {}: No E! entries!'.format(func_name, omim_morbid))
                 yield line
 
+    def pick_resolver(self):
+        """ Picks the resolver of fill_from_ensembl for the next line.
+        The adaptive resolver alternates between the cascade and the combined query for the
+        first ADAPTIVE_WARMUP lines of each, then picks the one with the lowest mean time per line.
+
+        Returns (str): 'cascade' or 'combined'
+        """
+        if self.ensembl_resolver != 'adaptive':
+            return self.ensembl_resolver
+
+        stats = self.resolution_stats
+        if min(stats.lines['cascade'], stats.lines['combined']) < self.ADAPTIVE_WARMUP:
+            return 'cascade' if stats.lines['cascade'] <= stats.lines['combined'] else 'combined'
+        return min(('cascade', 'combined'), key=stats.mean_seconds)
+
+    def resolve_ensembl(self, line, query):
+        """ Runs the cascade of fill_from_ensembl for one line.
+
+        Args:
+            line (dict): a row in a gene list.
+            query (callable): takes the identifiers of Ensembl.query as keywords and
+                              returns the E! entries, as Ensembl.query.
+
+        Returns (tuple): (the E! entries of the first query of the cascade with a hit, the branch
+                         of that query, see ResolutionStats.BRANCHES)
+        """
+        func_name = 'fill_from_ensembl'
+        omim_morbid = there(line, 'OMIM_morbid')
+        hgnc_symbol = there(line, 'HGNC_symbol')
+        chromosome = there(line, 'Chromosome')
+        ensembl_gene_id = there(line, 'Ensembl_gene_id')
+
+        ensembl_lines = []
+        branch = None
+
+        if ensembl_gene_id and omim_morbid:
+            ensembl_lines = query(ensembl_gene_id=ensembl_gene_id, omim_morbid=omim_morbid, chromosome=chromosome)
+            if ensembl_lines:
+                self.info('[{}] Found E! with {} {} {}'.format(func_name, ensembl_gene_id, omim_morbid, chromosome))
+                branch = 'E!+OMIM'
+
+        if not ensembl_lines:
+            if ensembl_gene_id and hgnc_symbol:
+                ensembl_lines = query(ensembl_gene_id=ensembl_gene_id, hgnc_symbol=hgnc_symbol, chromosome=chromosome)
+                if ensembl_lines:
+                    self.info('[{}] Found E! with {} {} {}'.format(func_name, ensembl_gene_id, hgnc_symbol, chromosome))
+                    branch = 'E!+HGNC'
+
+        if not ensembl_lines and omim_morbid:
+            ensembl_lines = query(omim_morbid=omim_morbid, chromosome=chromosome)
+            if ensembl_lines:
+                self.info('[{}] Found E! with {}'.format(func_name, omim_morbid, chromosome))
+                branch = 'OMIM'
+
+            # multiple hits? WTF. Check with the hgnc symbol and omim morbid
+            if len(ensembl_lines) > 1 and hgnc_symbol:
+                ensembl_lines = query(hgnc_symbol=hgnc_symbol, omim_morbid=omim_morbid, chromosome=chromosome)
+                self.info('[{}] Found E! with {} {} {}'.format(func_name, omim_morbid, hgnc_symbol, chromosome))
+                branch = 'OMIM+HGNC'
+
+        if not ensembl_lines and hgnc_symbol:
+            # then with the HGNC symbol only
+            ensembl_lines = query(hgnc_symbol=hgnc_symbol, chromosome=chromosome)
+            if ensembl_lines:
+                self.info('[{}] Found E! with {}'.format(func_name, hgnc_symbol))
+                branch = 'HGNC'
+
+        return ensembl_lines, branch if ensembl_lines else None
+
     def query_transcripts(self, data):
         """Queries EnsEMBL for all transcripts.
 
@@ -578,30 +734,79 @@ class Fetch(object):
     def add_uniprot(self, data):
         """ Add the UniProt ID and UniProt protein name based on the official HGNC symbol.
 
+        The protein names of batch_size lines are fetched in one search, batch_size is read from
+        the uniprot section of the config, 100 by default. 0 fetches a full entry per UniProt ID.
+        With reviewed_only in that section, only the first reviewed (Swiss-Prot) UniProt ID of
+        a gene is kept.
+
         Args:
                 data (list of dicts): Inner dict represents a row in a gene list
 
         Yields:
                 dict: now with the UniProt information.
         """
-        uniprot = Uniprot()
-        for line in data:
-            uniprot_ids = self.genenames.uniprot(line['HGNC_symbol'])
-            uniprot_ids = uniprot_ids if uniprot_ids != None else ''
-            uniprot_ids_joined = self.delimiter.join(uniprot_ids)
-            uniprot_description = ''
-            if len(uniprot_ids) > 1:
-                self.info('Multiple UniProt IDs: ' + uniprot_ids_joined)
-            for uniprot_id in uniprot_ids:
-                uniprot_description = uniprot.fetch_description(uniprot_id)
-
-            yield self.merge_line(
-                {
-                    'Uniprot_protein_name': uniprot_description,
-                    'UniProt_id': uniprot_ids_joined
-                },
-                line
-            )
+        uniprot = self.service(Uniprot, 'AsyncUniprot')
+        config = self.config.get('uniprot') or {}
+        batch_size = config.get('batch_size', 100)
+        reviewed_only = config.get('reviewed_only', False)
+
+        if not batch_size:
+            for line in data:
+                uniprot_ids = self.genenames.uniprot(line['HGNC_symbol'])
+                uniprot_ids = uniprot_ids if uniprot_ids != None else ''
+                uniprot_ids_joined = self.delimiter.join(uniprot_ids)
+                uniprot_description = ''
+                if len(uniprot_ids) > 1:
+                    self.info('Multiple UniProt IDs: ' + uniprot_ids_joined)
+                for uniprot_id in uniprot_ids:
+                    uniprot_description = uniprot.fetch_description(uniprot_id)
+
+                yield self.merge_line(
+                    {
+                        'Uniprot_protein_name': uniprot_description,
+                        'UniProt_id': uniprot_ids_joined
+                    },
+                    line
+                )
+            return
+
+        data = iter(data)
+        while True:
+            # read ahead a batch, with the context of each line
+            batch = []
+            for line in islice(data, batch_size):
+                uniprot_ids = self.genenames.uniprot(line['HGNC_symbol'])
+                batch.append((self.get_line_context(), line, uniprot_ids or []))
+            if not batch:
+                return
+
+            entries = uniprot.fetch_entries([uniprot_id for context, line, uniprot_ids in batch
+                                             for uniprot_id in uniprot_ids], reviewed_only)
+
+            for context, line, uniprot_ids in batch:
+                self.set_line_context(context)
+                # the name of the last ID, as one entry per ID does
+                entry = entries.get(uniprot_ids[-1]) if uniprot_ids else None
+                if reviewed_only:
+                    # the entry of the first reviewed ID, by its primary accession
+                    reviewed = [entries[uniprot_id] for uniprot_id in uniprot_ids
+                                if uniprot_id in entries and entries[uniprot_id]['reviewed']]
+                    entry = reviewed[0] if reviewed else None
+                    uniprot_ids = [entry['accession']] if entry else []
+                uniprot_ids_joined = self.delimiter.join(uniprot_ids)
+                uniprot_description = ''
+                if len(uniprot_ids) > 1:
+                    self.info('Multiple UniProt IDs: ' + uniprot_ids_joined)
+                if uniprot_ids:
+                    uniprot_description = entry['description'] if entry else None
+
+                yield self.merge_line(
+                    {
+                        'Uniprot_protein_name': uniprot_description,
+                        'UniProt_id': uniprot_ids_joined
+                    },
+                    line
+                )
 
     def add_refseq(self, data):
         """ Add the RefSeq ID based on the official HGNC symbol.
@@ -626,7 +831,7 @@ class Fetch(object):
         Yields:
                 dict: with the added HGNC symbol prepended to the HGNC_symbol column.
         """
-        omim = OMIM(api_key=self.config['OMIM']['api_key'])
+        omim = self.service(OMIM, 'AsyncOMIM', api_key=self.config['OMIM']['api_key'])
         for line in data:
             omim_morbid = there(line, 'OMIM_morbid')
             if omim_morbid:
@@ -769,8 +974,13 @@ class Fetch(object):
         return root_logger
 
     def annotate(self, lines, leave_na=False, warn=False, error=False, info=False,
-                 report_empty=False, remove_non_genes=False):
-        """ Annotate a gene list """
+                 report_empty=False, remove_non_genes=False, pipelined=False):
+        """ Annotate a gene list
+
+        With pipelined, the stages that query services each run in their own thread, connected
+        by queues of PIPELINE_QUEUE_SIZE lines, see Pipeline. The lines keep their order, but
+        the log messages of different lines can interleave.
+        """
 
         self.reset()
 
@@ -811,31 +1021,36 @@ class Fetch(object):
         # pick one HGNC symbol
         hgnc_data = self.pick_hgnc_symbol(reduced_data)
 
-        # Get OMIM morbid number
-        # Get E!
-        # all from mim2gene, the magical file
-        mim2gene_data = self.fill_from_mim2gene(hgnc_data)
-
-        # fill from genenames.org
-        genenames_data = self.fill_from_genenames(mim2gene_data)
-
-        # fill in the inheritance models, chromosome
-        omim_data = self.query_omim(genenames_data)
-
-        # fill in info from ensembl
-        ensembl_data = self.fill_from_ensembl(omim_data)
-
-        # check identifiers
-        identifiers_data = self.check_identifiers(ensembl_data)
-
-        # aggregate transcripts
-        transcript_data = self.query_transcripts(identifiers_data)
-
-        ## add uniprot
-        uniprot_data = self.add_uniprot(transcript_data)
-
-        ## add refseq
-        refseq_data = self.add_refseq(uniprot_data)
+        # the stages that query services
+        stages = [
+            # Get OMIM morbid number
+            # Get E!
+            # all from mim2gene, the magical file
+            self.fill_from_mim2gene,
+            # fill from genenames.org
+            self.fill_from_genenames,
+            # fill in the inheritance models, chromosome
+            self.query_omim,
+            # fill in info from ensembl
+            self.fill_from_ensembl,
+            # check identifiers
+            self.check_identifiers,
+            # aggregate transcripts
+            self.query_transcripts,
+            ## add uniprot
+            self.add_uniprot,
+            ## add refseq
+            self.add_refseq,
+        ]
+        if pipelined:
+            # each stage in its own thread, working on its own line
+            pipeline = Pipeline(stages, maxsize=self.PIPELINE_QUEUE_SIZE,
+                                get_context=self.get_line_context, set_context=self.set_line_context)
+            refseq_data = pipeline.run(hgnc_data)
+        else:
+            refseq_data = hgnc_data
+            for stage in stages:
+                refseq_data = stage(refseq_data)
 
         ## do some replacements
         redpen_data = self.redpen2symbol(refseq_data)
@@ -861,6 +1076,10 @@ class Fetch(object):
         for line in final_data:
             print(self.format_line(line))
             print_data.append(line)
+        self.info('[annotate] E! query cache: {hits} hits ({disk_hits} from disk), {misses} misses, {hit_rate:.0%}'.\
+                  format(**self.ensembldb.cache.stats()))
+        for line in self.resolution_stats.report():
+            self.info('[annotate] E! resolution ' + line)
 
         # print the errors and warnings
         if verbose:
@@ -0,0 +1,175 @@
+""" Index of the genes and panels of all gene lists of a repository """
+# encoding: utf-8
+
+from __future__ import print_function
+import os
+import re
+import glob
+import sqlite3
+
+from ..utils.git import GitMetadata
+
+INDEX_FILE = '.genelist-index.sqlite'
+SCHEMA_VERSION = 2 # 2: mtime in seconds, as st_mtime
+
+SCHEMA = """
+CREATE TABLE lists (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL, -- relative to the base dir
+    customer TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE genes (
+    list_id INTEGER NOT NULL REFERENCES lists(id) ON DELETE CASCADE,
+    hgnc_symbol TEXT NOT NULL,
+    ensembl_gene_id TEXT NOT NULL,
+    panel TEXT NOT NULL,
+    line_nr INTEGER NOT NULL
+);
+CREATE INDEX genes_hgnc_symbol ON genes(hgnc_symbol);
+CREATE INDEX genes_panel ON genes(panel);
+CREATE INDEX genes_list_id ON genes(list_id);
+"""
+
+def read_genes(genelist):
+    """Reads the genes of a gene list with their panels.
+
+    Args:
+        genelist (str): path to the gene list.
+
+    Yields (tuple): (HGNC_symbol, Ensembl_gene_id, panel, line_nr) for each panel of each gene.
+                    A gene without panels is yielded once with an empty panel.
+    """
+    header = None
+    with open(genelist) as f:
+        for line_nr, line in enumerate(f, 1):
+            if line.startswith('##'):
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            if header is None:
+                fields[0] = fields[0].lstrip('#')
+                header = dict((column, i) for i, column in enumerate(fields))
+                continue
+            if line.startswith('#') or not line.strip():
+                continue
+
+            row = dict((column, fields[i].strip()) for column, i in header.items() if i < len(fields))
+            hgnc_symbol = row.get('HGNC_symbol', '')
+            if not hgnc_symbol:
+                continue
+            ensembl_gene_id = row.get('Ensembl_gene_id', '')
+            panels = [panel.strip() for panel in row.get('Clinical_db_gene_annotation', '').split(',')]
+            for panel in sorted(set(panel for panel in panels if panel)) or ['']:
+                yield hgnc_symbol, ensembl_gene_id, panel, line_nr
+
+def get_list_name(genelist):
+    """Returns (tuple): (customer, name) of a gene list, e.g. ('cust000', 'CMMS')
+    for cust000/cust000-CMMS.txt."""
+    match = re.search(r'(cust...)-(.*).txt', os.path.basename(genelist))
+    if match:
+        return match.group(1), match.group(2)
+    return os.path.basename(os.path.dirname(genelist)), os.path.splitext(os.path.basename(genelist))[0]
+
+class GeneIndex(object):
+    """An SQLite index of gene -> (customer, list, panel, version, line) for all gene lists
+    of a repository. Updating it only reads the gene lists that changed since the last update.
+
+    Args:
+        base_dir (str): full path to the basedir of the repo's, as Acronyms.
+        db_file (str, optional): path to the index, defaults to .genelist-index.sqlite in base_dir.
+    """
+
+    def __init__(self, base_dir, db_file=None):
+        self.base_dir = base_dir
+        self.db_file = db_file or os.path.join(base_dir, INDEX_FILE)
+        self.db = sqlite3.connect(self.db_file)
+        self.db.execute('PRAGMA foreign_keys = ON')
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.executescript('DROP TABLE IF EXISTS genes; DROP TABLE IF EXISTS lists;' + SCHEMA +
+                                  'PRAGMA user_version = {};'.format(SCHEMA_VERSION))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, git_metadata=None):
+        """Indexes new and changed gene lists, drops removed gene lists and refreshes the
+        versions of all gene lists.
+
+        Args:
+            git_metadata (GitMetadata, optional): share the git versions with other runs.
+
+        Returns (dict): number of 'indexed', 'unchanged' and 'removed' gene lists.
+        """
+        genelists = sorted(glob.glob(self.base_dir + '/*/cust*txt'))
+        if git_metadata is None:
+            git_metadata = GitMetadata()
+        git_metadata.prefetch(genelists)
+
+        indexed = dict((path, (list_id, mtime, size)) for list_id, path, mtime, size
+                       in self.db.execute('SELECT id, path, mtime, size FROM lists'))
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0}
+
+        with self.db:
+            for genelist in genelists:
+                path = os.path.relpath(genelist, self.base_dir)
+                stat = os.stat(genelist)
+                version = git_metadata.tag(genelist)
+
+                list_id, mtime, size = indexed.pop(path, (None, None, None))
+                if (mtime, size) == (stat.st_mtime, stat.st_size):
+                    self.db.execute('UPDATE lists SET version = ? WHERE id = ?', (version, list_id))
+                    counts['unchanged'] += 1
+                    continue
+
+                if list_id is not None:
+                    self.db.execute('DELETE FROM lists WHERE id = ?', (list_id, ))
+                customer, name = get_list_name(genelist)
+                list_id = self.db.execute(
+                    'INSERT INTO lists (path, customer, name, version, mtime, size) VALUES (?, ?, ?, ?, ?, ?)',
+                    (path, customer, name, version, stat.st_mtime, stat.st_size)).lastrowid
+                self.db.executemany(
+                    'INSERT INTO genes (list_id, hgnc_symbol, ensembl_gene_id, panel, line_nr) VALUES (?, ?, ?, ?, ?)',
+                    ((list_id, ) + gene for gene in read_genes(genelist)))
+                counts['indexed'] += 1
+
+            for list_id, mtime, size in indexed.values():
+                self.db.execute('DELETE FROM lists WHERE id = ?', (list_id, ))
+                counts['removed'] += 1
+
+        return counts
+
+    def query(self, where, args):
+        """Yields (dict): the indexed genes matching the where clause, ordered on customer,
+        list and line."""
+        cursor = self.db.execute(
+            'SELECT customer, name, panel, version, hgnc_symbol, ensembl_gene_id, line_nr '
+            'FROM genes JOIN lists ON lists.id = genes.list_id WHERE ' + where +
+            ' ORDER BY customer, name, line_nr, panel', args)
+        columns = [column[0] for column in cursor.description]
+        for row in cursor:
+            yield dict(zip(columns, row))
+
+    def gene(self, hgnc_symbol):
+        """Yields (dict): the lists and panels containing a gene."""
+        return self.query('hgnc_symbol = ?', (hgnc_symbol, ))
+
+    def panel(self, panel):
+        """Yields (dict): the genes of a panel across all customers and lists."""
+        return self.query('panel = ?', (panel, ))
+
+    def genelist(self, name, customer=None):
+        """Yields (dict): the genes of a gene list, of all customers unless given."""
+        if customer:
+            return self.query('name = ? AND customer = ?', (name, customer))
+        return self.query('name = ?', (name, ))
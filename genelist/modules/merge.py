@@ -4,108 +4,218 @@
 from __future__ import print_function
 import os
 import datetime
+from itertools import groupby
 from collections import OrderedDict
 
-from ..utils.git import getgitlastmoddate, getgittag
+from ..api import readcolumns
+from ..utils.git import GitMetadata
 from ..utils.acronyms import Acronyms
-
-def merge_panels(infiles, databases):
-    """ Merge the panels of gene lists into one list. """
-
-    acronyms = Acronyms(os.path.dirname(os.path.dirname(os.path.realpath(infiles[0].name))))
-
-    versions = {} # Filename => { Database => { 'Version': Version, 'Date': Date } }
-    data = OrderedDict() # HGNC_symbol => {'HGNC_symbol' => '', 'EnsEMBLid' => [], 'Databases' => () }
-
-    columns = ['Chromosome', 'HGNC_symbol', 'Ensembl_gene_id', 'Clinical_db_gene_annotation',
-               'Reduced_penetrance', 'Disease_associated_transcript', 'Phenotypic_disease_model',
-               'Genetic_disease_model', 'OMIM_morbid', 'Database_entry_version', 'Curator',
-               'Alias', 'Group_or_Pathway', 'Mosaicism', 'Comments']
-
-    list_columns = ['Genetic_disease_model', 'Ensembl_gene_id', 'Clinical_db_gene_annotation']
-
-    for infile in infiles:
-        versions[infile.name] = {}
-        for line in infile:
-            # deal with headers
-            if line.startswith('##'):
-                continue # skip comments
-            if line.startswith('#Chromosome'): # get the header
-                line = line.lstrip('#')
-                header = line.split("\t")
+from ..utils.sort import chromosome_key, sorted_runs, merge_runs
+
+COLUMNS = ['Chromosome', 'HGNC_symbol', 'Ensembl_gene_id', 'Clinical_db_gene_annotation',
+           'Reduced_penetrance', 'Disease_associated_transcript', 'Phenotypic_disease_model',
+           'Genetic_disease_model', 'OMIM_morbid', 'Database_entry_version', 'Curator',
+           'Alias', 'Group_or_Pathway', 'Mosaicism', 'Comments']
+
+LIST_COLUMNS = ['Genetic_disease_model', 'Ensembl_gene_id', 'Clinical_db_gene_annotation']
+
+COORDINATE_COLUMNS = ['Gene_start', 'Gene_stop']
+
+def get_columns(coordinates=False):
+    """ Returns (list): the columns of the merged gene list, with Gene_start and Gene_stop
+    after the Chromosome if coordinates is set, e.g. to write it indexed. """
+    if coordinates:
+        return COLUMNS[:1] + COORDINATE_COLUMNS + COLUMNS[1:]
+    return COLUMNS
+
+def read_lines(infile, databases):
+    """ Reads the lines of a gene list that are in the databases.
+
+    Args:
+        infile (file): a gene list.
+        databases (list): only take HGNC_symbols from these databases.
+
+    Yields (dict): the sanitized columns of each line, the list columns as lists.
+    """
+    columns = COLUMNS + COORDINATE_COLUMNS
+    comments, header, rows = readcolumns(infile, columns)
+    for row in rows:
+        line = dict(zip(columns, row)) # get me a nice mapping
+
+        # sanitize all columns
+        for column in COLUMNS:
+            line[column] = line[column].strip()
+            if ':' in line[column]:
+                line[column] = line[column].split(':')[1]
+        for column in COORDINATE_COLUMNS:
+            line[column] = line[column].strip()
+
+        # the models can be multiple, so make it into a list
+        for column in LIST_COLUMNS:
+            line[column] = line[column].split(',')
+
+        # skip if we are whitelisting dbs
+        if len(databases):
+            set_databases = set(line['Clinical_db_gene_annotation']).intersection(databases)
+            if len(set_databases):
+                line['Clinical_db_gene_annotation'] = sorted(list(set_databases))
+            else:
                 continue
 
-            line = line.split("\t")
-            line = dict(zip(header, line)) # get me a nice mapping
-
-            # sanitize all columns
-            for column in columns:
-                if column not in line:
-                    line[column] = ''
-                line[column] = line[column].strip()
-                if ':' in line[column]:
-                    line[column] = line[column].split(':')[1]
-
-            # the models can be multiple, so make it into a list
-            for column in list_columns:
-                line[column] = line[column].split(',')
-
-            # skip if we are whitelisting dbs
-            if len(databases):
-                set_databases = set(line['Clinical_db_gene_annotation']).intersection(databases)
-                if len(set_databases):
-                    line['Clinical_db_gene_annotation'] = sorted(list(set_databases))
-                else:
+        yield line
+
+def new_record(columns=COLUMNS):
+    """ Returns (dict): an empty merged line """
+    record = dict(zip(columns, ['' for i in range(len(columns))]))
+    for column in LIST_COLUMNS:
+        record[column] = []
+    return record
+
+def fill_record(record, line, columns=COLUMNS):
+    """ Merges a line into a merged line. The list columns are extended, the others overwritten. """
+    for column in columns:
+        if column in LIST_COLUMNS:
+            record[column].extend(line[column])
+        else:
+            record[column] = line[column]
+
+def format_record(record, databases, columns=COLUMNS):
+    """ Yields (str): the output lines of a merged line, one per EnsEMBL gene id. """
+    if len(databases) > 2:
+        record['Clinical_db_gene_annotation'].append('FullList')
+
+    for column in LIST_COLUMNS:
+        list_values = sorted(list(set(record[column]))) # uniq sorted list
+        list_values = filter(None, list_values) # remove empty strings
+        record[column] = ','.join(list_values)
+
+    if record['Disease_associated_transcript'] == 'unknown':
+        record['Disease_associated_transcript'] = ''
+    for ensemblid in record['Ensembl_gene_id'].split(','):
+        record['Ensembl_gene_id'] = ensemblid
+        yield '\t'.join([record[column] for column in columns])
+
+class Versions(object):
+    """ The version and date of each database of each gene list, for the ##Database header lines. """
+
+    def __init__(self, infiles, git_metadata=None):
+        self.acronyms = Acronyms(os.path.dirname(os.path.dirname(os.path.realpath(infiles[0].name))))
+
+        # get the versions and dates of all gene lists at once
+        if git_metadata is None:
+            git_metadata = GitMetadata()
+        git_metadata.prefetch([infile.name for infile in infiles])
+        self.git_metadata = git_metadata
+
+        self.versions = OrderedDict() # Filename => { Database => { 'Version': Version, 'Date': Date } }
+        for infile in infiles:
+            self.versions[infile.name] = {}
+
+    def add(self, filename, line):
+        """ Adds the databases of a line of gene list filename """
+        for database in line['Clinical_db_gene_annotation']:
+            if database == 'OMIM':
+                if not filename.endswith('OMIM.txt'):
                     continue
+            if database not in self.versions[filename]:
+                full_mod_date = self.git_metadata.lastmoddate(filename, '%c')
+                if not full_mod_date: # ok, we haven't saved this list yet
+                    mod_date = datetime.datetime.now().strftime('%Y%m%d')
+                else:
+                    mod_date = datetime.datetime.\
+                               strptime(full_mod_date, '%c').\
+                               strftime('%Y%m%d')
+                version = self.git_metadata.tag(filename)
+                full_name = self.acronyms[database]
+                self.versions[filename][database] = {'Version': version, 'Date': mod_date,
+                                                     'Fullname': full_name}
+
+    def header(self, columns=COLUMNS):
+        """ Yields (str): the ##Database header lines and the column header """
+        for filename, database_version in self.versions.items():
+            for database, version_date in database_version.items():
+                yield '##Database=<ID=%s,Version=%s,Date=%s,Acronym=%s,Complete_name=%s,Clinical_db_genome_build=GRCh37.p13' % (os.path.basename(filename), version_date['Version'], version_date['Date'], database, version_date['Fullname'])
+
+        yield '#' + '\t'.join(columns)
+
+def merge_panels(infiles, databases, git_metadata=None, coordinates=False):
+    """ Merge the panels of gene lists into one list.
+
+    Args:
+        infiles (list of files): gene lists.
+        databases (list): only take HGNC_symbols from these databases.
+        git_metadata (GitMetadata, optional): share the git versions and dates with other runs.
+        coordinates (bool, False): also output Gene_start and Gene_stop, see get_columns.
+
+    Yields (str): the lines of the merged gene list.
+    """
+
+    columns = get_columns(coordinates)
+    versions = Versions(infiles, git_metadata)
+    data = OrderedDict() # HGNC_symbol => {'HGNC_symbol' => '', 'EnsEMBLid' => [], 'Databases' => () }
 
+    for infile in infiles:
+        for line in read_lines(infile, databases):
             hgnc_id = line['HGNC_symbol']
 
             # init
             if hgnc_id not in data:
-                data[hgnc_id] = dict(zip(columns, ['' for i in range(len(columns))]))
-                for column in list_columns:
-                    data[hgnc_id][column] = []
+                data[hgnc_id] = new_record(columns)
 
             # fill
-            for column in columns:
-                if column in list_columns:
-                    data[hgnc_id][column].extend(line[column])
-                else:
-                    data[hgnc_id][column] = line[column]
+            fill_record(data[hgnc_id], line, columns)
 
             # fill versions dict
-            for database in line['Clinical_db_gene_annotation']:
-                if database == 'OMIM':
-                    if not infile.name.endswith('OMIM.txt'):
-                        continue
-                if database not in versions[infile.name]:
-                    full_mod_date = getgitlastmoddate(infile.name, '%c')
-                    if not full_mod_date: # ok, we haven't saved this list yet
-                        mod_date = datetime.datetime.now().strftime('%Y%m%d')
-                    else:
-                        mod_date = datetime.datetime.\
-                                   strptime(full_mod_date, '%c').\
-                                   strftime('%Y%m%d')
-                    version = getgittag(infile.name, full_mod_date)
-                    full_name = acronyms[database]
-                    versions[infile.name][database] = {'Version': version, 'Date': mod_date,
-                                                       'Fullname': full_name}
-    for filename, database_version in versions.items():
-        for database, version_date in database_version.items():
-            yield '##Database=<ID=%s,Version=%s,Date=%s,Acronym=%s,Complete_name=%s,Clinical_db_genome_build=GRCh37.p13' % (os.path.basename(filename), version_date['Version'], version_date['Date'], database, version_date['Fullname'])
-
-    yield '#' + '\t'.join(columns)
+            versions.add(infile.name, line)
+
+    for line in versions.header(columns):
+        yield line
+
     for line in data.values():
-        if len(databases) > 2:
-            line['Clinical_db_gene_annotation'].append('FullList')
-
-        for column in list_columns:
-            list_values = sorted(list(set(line[column]))) # uniq sorted list
-            list_values = filter(None, list_values) # remove empty strings
-            line[column] = ','.join(list_values)
-
-        if line['Disease_associated_transcript'] == 'unknown':
-            line['Disease_associated_transcript'] = ''
-        for ensemblid in line['Ensembl_gene_id'].split(','):
-            line['Ensembl_gene_id'] = ensemblid
-            yield '\t'.join([line[column] for column in columns])
+        for merged_line in format_record(line, databases, columns):
+            yield merged_line
+
+def sort_key(line, infile_nr, line_nr):
+    """ Returns (list): (chromosome, start, HGNC_symbol, input and line) to sort and merge lines on """
+    start = line.get('Gene_start', '').strip()
+    return [chromosome_key(line['Chromosome']), int(start) if start.isdigit() else 0,
+            line['HGNC_symbol'], infile_nr, line_nr]
+
+def merge_panels_sorted(infiles, databases, git_metadata=None, max_lines=100000, coordinates=False):
+    """ Merge the panels of gene lists into one list, sorted on chromosome, start and HGNC_symbol.
+    Each gene list is sorted on its own, in runs of max_lines that are spilled to disk, and
+    the runs are merged with a heap. Only the last run of the last gene list stays in memory.
+    Lines with the same chromosome, start and HGNC_symbol are merged as merge_panels does, so
+    memory use is bounded by max_lines and the nr of runs, not by the size of the gene lists.
+
+    Args:
+        infiles (list of files): gene lists.
+        databases (list): only take HGNC_symbols from these databases.
+        git_metadata (GitMetadata, optional): share the git versions and dates with other runs.
+        max_lines (int, 100000): the maximum nr of lines to sort in memory.
+        coordinates (bool, False): also output Gene_start and Gene_stop, see get_columns.
+
+    Yields (str): the lines of the merged gene list.
+    """
+
+    columns = get_columns(coordinates)
+    versions = Versions(infiles, git_metadata)
+
+    runs = []
+    for infile_nr, infile in enumerate(infiles):
+        def key_lines(infile=infile, infile_nr=infile_nr):
+            for line_nr, line in enumerate(read_lines(infile, databases)):
+                versions.add(infile.name, line)
+                yield sort_key(line, infile_nr, line_nr), dict((column, line[column]) for column in columns)
+        runs.extend(sorted_runs(key_lines(), max_lines, keep_last=infile_nr == len(infiles) - 1))
+
+    for line in versions.header(columns):
+        yield line
+
+    merged = merge_runs(runs)
+    for gene, key_lines in groupby(merged, key=lambda key_line: key_line[0][:3]):
+        record = new_record(columns)
+        for key, line in key_lines:
+            fill_record(record, line, columns)
+        for merged_line in format_record(record, databases, columns):
+            yield merged_line
@@ -0,0 +1,76 @@
+""" Annotate variants and regions with the genes and panels of a gene list """
+# encoding: utf-8
+
+from __future__ import print_function
+from itertools import islice
+
+from ..api import readcolumns, IntervalIndex
+
+def read_records(lines, file_format):
+    """Reads the records of a VCF or BED file.
+
+    Args:
+        lines (iterable): the lines of the file.
+        file_format (str): 'vcf' or 'bed'.
+
+    Yields (tuple): (chromosome, start, stop, id) of each record, 1-based and inclusive.
+                    The stop of a VCF record is the last base of REF.
+    """
+    for line in lines:
+        if line.startswith(('#', 'track', 'browser')) or not line.strip():
+            continue
+        fields = line.rstrip('\r\n').split('\t')
+        if file_format == 'vcf':
+            start = int(fields[1])
+            stop = start + max(len(fields[3]), 1) - 1
+            record_id = fields[2]
+        else:
+            start = int(fields[1]) + 1 # BED is 0-based, half open
+            stop = max(int(fields[2]), start)
+            record_id = fields[3] if len(fields) > 3 else '.'
+        yield fields[0], start, stop, record_id
+
+def overlap(genelist, lines, file_format, batch_size=100000, report_all=False):
+    """Streams the records of a VCF or BED file and finds the genes of a gene list they overlap.
+    The records are queried in batches against an IntervalIndex of the gene list.
+
+    Args:
+        genelist (iterable): the lines of a gene list.
+        lines (iterable): the lines of a VCF or BED file.
+        file_format (str): 'vcf' or 'bed'.
+        batch_size (int, 100000): nr of records per query.
+        report_all (bool, False): also yield the records that overlap no gene.
+
+    Yields (str): a header, then the chromosome, start, stop, id, HGNC symbols and panels
+                  of each record, tab separated.
+    """
+    comments, header, rows = readcolumns(genelist, ['Chromosome', 'Gene_start', 'Gene_stop',
+                                                    'HGNC_symbol', 'Clinical_db_gene_annotation'])
+    rows = list(rows)
+    index = IntervalIndex(row[:3] for row in rows)
+
+    yield '#Chromosome\tStart\tStop\tID\tHGNC_symbol\tClinical_db_gene_annotation'
+    records = read_records(lines, file_format)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+
+        chromosomes, starts, stops, record_ids = zip(*batch)
+        query_ids, row_ids = index.query(chromosomes, starts, stops)
+
+        hits = [[] for record in batch]
+        for query_id, row_id in zip(query_ids.tolist(), row_ids.tolist()):
+            hits[query_id].append(rows[row_id])
+
+        for (chromosome, start, stop, record_id), genes in zip(batch, hits):
+            if not genes and not report_all:
+                continue
+            symbols = []
+            panels = set()
+            for gene in genes:
+                if gene[3].strip() not in symbols:
+                    symbols.append(gene[3].strip())
+                panels.update(panel.strip() for panel in gene[4].split(','))
+            yield '\t'.join([chromosome, str(start), str(stop), record_id, ','.join(symbols),
+                             ','.join(sorted(filter(None, panels)))])
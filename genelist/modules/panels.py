@@ -3,6 +3,8 @@
 
 from __future__ import print_function
 
+from ..api import readcolumns
+
 def get_panels(genelist):
     """ List panels in a gene list
 
@@ -12,22 +14,14 @@ def get_panels(genelist):
     Returns (list): list of panel names.
     """
 
-    f = open(genelist)
-
-    lines = (line.strip() for line in f.readlines())
-
     panels = {}
 
-    for line in lines:
-        # skip comments
-        if line.startswith('#'):
-            continue
-
-        l = line.split('\t')
-
-        cur_panels = l[17].split(',')
-        cur_panels = (panel.strip() for panel in cur_panels)
-        for cur_panel in cur_panels:
-            panels[cur_panel] = 1
+    with open(genelist) as f:
+        comments, header, rows = readcolumns(f, ['Clinical_db_gene_annotation'])
+        for clinical_db_gene_annotation, in rows:
+            cur_panels = clinical_db_gene_annotation.split(',')
+            cur_panels = (panel.strip() for panel in cur_panels)
+            for cur_panel in cur_panels:
+                panels[cur_panel] = 1
 
     return panels.keys()
@@ -3,14 +3,25 @@
 
 from __future__ import print_function
 import sys
+import os
+import io
 import re
+import locale
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import Pool
+
+from ..utils.intervals import find_overlaps
 
 class Sanity(object):
     """ Check the validty of a gene list. report back inconsistancies """
 
-    def __init__(self):
-        """TODO: Docstring for __init__.
-        Returns: TODO
+    def __init__(self, quiet=False, check_overlaps=False):
+        """Sets up the column rules.
+
+        Args:
+            quiet (bool, False): only collect the messages in self.messages, don't print them
+            check_overlaps (bool, False): also warn on genes that overlap on the same chromosome
 
         """
 
@@ -41,8 +52,11 @@ class Sanity(object):
             'OMIM_morbid': re.compile(r'(False|.*:False)')
         }
 
+        self.quiet = quiet
+        self.check_overlaps = check_overlaps
         self.line_nr = 0 # hold on to the line nr
         self.warned = 0 # exit code
+        self.messages = [] # (line nr, message)
 
     def list2dict(self, header, data):
         """Will convert each row in the data from a list to dict using the header list as keys.
@@ -64,7 +78,9 @@ class Sanity(object):
             msg (str): The message to print
 
         """
-        print("#{}: {}".format(self.line_nr, msg))
+        if not self.quiet:
+            print("#{}: {}".format(self.line_nr, msg))
+        self.messages.append((self.line_nr, msg))
         self.warned = 1
 
     def inc_line_nr(self, lines):
@@ -172,7 +188,8 @@ class Sanity(object):
             yield line
 
     def check_duplicates(self, lines):
-        """Check for duplicates based on HGNC_symbol, EnsEMBL_gene_id and coordinates
+        """Check for duplicates based on HGNC_symbol, EnsEMBL_gene_id and coordinates.
+        Overlaps are checked after the last line, see check_coordinate_overlaps.
 
         Args:
             lines (list of dicts): each dict contains a dict with gl_header as keys
@@ -183,8 +200,8 @@ class Sanity(object):
             'HGNC_symbol': {}, # HGNC_symbol: line nr
             'Ensembl_gene_id': {},
         }
-        Gene_start = {}
-        Gene_stop = {}
+        coordinates = {} # (Chromosome, Gene_start, Gene_stop): line nr
+        intervals = []
         for line in lines:
             for field_key in fields.keys():
                 if line[field_key] in fields[field_key]:
@@ -192,15 +209,56 @@ class Sanity(object):
                               format(line[field_key], fields[field_key][line[field_key]]))
                 fields[field_key][line[field_key]] = self.line_nr
 
-            if line['Gene_start'] in Gene_start and line['Gene_stop'] in Gene_stop:
-                self.warn("'{}-{}' already listed at #{}".\
-                          format(line['Gene_start'], line['Gene_stop'],
-                                 Gene_start[line['Gene_start']]))
-            Gene_start[line['Gene_start']] = self.line_nr
-            Gene_stop[line['Gene_stop']]   = self.line_nr
+            interval = to_interval(line['Chromosome'], line['Gene_start'], line['Gene_stop'],
+                                   self.line_nr)
+            if interval:
+                self.check_coordinate_duplicate(interval, coordinates)
+                if self.check_overlaps:
+                    intervals.append(interval)
 
             yield line
 
+        self.check_coordinate_overlaps(intervals)
+
+    def check_coordinate_duplicate(self, interval, coordinates):
+        """Warns when the coordinates of the current line were listed before on the same
+        chromosome, and remembers them.
+
+        Args:
+            interval (tuple): (Chromosome, Gene_start, Gene_stop, line nr) of the current line
+            coordinates (dict): (Chromosome, Gene_start, Gene_stop): line nr of the lines so far
+
+        """
+        key = interval[:3]
+        if key in coordinates:
+            self.warn("'{}-{}' already listed at #{}".format(interval[1], interval[2], coordinates[key]))
+        coordinates[key] = interval[3]
+
+    def check_coordinate_overlaps(self, intervals):
+        """If check_overlaps is set, checks for genes that overlap with a sorted sweep, see
+        find_overlaps. Warns on the line listed last of each pair. Genes with the same
+        coordinates are reported per line, see check_coordinate_duplicate.
+
+        Args:
+            intervals (list of tuples): (Chromosome, Gene_start, Gene_stop, line nr)
+
+        """
+        if not self.check_overlaps:
+            return
+
+        messages = []
+        for interval, other in find_overlaps(intervals):
+            if interval[1:3] == other[1:3]: # already reported as duplicate
+                continue
+            first, last = sorted((interval, other), key=lambda i: i[3])
+            messages.append((last[3], first[3], "'{}:{}-{}' overlaps '{}:{}-{}' listed at #{}".\
+                             format(last[0], last[1], last[2],
+                                    first[0], first[1], first[2], first[3])))
+
+        for line_nr, first_line_nr, message in sorted(messages):
+            self.line_nr = line_nr
+            self.warn(message)
+
     def check_chromosome(self, lines):
         """Checks if the Gene_locus corresponds with the listed chromosome
 
@@ -221,28 +279,154 @@ class Sanity(object):
 
             yield line
 
-    def check(self, infile):
-        """Main program
+    def compile_duplicate_check(self):
+        """Compiles the cross-row part of check_duplicates: remembers the HGNC symbol,
+        EnsEMBL gene id and coordinates of each line and warns when one of them was
+        listed before.
 
-        Args:
-            infile (str): input gene list
+        Returns (tuple of functions): the first takes the duplicate keys of a line as returned
+                                      by the routine of compile_checks and warns for the current
+                                      self.line_nr. Call the second after the last line to
+                                      check for overlaps, see check_coordinate_overlaps.
+        """
+        hgnc_symbols = {} # HGNC_symbol: line nr
+        ensembl_gene_ids = {} # Ensembl_gene_id: line nr
+        coordinates = {} # (Chromosome, Gene_start, Gene_stop): line nr
+        intervals = []
+
+        def check_keys(keys):
+            hgnc_symbol, ensembl_gene_id, chromosome, start, stop = keys
+            for value, seen in ((hgnc_symbol, hgnc_symbols), (ensembl_gene_id, ensembl_gene_ids)):
+                if value in seen:
+                    self.warn("'{}' already listed at #{}".format(value, seen[value]))
+                seen[value] = self.line_nr
+
+            interval = to_interval(chromosome, start, stop, self.line_nr)
+            if interval:
+                self.check_coordinate_duplicate(interval, coordinates)
+                if self.check_overlaps:
+                    intervals.append(interval)
+
+        def check_coordinates():
+            self.check_coordinate_overlaps(intervals)
+
+        return check_keys, check_coordinates
+
+    def compile_checks(self, header):
+        """Compiles the row checks of check_nr_fields, check_delimiter, check_trimming,
+        check_forbidden_chars, check_mandatory_fields, check_chromosome, check_coordinates
+        into one routine. Fields are looked up by column position, so no dict is built per
+        line. Warns with the same messages, in the same order, as the chained generators.
+        Duplicates span lines, pass the returned keys to compile_duplicate_check for those.
 
-        Returns: 0 on success, otherwise error code
+        Args:
+            header (list): the column names of the gene list, without the leading #
 
+        Returns (function): takes a line (str) and its fields (list of str), returns the
+                            duplicate keys of the line: HGNC_symbol, Ensembl_gene_id,
+                            Chromosome, Gene_start and Gene_stop
         """
-        infile = open(infile, 'r')
-        lines = (line.strip('\r\n') for line in infile) # sluuuurp
+        # dict(zip(header, line)) keeps the first position and the last value of a duplicate key
+        keys = list(OrderedDict.fromkeys(header))
+        position = dict((key, i) for i, key in enumerate(keys))
+        len_header = len(header)
+        unique_header = len(keys) == len_header
+
+        delimiter = ', '
+        locus_re = re.compile('p|q')
+
+        def compile_rule(rule_re):
+            # '.+' matches any non-empty field, as fields can't hold a newline
+            if rule_re.pattern == '.+':
+                return bool
+            return rule_re.search
+
+        forbidden_rules = [(field, position.get(field), forbidden_re.search, forbidden_re)
+                           for field, forbidden_re in self.forbidden_chars.items()]
+        mandatory_rules = [(field, position.get(field), compile_rule(mandatory_re), mandatory_re)
+                           for field, mandatory_re in self.mandatory_fields.items()]
+
+        def get(values, field, pos):
+            """ Mimics line[field] """
+            value = values[pos] if pos is not None else None
+            if value is None:
+                raise KeyError(field)
+            return value
+
+        def get_values(fields):
+            """ Aligns the fields with keys, missing fields are None """
+            if unique_header and len(fields) == len_header:
+                return fields
+
+            line = dict(zip(header, fields))
+            if len(line) != len_header:
+                self.warn("Len fields ({}) != len headers ({})".format(len(line), len_header))
+            return [line.get(key) for key in keys]
+
+        def check_row(line, fields):
+            values = get_values(fields)
+
+            # quick tests on the whole line, a hit will check each field
+            if delimiter in line:
+                for key, value in zip(keys, values):
+                    if value is not None and delimiter in value:
+                        self.warn("{} ('{}') holds a forbidden delimiter".format(key, value))
+
+            if list(map(str.strip, fields)) != fields:
+                for key, value in zip(keys, values):
+                    if value is not None and value != value.strip():
+                        self.warn("{} ('{}') is not trimmed!".format(key, value))
+
+            for field, pos, search, forbidden_re in forbidden_rules:
+                value = get(values, field, pos)
+                if search(value):
+                    self.warn("'{}' ('{}') has a forbidden char combination '{}'".\
+                              format(field, value, forbidden_re))
+
+            for field, pos, search, mandatory_re in mandatory_rules:
+                value = get(values, field, pos)
+                if not search(value):
+                    self.warn("'{}' ('{}') fails mandatory requirement '{}'".\
+                              format(field, value, mandatory_re))
+
+            locus_pos = position.get('Gene_locus')
+            if locus_pos is not None and values[locus_pos] is not None:
+                gene_locus = values[locus_pos]
+                if 'q' in gene_locus or 'p' in gene_locus:
+                    chromosome = get(values, 'Chromosome', position.get('Chromosome'))
+                    if locus_re.split(gene_locus)[0] != chromosome:
+                        self.warn("Chromosome '{}' differs from gene locus '{}'".\
+                                  format(chromosome, gene_locus))
 
-        # get the line in parts
-        parsable_data = (line.split('\t') for line in lines)
+            start = get(values, 'Gene_start', position.get('Gene_start'))
+            stop = get(values, 'Gene_stop', position.get('Gene_stop'))
+            if stop and start:
+                if int(stop) - int(start) <= 0:
+                    self.warn('Gene coordinates are not above zero.')
+
+            return (get(values, 'HGNC_symbol', position.get('HGNC_symbol')),
+                    get(values, 'Ensembl_gene_id', position.get('Ensembl_gene_id')),
+                    get(values, 'Chromosome', position.get('Chromosome')),
+                    start, stop)
+
+        return check_row
+
+    def check_header(self, lines):
+        """Skips the leading comments and checks the header.
+
+        Args:
+            lines (iterator of str): the lines of the gene list, stripped of their line ends.
+                                     Only the comments and the header are consumed.
 
+        Returns (list): the column names, without the leading #
+        """
         # skip parsing of leading comments
         comments = []
-        line = next(parsable_data)
+        line = next(lines).split('\t')
         self.line_nr = 1
         while line[0].startswith('##'):
             comments.append(line)
-            line = next(parsable_data)
+            line = next(lines).split('\t')
             self.line_nr += 1
 
         # OK - start the sanity checks
@@ -254,8 +438,6 @@ class Sanity(object):
         else:
             header[0] = header[0][1:] # remove the leading #
 
-        dict_data = self.list2dict(header, parsable_data)
-
         # are all mandatory headers there?
         header_diff = set(self.mandatory_fields.keys()).difference(header)
         if len(header_diff) > 0:
@@ -266,6 +448,101 @@ class Sanity(object):
             if re.search(' ', head) != None:
                 self.warn("Header '{}' contains white space".format(head))
 
+        return header
+
+    def check_chunked(self, infile, jobs, min_chunk_size=1 << 20):
+        """Splits the gene list in byte ranges on line boundaries and runs the row checks
+        of each range in a pool of worker processes. The duplicate keys of all lines are
+        checked afterwards, in line order, so messages are the same as those of check.
+
+        Args:
+            infile (str): input gene list
+            jobs (int): nr of worker processes
+            min_chunk_size (int, 1MB): don't split the gene list in smaller ranges than this
+
+        Returns: 0 on success, otherwise error code
+        """
+        encoding = locale.getpreferredencoding(False) # same as open(infile, 'r')
+        with open(infile, 'rb') as f:
+            lines = (line.decode(encoding).strip('\r\n') for line in iter(f.readline, b''))
+            header = self.check_header(lines)
+            data_start = f.tell()
+
+            # move the chunk ends to the start of the next line
+            size = os.fstat(f.fileno()).st_size
+            chunk_size = max(min_chunk_size, (size - data_start) // jobs + 1)
+            boundaries = [data_start]
+            while boundaries[-1] < size:
+                f.seek(boundaries[-1] + chunk_size)
+                f.readline()
+                boundaries.append(min(f.tell(), size))
+
+        chunks = [(infile, header, start, end) for start, end in zip(boundaries, boundaries[1:])]
+        check_keys, check_coordinates = self.compile_duplicate_check()
+        first_line_nr = self.line_nr + 1
+        pool = Pool(jobs)
+        try:
+            for messages, duplicate_keys, error in pool.imap(check_chunk, chunks):
+                messages = iter(messages)
+                message = next(messages, None)
+                for line_nr, keys in enumerate(duplicate_keys, first_line_nr):
+                    self.line_nr = line_nr
+                    while message and message[0] + first_line_nr == line_nr:
+                        self.warn(message[1])
+                        message = next(messages, None)
+                    check_keys(keys)
+                first_line_nr += len(duplicate_keys)
+
+                if error:
+                    # the messages of the failing line come before the error
+                    self.line_nr = first_line_nr
+                    while message:
+                        self.warn(message[1])
+                        message = next(messages, None)
+                    raise error
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        check_coordinates()
+        return self.warned
+
+    def check(self, infile, fused=True, jobs=1):
+        """Main program
+
+        Args:
+            infile (str): input gene list
+            fused (bool, True): run the checks as one compiled routine per line instead of
+                                chaining the check_* generators.
+            jobs (int, 1): more than 1 checks chunks of the gene list in parallel,
+                           see check_chunked
+
+        Returns: 0 on success, otherwise error code
+
+        """
+        if jobs > 1:
+            return self.check_chunked(infile, jobs)
+
+        infile = open(infile, 'r')
+        lines = (line.strip('\r\n') for line in infile) # sluuuurp
+
+        header = self.check_header(lines)
+
+        if fused:
+            check_row = self.compile_checks(header)
+            check_keys, check_coordinates = self.compile_duplicate_check()
+            for line in lines:
+                self.line_nr += 1
+                check_keys(check_row(line, line.split('\t')))
+            check_coordinates()
+
+            return self.warned
+
+        # get the line in parts
+        parsable_data = (line.split('\t') for line in lines)
+        dict_data = self.list2dict(header, parsable_data)
+
         # file contains ';' delimiter
         # elements in a field should be seperated by ',', not ', '
         # fields should be trimmed
@@ -297,3 +574,122 @@ class Sanity(object):
         ]
 
         return self.warned
+
+def to_interval(chromosome, start, stop, line_nr):
+    """Returns (chromosome, start, stop, line_nr) with int coordinates, None if start or stop
+    is not a number. Missing coordinates are reported by check_mandatory_fields.
+    """
+    if start.isdigit() and stop.isdigit():
+        return (chromosome, int(start), int(stop), line_nr)
+    return None
+
+def check_chunk(chunk):
+    """Runs the row checks of Sanity on a byte range of a gene list.
+
+    Args:
+        chunk (tuple): path to the gene list, its header, the start and end of the byte range.
+                       The range starts and ends on a line boundary.
+
+    Returns (tuple): the messages as (line nr, message), with line nrs starting at 0 at
+                     the first line of the range, the duplicate keys of each line and the
+                     exception that stopped the checks, if any
+    """
+    infile, header, start, end = chunk
+
+    with open(infile, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = io.StringIO(data.decode(locale.getpreferredencoding(False)), newline=None)
+
+    sanity = Sanity(quiet=True)
+    check_row = sanity.compile_checks(header)
+    duplicate_keys = []
+    try:
+        for line_nr, line in enumerate(lines):
+            sanity.line_nr = line_nr
+            line = line.strip('\r\n')
+            duplicate_keys.append(check_row(line, line.split('\t')))
+    except Exception as e:
+        return sanity.messages, duplicate_keys, e
+
+    return sanity.messages, duplicate_keys, None
+
+def expand_genelists(paths):
+    """Replaces each directory in paths with the gene lists (*.txt) found below it.
+
+    Args:
+        paths (list): paths to gene lists and/or directories
+
+    Returns (list): paths to gene lists
+    """
+    genelists = []
+    for path in paths:
+        if not os.path.isdir(path):
+            genelists.append(path)
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.')) # skip .git
+            genelists.extend(os.path.join(root, f) for f in sorted(files) if f.endswith('.txt'))
+
+    return genelists
+
+def validate_list(genelist, jobs=1, check_overlaps=False):
+    """Checks one gene list without printing.
+
+    Args:
+        genelist (str): path to the gene list
+        jobs (int, 1): nr of worker processes to check chunks of the gene list with
+        check_overlaps (bool, False): also warn on overlapping genes
+
+    Returns (dict): with keys genelist, exit_code, messages and error. Messages is a list of dicts
+                    with keys line_nr and message. Error holds the exception that stopped the
+                    check, if any.
+    """
+    sanity = Sanity(quiet=True, check_overlaps=check_overlaps)
+    error = None
+    try:
+        exit_code = sanity.check(genelist, jobs=jobs)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        exit_code = 1
+
+    return {
+        'genelist': genelist,
+        'exit_code': exit_code,
+        'messages': [{'line_nr': line_nr, 'message': message}
+                     for line_nr, message in sanity.messages],
+        'error': error,
+    }
+
+def validate_lists(genelists, jobs=1, split=False, check_overlaps=False):
+    """Checks gene lists in a pool of worker processes.
+
+    Args:
+        genelists (list): paths to gene lists
+        jobs (int, 1): nr of worker processes, 1 checks the lists in this process
+        split (bool, False): check the gene lists one after the other, each split in chunks
+                             over the worker processes. For very large gene lists.
+        check_overlaps (bool, False): also warn on overlapping genes
+
+    Yields (dict): the result of validate_list per gene list, in the order of genelists
+    """
+    if split:
+        for genelist in genelists:
+            yield validate_list(genelist, jobs=jobs, check_overlaps=check_overlaps)
+        return
+
+    validate = partial(validate_list, check_overlaps=check_overlaps)
+    if jobs == 1 or len(genelists) < 2:
+        for genelist in genelists:
+            yield validate(genelist)
+        return
+
+    pool = Pool(jobs)
+    try:
+        for result in pool.imap(validate, genelists):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,194 @@
+""" Set algebra on the panels of gene lists """
+# encoding: utf-8
+
+from __future__ import print_function
+import os
+import re
+import binascii
+from collections import OrderedDict
+
+from ..api import readcolumns
+from .index import get_list_name
+from ..utils.git import GitMetadata
+from ..utils.acronyms import Acronyms
+
+RE_TOKEN = re.compile(r'\s*(?:([()|&])|(-)(?=[\s(])|([^\s()|&]+))')
+
+class PanelSets(object):
+    """Panel membership of gene lists as bitsets over one dictionary of genes.
+    Bit i of a bitset is set when the gene with id i is in the panel.
+    """
+
+    def __init__(self):
+        self.genes = [] # id: HGNC_symbol
+        self.gene_ids = {} # HGNC_symbol: id
+        self.lists = {} # list name: {panel: bitset, None: bitset of the whole list}
+        self.paths = {} # list name: path
+
+    def gene_id(self, hgnc_symbol):
+        """Returns (int): the id of a gene, adds it to the dictionary when new."""
+        if hgnc_symbol not in self.gene_ids:
+            self.gene_ids[hgnc_symbol] = len(self.genes)
+            self.genes.append(hgnc_symbol)
+        return self.gene_ids[hgnc_symbol]
+
+    def to_bitset(self, ids):
+        """Returns (int): the bitset with the bits of ids set."""
+        bits = bytearray(len(self.genes) // 8 + 1)
+        for i in ids:
+            bits[i >> 3] |= 1 << (i & 7)
+        # int.from_bytes(bits, 'little') on python 3
+        return int(binascii.hexlify(bytes(bytearray(reversed(bits)))), 16)
+
+    def to_genes(self, bitset):
+        """Returns (list): the HGNC symbols in a bitset, in the order they were first seen."""
+        return [self.genes[i] for i, bit in enumerate(bin(bitset)[:1:-1]) if bit == '1']
+
+    def add(self, genelist):
+        """Reads the panels of a gene list. The list is known by its name, e.g. CMMS for
+        cust000-CMMS.txt, by its file name without extension and by its path.
+
+        Args:
+            genelist (str): path to the gene list.
+        """
+        members = {None: []} # panel: [gene id, ]
+        with open(genelist) as f:
+            comments, header, rows = readcolumns(f, ['HGNC_symbol', 'Clinical_db_gene_annotation'])
+            for hgnc_symbol, clinical_db_gene_annotation in rows:
+                hgnc_symbol = hgnc_symbol.strip()
+                if not hgnc_symbol:
+                    continue
+                gene_id = self.gene_id(hgnc_symbol)
+                members[None].append(gene_id)
+                for panel in clinical_db_gene_annotation.split(','):
+                    panel = panel.strip()
+                    if panel:
+                        members.setdefault(panel, []).append(gene_id)
+
+        bitsets = dict((panel, self.to_bitset(ids)) for panel, ids in members.items())
+        for name in (get_list_name(genelist)[1], os.path.splitext(os.path.basename(genelist))[0], genelist):
+            self.lists[name] = bitsets
+            self.paths[name] = genelist
+
+    def operand(self, operand):
+        """Returns (int): the bitset of LIST or LIST:PANEL."""
+        name, sep, panel = operand.rpartition(':') if ':' in operand else (operand, '', None)
+        if name not in self.lists:
+            raise ValueError("Unknown gene list '{}'".format(name))
+        return self.lists[name].get(panel, 0)
+
+    def evaluate(self, expression):
+        """Evaluates a set expression on the panels of the gene lists.
+
+        Operands are LIST or LIST:PANEL. Operators are | (union), & (intersection) and
+        - (difference), with the precedence of Python: - before & before |. A - needs a
+        space after it, to tell it from the dashes in list names. Use parentheses to group.
+
+        Args:
+            expression (str): e.g. 'CMMS:EP - (FullList:EP | FullList:OMIM)'
+
+        Returns (int): the bitset of the result
+        """
+        tokens = []
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = RE_TOKEN.match(expression, position)
+            if not match:
+                raise ValueError("Can't parse '{}' at {}".format(expression, position))
+            tokens.append(match.group(1) or match.group(2) or ('operand', match.group(3)))
+            position = match.end()
+
+        def expect_operand():
+            if not tokens:
+                raise ValueError("Missing an operand in '{}'".format(expression))
+            token = tokens.pop(0)
+            if token == '(':
+                result = parse('|')
+                if not tokens or tokens.pop(0) != ')':
+                    raise ValueError("Missing ')' in '{}'".format(expression))
+                return result
+            if isinstance(token, tuple):
+                return self.operand(token[1])
+            raise ValueError("Unexpected '{}' in '{}'".format(token, expression))
+
+        precedence = ['|', '&', '-']
+        def parse(operator):
+            level = precedence.index(operator)
+            result = parse(precedence[level + 1]) if level + 1 < len(precedence) else expect_operand()
+            while tokens and tokens[0] == operator:
+                tokens.pop(0)
+                other = parse(precedence[level + 1]) if level + 1 < len(precedence) else expect_operand()
+                if operator == '|':
+                    result |= other
+                elif operator == '&':
+                    result &= other
+                else:
+                    result &= ~other
+            return result
+
+        result = parse('|')
+        if tokens:
+            raise ValueError("Unexpected '{}' in '{}'".format(tokens[0], expression))
+        return result
+
+    def members(self, hgnc_symbol, operands):
+        """Returns (list): the operands that contain a gene."""
+        bit = 1 << self.gene_ids[hgnc_symbol]
+        return [operand for operand in operands if self.operand(operand) & bit]
+
+def parse_expression(expression):
+    """Splits an expression in its optional name and its operands.
+
+    Args:
+        expression (str): [NAME=]EXPRESSION
+
+    Returns (tuple): (name, expression, operands). The name defaults to the panel of the first
+                     operand, or its list when it has no panel.
+    """
+    name, sep, rest = expression.partition('=')
+    if not sep:
+        name, rest = None, expression
+    operands = [match.group(3) for match in RE_TOKEN.finditer(rest) if match.group(3)]
+    if not name:
+        first = operands[0] if operands else rest
+        name = first.rpartition(':')[2]
+    return name.strip(), rest.strip(), operands
+
+def setop_report(genelists, expressions, git_metadata=None):
+    """Evaluates set expressions on the panels of gene lists, each gene list is read once.
+
+    Args:
+        genelists (list): paths to gene lists.
+        expressions (list): [NAME=]EXPRESSION, see PanelSets.evaluate and parse_expression.
+        git_metadata (GitMetadata, optional): share the git versions and dates with other runs.
+
+    Returns (tuple): (panel_sets, OrderedDict) of NAME: {'display', 'version', 'date', 'customer',
+                     'genes'}, as faulty_gl.py. The metadata is of the gene list of the first operand.
+    """
+    panel_sets = PanelSets()
+    for genelist in genelists:
+        panel_sets.add(genelist)
+
+    if git_metadata is None:
+        git_metadata = GitMetadata()
+    git_metadata.prefetch(genelists)
+
+    report = OrderedDict()
+    for expression in expressions:
+        name, expression, operands = parse_expression(expression)
+        if name in report:
+            raise ValueError("'{}' is the name of more than one expression, use NAME=EXPRESSION".format(name))
+        genes = panel_sets.to_genes(panel_sets.evaluate(expression))
+
+        path = panel_sets.paths[operands[0].rpartition(':')[0] if ':' in operands[0] else operands[0]]
+        acronyms = Acronyms(os.path.dirname(os.path.dirname(os.path.realpath(path))), index_file=None)
+        report[name] = {
+            'display': acronyms[name],
+            'version': git_metadata.head_tag(path),
+            'date': git_metadata.lastmoddate(path),
+            'customer': get_list_name(path)[0],
+            'genes': genes,
+        }
+
+    return panel_sets, report
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+""" asyncio clients for genenames.org, UniProt and OMIM, with a blocking facade """
+
+import io
+import ssl
+import json
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urljoin, urlencode
+
+import requests
+import requests_cache
+import xmltodict
+from requests.structures import CaseInsensitiveDict
+
+from .genenames import parse_symbol, parse_official
+from .uniprot import parse_description_xml, parse_entries, search_params, next_link, SEARCH_URL
+from .omim import OMIM, pick_entry
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+class AsyncSingleFlight(object):
+    """SingleFlight for coroutines on one event loop, see utils.singleflight. A caller that is
+    cancelled does not cancel the call the others wait for.
+    """
+
+    def __init__(self):
+        self.calls = {} # key: asyncio.Task
+        self.shared = 0
+
+    async def do(self, key, function, *args, **kwargs):
+        """Returns: the result of await function(*args, **kwargs), see SingleFlight.do."""
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(function(*args, **kwargs))
+            task.add_done_callback(lambda task: self.calls.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+class HTTPCache(object):
+    """The SQLite cache of requests_cache that the blocking client of a service installs, e.g.
+    genenames_cache, read and written by its asyncio client. Responses are keyed on the URL
+    and query string as requests_cache keys them, so both clients share the cached responses.
+
+    Args:
+        cache_name (str): the cache, kept in cache_name.sqlite.
+        expire_after (int, 8460000): seconds a response stays valid, as the blocking clients.
+    """
+
+    def __init__(self, cache_name, expire_after=8460000):
+        self.backend = requests_cache.backends.create_backend('sqlite', cache_name, {})
+        self.expire_after = timedelta(seconds=expire_after)
+
+    def prepare(self, url, params=None):
+        """Returns (PreparedRequest): the GET request that requests_cache keys the response on."""
+        if isinstance(params, dict):
+            params = sorted(params.items()) # as requests_cache normalizes them
+        return requests.Request('GET', url, params=params).prepare()
+
+    def get(self, url, params=None):
+        """Returns (tuple): (status code, dict of lower case headers, body as bytes) of the cached
+        response, None when it is not cached or expired."""
+        response, timestamp = self.backend.get_response_and_time(self.backend.create_key(self.prepare(url, params)))
+        if response is None or datetime.utcnow() - timestamp > self.expire_after:
+            return None
+        headers = dict((key.lower(), value) for key, value in response.headers.items())
+        return response.status_code, headers, response.content
+
+    def set(self, url, params, status, headers, body):
+        """Caches a response, only a 200 as requests_cache does."""
+        if status != 200:
+            return
+        request = self.prepare(url, params)
+        response = requests.Response()
+        response.status_code = status
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(headers)
+        response.url = request.url
+        response.request = request
+        response._content = body
+        self.backend.save_response(self.backend.create_key(request), response)
+
+async def read_body(reader, headers):
+    """Reads the body of an HTTP response: chunked, of Content-Length or up to EOF."""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = b''
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if size == 0:
+                await reader.readline()
+                return body
+            body += await reader.readexactly(size)
+            await reader.readline()
+    if 'content-length' in headers:
+        return await reader.readexactly(int(headers['content-length']))
+    return await reader.read()
+
+async def http_get(url, params=None, headers=None, timeout=60, max_redirects=5):
+    """GETs a URL over a connection of its own, follows redirects.
+
+    Args:
+        url (str): http or https URL.
+        params (dict, optional): the query string, list values are repeated as requests does.
+        headers (dict, optional): extra request headers.
+        timeout (float, 60): seconds to wait for the whole response.
+
+    Returns (tuple): (status code, dict of lower case response headers, body as bytes)
+    """
+    if params:
+        url += ('&' if '?' in url else '?') + urlencode(params, doseq=True)
+
+    for redirect in range(max_redirects + 1):
+        parts = urlsplit(url)
+        https = parts.scheme == 'https'
+        port = parts.port or (443 if https else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if https else None),
+            timeout)
+        try:
+            request_headers = {'Host': parts.netloc, 'Connection': 'close', 'Accept-Encoding': 'identity',
+                               'User-Agent': 'genelist'}
+            request_headers.update(headers or {})
+            path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+            request = 'GET {} HTTP/1.1\r\n'.format(path) + \
+                ''.join('{}: {}\r\n'.format(key, value) for key, value in request_headers.items()) + '\r\n'
+            writer.write(request.encode('latin-1'))
+            await writer.drain()
+
+            async def read_response():
+                status = int((await reader.readline()).split()[1])
+                response_headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+                    if not line:
+                        break
+                    key, sep, value = line.partition(':')
+                    response_headers[key.strip().lower()] = value.strip()
+                return status, response_headers, await read_body(reader, response_headers)
+
+            status, response_headers, body = await asyncio.wait_for(read_response(), timeout)
+        finally:
+            writer.close()
+
+        if status not in REDIRECTS or 'location' not in response_headers:
+            return status, response_headers, body
+        url = urljoin(url, response_headers['location'])
+
+    raise IOError('More than {} redirects for {}'.format(max_redirects, url))
+
+class AsyncClient(object):
+    """Base of the asyncio clients. At most limit_per_host requests to a host are in flight at
+    a time, and a request keeps its slot for delay seconds after it is done, to play nice as
+    the blocking clients do. All requests of all clients can run on one event loop. Identical
+    requests in flight at the same time are made once, see AsyncSingleFlight. Responses come
+    from, and go to, the cache of the blocking client, see HTTPCache; only misses are delayed.
+
+    Args:
+        limit_per_host (int, 4): nr of requests in flight per host.
+        delay (float, 0.25): seconds a request keeps its slot after it is done.
+        cache_name (str, optional): the requests_cache cache to share, None to not cache.
+    """
+
+    def __init__(self, limit_per_host=4, delay=0.25, cache_name=None):
+        self.limit_per_host = limit_per_host
+        self.delay = delay
+        self.semaphores = {} # host: asyncio.Semaphore
+        self.flights = AsyncSingleFlight()
+        self.cache = HTTPCache(cache_name) if cache_name else None
+
+    async def fetch(self, url, params=None, headers=None):
+        """GETs a URL within the limit of its host, or from the cache.
+
+        Returns (tuple): (status code, dict of lower case response headers, body as bytes)
+        """
+        if self.cache is not None:
+            cached = self.cache.get(url, params)
+            if cached is not None:
+                return cached
+        key = (url, json.dumps(params, sort_keys=True), json.dumps(headers, sort_keys=True))
+        return await self.flights.do(key, self._fetch, url, params, headers)
+
+    async def _fetch(self, url, params, headers):
+        host = urlsplit(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.limit_per_host)
+        async with self.semaphores[host]:
+            status, response_headers, body = await http_get(url, params=params, headers=headers)
+            if self.cache is not None:
+                self.cache.set(url, params, status, response_headers, body)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        return status, response_headers, body
+
+class AsyncGenenames(AsyncClient):
+    """asyncio variant of Genenames, with the same methods as coroutines.
+
+    Args:
+        response_format (str): format for response (xml, json, etc.)
+    """
+
+    def __init__(self, response_format='application/json', base_url='http://rest.genenames.org/',
+                 cache_name='genenames_cache', **kwargs):
+        super(AsyncGenenames, self).__init__(cache_name=cache_name, **kwargs)
+        self.base_url = base_url
+        self.format = response_format
+
+    async def get(self, handler):
+        """Returns (json): the parsed response of an API entry point."""
+        # the URL of Genenames.get, so they share the cache
+        status, headers, body = await self.fetch("%s/%s" % (self.base_url, handler), headers={'Accept': self.format})
+        return json.loads(body.decode('utf-8'))
+
+    async def fetch_symbol(self, hgnc_symbol, key):
+        """See Genenames.fetch_symbol."""
+        data = await self.get("fetch/symbol/%s" % hgnc_symbol)
+        return parse_symbol(data, key)
+
+    async def omim(self, hgnc_symbol):
+        return await self.fetch_symbol(hgnc_symbol, 'omim_id')
+
+    async def aliases(self, hgnc_symbol):
+        return await self.fetch_symbol(hgnc_symbol, 'alias_symbol')
+
+    async def uniprot(self, hgnc_symbol):
+        return await self.fetch_symbol(hgnc_symbol, 'uniprot_ids')
+
+    async def refseq(self, hgnc_symbol):
+        return await self.fetch_symbol(hgnc_symbol, 'refseq_accession')
+
+    async def official(self, hgnc_symbol, omim_morbid=None):
+        """See Genenames.official."""
+        data = await self.get("fetch/symbol/%s" % hgnc_symbol)
+
+        official_symbol = None
+        try:
+            official_symbol = parse_official(data, omim_morbid)
+        except (KeyError, IndexError):
+            pass
+
+        if official_symbol == None:
+            # ok, no results found, maybe try its previous symbol?
+            data = await self.get("fetch/prev_symbol/%s" % hgnc_symbol)
+
+            try:
+                official_symbol = parse_official(data, omim_morbid)
+            except (KeyError, IndexError):
+                return None
+
+        return official_symbol
+
+class AsyncUniprot(AsyncClient):
+    """asyncio variant of Uniprot.
+
+    Args:
+        response_format (str): format for response (xml, json, etc.)
+    """
+
+    def __init__(self, response_format='application/xml', base_url='http://www.uniprot.org/uniprot',
+                 search_url=SEARCH_URL, cache_name='uniprot_cache', **kwargs):
+        super(AsyncUniprot, self).__init__(cache_name=cache_name, **kwargs)
+        self.base_url = base_url
+        self.search_url = search_url
+        self.format = response_format
+
+    async def get(self, handler):
+        """Returns (dict): the parsed XML response of an API entry point."""
+        status, headers, body = await self.fetch("%s/%s" % (self.base_url, handler), headers={'Accept': self.format})
+        return xmltodict.parse(body)
+
+    async def fetch_description(self, uniprot_id):
+        """See Uniprot.fetch_description."""
+        status, headers, body = await self.fetch("%s/%s.xml" % (self.base_url, uniprot_id), headers={'Accept': self.format})
+        return parse_description_xml(io.BytesIO(body))
+
+    async def fetch_entries(self, accessions, reviewed_only=False):
+        """See Uniprot.fetch_entries."""
+        accessions = sorted(set(accessions))
+        if not accessions:
+            return {}
+        results = []
+        url, params = self.search_url, search_params(accessions, reviewed_only)
+        while url:
+            status, headers, body = await self.fetch(url, params=params)
+            if status != 200:
+                raise IOError('UniProt search failed with HTTP {}: {}'.format(status, url))
+            results.extend(json.loads(body.decode('utf-8')).get('results', []))
+            url, params = next_link(headers.get('link')), None
+        return parse_entries({'results': results}, accessions)
+
+class AsyncOMIM(AsyncClient):
+    """asyncio variant of the searches of OMIM. One request in flight by default, as OMIM asks.
+
+    Args:
+        api_key (str): the OMIM API key http://www.omim.org/api
+        response_format (str): format for response (xml, json, etc.)
+        max_backoff (float, 60): the maximum seconds to wait after a 409 Conflict (throttled).
+        max_conflicts (int, 10): give up on a search after this many 409 Conflicts.
+    """
+
+    def __init__(self, api_key, response_format='json', base_url='http://api.omim.org/api',
+                 limit_per_host=1, max_backoff=60, max_conflicts=10, cache_name='omim_cache', **kwargs):
+        super(AsyncOMIM, self).__init__(limit_per_host=limit_per_host, cache_name=cache_name, **kwargs)
+        self.base_url = base_url
+        self.format = response_format
+        self.api_key = api_key
+        self.max_backoff = max_backoff
+        self.max_conflicts = max_conflicts
+
+    async def search_gene(self, hgnc_symbol=None, mim_number=None, include=('geneMap', 'dates')):
+        """See OMIM.search_gene. Backs off while OMIM answers 409 Conflict (throttled), raises
+        an IOError after max_conflicts of them."""
+        params = {'apiKey': self.api_key, 'format': self.format, 'include': list(include)}
+        if mim_number:
+            params['search'] = "number:%s" % mim_number
+        else:
+            params['search'] = "approved_gene_symbol:%s" % hgnc_symbol
+
+        backoff = 1
+        for conflicts in range(self.max_conflicts + 1):
+            status, headers, body = await self.fetch("%s/entry/search" % self.base_url, params=params)
+            if status != 409:
+                break
+            if conflicts == self.max_conflicts:
+                raise IOError('OMIM still throttles the search for {} after {} retries'.\
+                              format(params['search'], self.max_conflicts))
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+        data = json.loads(body.decode('utf-8'))
+        return data['omim']['searchResponse']['entryList'] or []
+
+    async def gene(self, hgnc_symbol=None, mim_number=None):
+        """See OMIM.gene."""
+        return pick_entry(await self.search_gene(hgnc_symbol=hgnc_symbol, mim_number=mim_number))
+
+    # the parsing of the entries is the one of OMIM
+    parse_phenotypic_disease_models_ext = OMIM.parse_phenotypic_disease_models_ext
+    parse_phenotypic_disease_models = OMIM.parse_phenotypic_disease_models
+    parse_phenotypic_descriptions = OMIM.parse_phenotypic_descriptions
+
+class LoopThread(object):
+    """An event loop that runs forever in a daemon thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='genelist-asyncio')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, coroutine):
+        """Runs a coroutine on the loop and waits for its result, from any other thread."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+LOOP_THREAD = None
+LOOP_THREAD_LOCK = threading.Lock()
+
+def get_loop_thread():
+    """Returns (LoopThread): the loop shared by all Blocking facades, started on first use."""
+    global LOOP_THREAD
+    with LOOP_THREAD_LOCK:
+        if LOOP_THREAD is None:
+            LOOP_THREAD = LoopThread()
+        return LOOP_THREAD
+
+class Blocking(object):
+    """Blocking facade of an asyncio client: each coroutine method becomes a method that runs
+    it on a LoopThread and returns its result, so the client drops in for Genenames, Uniprot or
+    OMIM. Calls from many threads share the one loop and the per-host limits of the client.
+
+    Args:
+        client (AsyncClient): e.g. AsyncGenenames().
+        loop_thread (LoopThread, optional): defaults to the shared one, see get_loop_thread.
+    """
+
+    def __init__(self, client, loop_thread=None):
+        self.client = client
+        self.loop_thread = loop_thread or get_loop_thread()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        def blocking(*args, **kwargs):
+            return self.loop_thread.run(attribute(*args, **kwargs))
+        blocking.__name__ = name
+        blocking.__doc__ = attribute.__doc__
+        return blocking
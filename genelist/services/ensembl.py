@@ -1,26 +1,397 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import pymysql
 
+try:
+    import queue
+except ImportError: # python 2
+    import Queue as queue
+
 from ..utils import cleanup_description
 
-class Ensembl:
+# client errors of a connection that is gone: can't connect, server has gone away, lost connection
+RECONNECT_ERRORS = (2003, 2006, 2013)
 
-    def __init__(self, host='localhost', port=3306, user='anonymous', db='homo_sapiens_core_85_37'):
-        self.conn = pymysql.connect(host=host, port=port, user=user, db=db)
+TRANSCRIPTS_QUERY = """
+        SELECT DISTINCT g.seq_region_start AS Gene_start, g.seq_region_end AS Gene_stop,
+        g.stable_id AS Ensembl_gene_id, sr.name AS Chromosome,
+        t.stable_id AS Transcript_ID, g.description, tx.dbprimary_acc AS RefSeq_ID
+        FROM gene g JOIN xref x ON x.xref_id = g.display_xref_id
+        JOIN seq_region sr ON sr.seq_region_id = g.seq_region_id
+        LEFT JOIN object_xref ox on ox.ensembl_id = g.gene_id AND ensembl_object_type = 'Gene'
+        LEFT JOIN xref xx on xx.xref_id = ox.xref_id AND xx.external_db_id IN (1500, 1510, 1520)
+        LEFT JOIN transcript t ON t.gene_id = g.gene_id
+        LEFT JOIN object_xref tox ON tox.ensembl_id = t.transcript_id AND tox.ensembl_object_type = 'Transcript'
+        LEFT JOIN xref tx ON tx.xref_id = tox.xref_id AND tx.external_db_id in (1801, 1806, 1810)
+        WHERE length(sr.name) < 3
+"""
 
-    def __enter__(self, host='localhost', port=3306, user='anonymous', db='homo_sapiens_core_85_37'):
-        self.conn = pymysql.connect(host=host, port=port, user=user, db=db) # TODO find out how to combine init with enter
+GENES_QUERY = """
+        SELECT DISTINCT g.seq_region_start AS Gene_start, g.seq_region_end AS Gene_stop,
+        g.stable_id AS Ensembl_gene_id,
+        seq_region.name AS Chromosome
+        FROM gene g JOIN xref x ON x.xref_id = g.display_xref_id
+        join seq_region USING (seq_region_id)
+        LEFT join object_xref ox on ox.ensembl_id = g.gene_id and ensembl_object_type = 'Gene'
+        LEFT join xref xx on xx.xref_id = ox.xref_id and xx.external_db_id IN (1500, 1510, 1520)
+        where length(seq_region.name) < 3
+"""
+
+GENE_COLUMNS = ('Gene_start', 'Gene_stop', 'Ensembl_gene_id', 'Chromosome')
+
+def filter_candidates(candidates, omim_morbid=None, ensembl_gene_id=None, hgnc_symbol=None, chromosome=None):
+    """Answers Ensembl.query from the rows of Ensembl.query_candidates, without a round-trip.
+    Identifiers compare case-insensitively, as MySQL does.
+
+    Args:
+        candidates (list): dicts as Ensembl.query, with HGNC_symbol and OMIM_morbid added.
+        omim_morbid, ensembl_gene_id, hgnc_symbol, chromosome: as Ensembl.query.
+
+    Returns (list): dicts as Ensembl.query, in the order of the candidates
+    """
+    def same(value, other):
+        return value is not None and str(value).strip().lower() == str(other).strip().lower()
+
+    genes = OrderedDict() # gene: set of OMIM morbid
+    symbols = {}
+    for row in candidates:
+        gene = tuple(row[column] for column in GENE_COLUMNS)
+        genes.setdefault(gene, set()).add(row['OMIM_morbid'])
+        symbols[gene] = row['HGNC_symbol']
+
+    lines = []
+    for gene, omim_morbids in genes.items():
+        line = dict(zip(GENE_COLUMNS, gene))
+        if omim_morbid and not any(same(omim, omim_morbid) for omim in omim_morbids):
+            continue
+        if ensembl_gene_id and not same(line['Ensembl_gene_id'], ensembl_gene_id):
+            continue
+        if hgnc_symbol and not same(symbols[gene], hgnc_symbol):
+            continue
+        if chromosome and not same(line['Chromosome'], chromosome):
+            continue
+        lines.append(line)
+    return lines
+
+def join_refseqs(transcripts):
+    """Formats the transcripts of a gene with their RefSeq IDs.
+
+    Args:
+        transcripts (dict): transcript id: list of RefSeq IDs, None for no RefSeq ID
+
+    Returns (list): ensembl_transcript_id>ref_seq_id/ref_seq_id for each transcript
+    """
+    transcripts_refseqs = []
+    for transcript in sorted(transcripts.keys()):
+        refseqs = '/'.join(sorted([refseq for refseq in transcripts[transcript]
+                                   if refseq != None]))
+
+        if len(refseqs) == 0:
+            transcripts_refseqs.append(transcript)
+        else:
+            transcripts_refseqs.append('%s>%s' % (transcript, refseqs))
+
+    return transcripts_refseqs
+
+def process_transcripts(rows):
+    """Processes raw data:
+    * aggregates transcripts, RefSeq IDs per gene
+
+    Args:
+        rows (iterator): dicts with following keys: Ensembl_gene_id,
+                         description, Transcript_ID, RefSeq_ID, Gene_start, Gene_stop,
+                         Chromosome and optionally HGNC_symbol. Sorted on gene.
+
+    yields (dict): per gene, with transcripts, RefSeq IDs aggregated
+
+    """
+    def new_line(row):
+        # keys: Ensembl_transcript_to_refseq_transcript, Gene_description,
+        # Gene_start, Gene_stop, Chromosome, Ensembl_gene_id and HGNC_symbol if queried
+        line = {
+            'Gene_description': cleanup_description(row['description']),
+            'Gene_start': row['Gene_start'],
+            'Gene_stop': row['Gene_stop'],
+            'Chromosome': row['Chromosome'],
+            'Ensembl_gene_id': row['Ensembl_gene_id']
+        }
+        if 'HGNC_symbol' in row:
+            line['HGNC_symbol'] = row['HGNC_symbol']
+        return line
+
+    row = next(rows, None)
+    if row is None:
+        return
+
+    # init
+    ensembl_gene_id = row['Ensembl_gene_id']
+    line = new_line(row)
+    transcripts = {row['Transcript_ID']: [row['RefSeq_ID']]}
+
+    for row in rows:
+        if row['Ensembl_gene_id'] != ensembl_gene_id:
+
+            line['Ensembl_transcript_to_refseq_transcript'] = \
+                    '|'.join(join_refseqs(transcripts))
+            yield line
+
+            # reset
+            transcripts = {}
+            ensembl_gene_id = row['Ensembl_gene_id']
+            line = new_line(row)
+
+        if row['Transcript_ID'] not in transcripts:
+            transcripts[row['Transcript_ID']] = []
+        transcripts[row['Transcript_ID']].append(row['RefSeq_ID'])
+
+    # yield last one
+    line['Ensembl_transcript_to_refseq_transcript'] = '|'.join(join_refseqs(transcripts))
+    yield line
+
+class ConnectionPool(object):
+    """A pool of at most size connections. A thread checks out a connection for the time it
+    needs it and gets the same connection when it checks out again in that time. A connection
+    is pinged, and reconnected when needed, when it is checked out. A thread that has all
+    connections checked out itself, e.g. with an open stream_transcripts, can't wait for one
+    to come back: it gets a RuntimeError instead of blocking forever.
+
+    Args:
+        connect (callable): returns a new connection.
+        size (int, 1): the maximum nr of connections.
+        timeout (float, optional): seconds to wait for a free connection, wait forever when None.
+    """
+
+    def __init__(self, connect, size=1, timeout=None):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get(self):
+        """Returns: an idle connection, a new one when the pool is not full, or waits for one."""
+        conn = self._get()
+        self.local.held = getattr(self.local, 'held', 0) + 1
+        return conn
+
+    def _get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                try:
+                    return self.connect()
+                except:
+                    self.created -= 1
+                    raise
+        if getattr(self.local, 'held', 0) >= self.size:
+            raise RuntimeError('All {} connections are checked out by this thread, it would wait for '
+                               'itself. Use a larger pool.'.format(self.size))
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError('No free connection after {}s, all {} are checked out'.format(self.timeout, self.size))
+
+    def _release(self):
+        held = getattr(self.local, 'held', 0)
+        if held:
+            self.local.held = held - 1
+
+    def put(self, conn):
+        """Returns a connection to the pool."""
+        self._release()
+        self.idle.put(conn)
+
+    def discard(self, conn):
+        """Closes a broken connection, so a new one can take its place."""
+        self._release()
+        with self.lock:
+            self.created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the current thread, see the class doc.
+
+        Yields: a connection
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self.get()
+        try:
+            conn.ping(reconnect=True)
+        except Exception:
+            self.discard(conn)
+            raise
+        self.local.conn = conn
+        try:
+            yield conn
+        except pymysql.err.OperationalError as error:
+            if error.args and error.args[0] in RECONNECT_ERRORS:
+                self.discard(conn)
+                conn = None
+            raise
+        finally:
+            self.local.conn = None
+            if conn is not None:
+                self.put(conn)
+
+    def close(self):
+        """Closes the idle connections."""
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+class QueryCache(object):
+    """A memo of query results: an LRU in memory, backed by an optional SQLite file that is
+    shared between runs. Empty results are cached as well. Thread safe.
+
+    Args:
+        maxsize (int, 10000): nr of results to keep in memory, 0 to keep none.
+        path (str, optional): path to the SQLite file.
+    """
+
+    def __init__(self, maxsize=10000, path=None):
+        self.maxsize = maxsize
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self.db.commit()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns (tuple): (True, a copy of the rows) on a hit, (False, None) on a miss.
+
+        Args:
+            key (tuple): of str or None.
+        """
+        key = json.dumps(key)
+        with self.lock:
+            if key in self.memory:
+                value = self.memory.pop(key)
+                self.memory[key] = value # most recently used
+                self.hits += 1
+                return True, [dict(row) for row in value]
+            if self.db is not None:
+                row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return True, [dict(row) for row in value]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, rows):
+        """Caches the rows of a query, see get."""
+        key = json.dumps(key)
+        value = [dict(row) for row in rows]
+        with self.lock:
+            self._remember(key, value)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)',
+                                (key, json.dumps(value)))
+                self.db.commit()
+
+    def stats(self):
+        """Returns (dict): hits, disk_hits (part of the hits), misses and the hit_rate."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+class Ensembl:
+    """Queries the EnsEMBL core database through a pool of connections, see ConnectionPool.
+    Queries that fail because the connection is gone are retried on a new connection.
+
+    Args:
+        pool_size (int, 1): the maximum nr of connections, one per thread that queries at the same time.
+        retries (int, 1): the nr of times to retry a query after a lost connection.
+        cache_size (int, 10000): nr of results of query to keep in memory, see QueryCache.
+        cache_path (str, optional): SQLite file to keep the results of query in between runs.
+    """
+
+    def __init__(self, host='localhost', port=3306, user='anonymous', db='homo_sapiens_core_85_37',
+                 pool_size=1, retries=1, cache_size=10000, cache_path=None):
+        self.db = db
+        self.retries = retries
+        self.cache = QueryCache(cache_size, cache_path)
+        self.pool = ConnectionPool(lambda: pymysql.connect(host=host, port=port, user=user, db=db),
+                                   size=pool_size)
+
+    def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        self.conn.close()
+        self.close()
+
+    def close(self):
+        """Closes the idle connections of the pool and the cache."""
+        self.pool.close()
+        self.cache.close()
+
+    def execute(self, query, values=None):
+        """Executes a query on a connection of the pool.
+
+        Args:
+            query (str): the SQL, with %s placeholders.
+            values (list, optional): the values of the placeholders.
+
+        Returns (list): of dicts, one per row
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.pool.connection() as conn:
+                    cur = conn.cursor(pymysql.cursors.DictCursor)
+                    try:
+                        cur.execute(query, values)
+                        return cur.fetchall()
+                    finally:
+                        cur.close()
+            except pymysql.err.OperationalError as error:
+                if attempt == self.retries or not error.args or error.args[0] not in RECONNECT_ERRORS:
+                    raise
 
     def query(self, omim_morbid=None, ensembl_gene_id=None, hgnc_symbol=None, chromosome=None):
         """Queries EnsEMBL based on the Ensembl_gene_id. Data from EnsEMBLdb will overwrite
         the client data.
         An identifiers should yield one result from EnsEMBLdb.
+        The results, also empty ones, are cached per database and identifiers, see QueryCache.
 
         Args:
             ensembl_id (str): the EnsEMBL gene id.
@@ -33,17 +404,14 @@ class Ensembl:
             
         """
 
+        key = (self.db,) + tuple(str(value) if value else None
+                                 for value in (omim_morbid, ensembl_gene_id, hgnc_symbol, chromosome))
+        hit, rs = self.cache.get(key)
+        if hit:
+            return rs
+
         # add 'x.display_label AS HGNC_symbol,' if oyu want to have the HGNC_symbol
-        base_query = """
-        SELECT DISTINCT g.seq_region_start AS Gene_start, g.seq_region_end AS Gene_stop,
-        g.stable_id AS Ensembl_gene_id,
-        seq_region.name AS Chromosome
-        FROM gene g JOIN xref x ON x.xref_id = g.display_xref_id
-        join seq_region USING (seq_region_id)
-        LEFT join object_xref ox on ox.ensembl_id = g.gene_id and ensembl_object_type = 'Gene'
-        LEFT join xref xx on xx.xref_id = ox.xref_id and xx.external_db_id IN (1500, 1510, 1520)
-        where length(seq_region.name) < 3
-        """
+        base_query = GENES_QUERY
 
         cond_values = []
         if omim_morbid:
@@ -60,15 +428,55 @@ class Ensembl:
             cond_values.append(chromosome)
 
         # execute the query
-        cur = self.conn.cursor(pymysql.cursors.DictCursor)
-        cur.execute(base_query, cond_values)
-        rs = cur.fetchall() # result set
+        rs = self.execute(base_query, cond_values) # result set
+        self.cache.set(key, rs)
 
         if len(rs) == 0:
             return []
         else:
             return rs
 
+    def query_candidates(self, omim_morbid=None, ensembl_gene_id=None, hgnc_symbol=None, chromosome=None):
+        """Queries EnsEMBL in one go for all genes that match any of the identifiers, on the
+        chromosome if given. Use filter_candidates to answer the queries of Ensembl.query from
+        the result. The results are cached, see query.
+
+        Args:
+            omim_morbid, ensembl_gene_id, hgnc_symbol, chromosome: as query.
+
+        Returns (list): dicts as query, with HGNC_symbol and OMIM_morbid, one per OMIM morbid
+                        of a gene
+        """
+        key = ('candidates', self.db) + tuple(str(value) if value else None
+                                              for value in (omim_morbid, ensembl_gene_id, hgnc_symbol, chromosome))
+        hit, rs = self.cache.get(key)
+        if hit:
+            return rs
+
+        identifiers = []
+        cond_values = []
+        if omim_morbid:
+            identifiers.append("xx.dbprimary_acc = %s")
+            cond_values.append(str(omim_morbid))
+        if ensembl_gene_id:
+            identifiers.append("g.stable_id = %s")
+            cond_values.append(ensembl_gene_id)
+        if hgnc_symbol:
+            identifiers.append("x.display_label = %s")
+            cond_values.append(hgnc_symbol)
+        if not identifiers:
+            return []
+
+        base_query = GENES_QUERY.replace('AS Chromosome', 'AS Chromosome, x.display_label AS HGNC_symbol, xx.dbprimary_acc AS OMIM_morbid')
+        base_query += " AND (" + " OR ".join(identifiers) + ")"
+        if chromosome:
+            base_query += " AND seq_region.name = %s"
+            cond_values.append(chromosome)
+
+        rs = self.execute(base_query, cond_values)
+        self.cache.set(key, rs)
+        return list(rs)
+
     def query_transcripts(self, omim_morbid=None, ensembl_gene_id=None):
         """Queries EnsEMBL for all transcripts.
 
@@ -81,88 +489,12 @@ class Ensembl:
 
         """
 
-        def _join_refseqs(transcripts):
-            transcripts_refseqs = []
-            for transcript in sorted(transcripts.keys()):
-                refseqs = '/'.join(sorted([refseq for refseq in transcripts[transcript]
-                                           if refseq != None]))
-
-                if len(refseqs) == 0:
-                    transcripts_refseqs.append(transcript)
-                else:
-                    transcripts_refseqs.append('%s>%s' % (transcript, refseqs))
-
-            return transcripts_refseqs
-
-        def _process_transcripts(data):
-            """Processes raw data:
-            * aggregates transcripts, RefSeq IDs
-
-            Args:
-                data (dict): dictionary with following keys: EnsEMBL_ID,
-                             description, Transcript_ID, RefSeq_ID
-
-            yields (str): A string with transcripts, RefSeq IDs aggregated
-
-            """
-            row = data.pop(0)
-
-            # init
-            ensembl_gene_id = row['Ensembl_gene_id']
-            line = { # keys: Ensembl_transcript_to_refseq_transcript, Gene_description,
-                     # Gene_start, Gene_stop, Chromosome, HGNC_symbol, Ensembl_gene_id
-                'Gene_description': cleanup_description(row['description']),
-                'Gene_start': row['Gene_start'],
-                'Gene_stop': row['Gene_stop'],
-                'Chromosome': row['Chromosome'],
-                'Ensembl_gene_id': ensembl_gene_id
-            }
-            transcripts = {row['Transcript_ID']: [row['RefSeq_ID']]}
-
-            for row in data:
-                if row['Ensembl_gene_id'] != ensembl_gene_id:
-
-                    line['Ensembl_transcript_to_refseq_transcript'] = \
-                            '|'.join(_join_refseqs(transcripts))
-                    yield line
-
-                    # reset
-                    transcripts = {}
-                    ensembl_gene_id = row['Ensembl_gene_id']
-                    line = {
-                        'Gene_description': cleanup_description(row['description']),
-                        'Gene_start': row['Gene_start'],
-                        'Gene_stop': row['Gene_stop'],
-                        'Chromosome': row['Chromosome'],
-                        'Ensembl_gene_id': ensembl_gene_id
-                    }
-
-                if row['Transcript_ID'] not in transcripts:
-                    transcripts[row['Transcript_ID']] = []
-                transcripts[row['Transcript_ID']].append(row['RefSeq_ID'])
-
-            # yield last one
-            line['Ensembl_transcript_to_refseq_transcript'] = '|'.join(_join_refseqs(transcripts))
-            yield line
-
         """
         external_db_id = 1801
         select * from xref where display_label like 'NM\_%' limit 10;
         """
 
-        base_query = """
-        SELECT DISTINCT g.seq_region_start AS Gene_start, g.seq_region_end AS Gene_stop,
-        g.stable_id AS Ensembl_gene_id, sr.name AS Chromosome,
-        t.stable_id AS Transcript_ID, g.description, tx.dbprimary_acc AS RefSeq_ID
-        FROM gene g JOIN xref x ON x.xref_id = g.display_xref_id
-        JOIN seq_region sr ON sr.seq_region_id = g.seq_region_id
-        LEFT JOIN object_xref ox on ox.ensembl_id = g.gene_id AND ensembl_object_type = 'Gene'
-        LEFT JOIN xref xx on xx.xref_id = ox.xref_id AND xx.external_db_id IN (1500, 1510, 1520)
-        LEFT JOIN transcript t ON t.gene_id = g.gene_id
-        LEFT JOIN object_xref tox ON tox.ensembl_id = t.transcript_id AND tox.ensembl_object_type = 'Transcript'
-        LEFT JOIN xref tx ON tx.xref_id = tox.xref_id AND tx.external_db_id in (1801, 1806, 1810)
-        WHERE length(sr.name) < 3
-        """
+        base_query = TRANSCRIPTS_QUERY
 
         cond_values = []
         if omim_morbid:
@@ -174,10 +506,45 @@ class Ensembl:
             
         base_query += " ORDER BY g.gene_id, t.transcript_id"
 
-        cur = self.conn.cursor(pymysql.cursors.DictCursor)
-        cur.execute(base_query, cond_values)
-        rs = cur.fetchall()
+        rs = self.execute(base_query, cond_values)
         if len(rs) > 0:
-            transcripts = _process_transcripts(rs)
+            transcripts = process_transcripts(iter(rs))
             return next(transcripts)
         return {}
+
+    def stream_transcripts(self, chromosome=None):
+        """Queries EnsEMBL for the transcripts of all genes, genome-wide or of one chromosome.
+        The rows are streamed from the server with an unbuffered cursor and grouped per gene
+        as they come in, so memory use does not grow with the nr of genes. The connection can't
+        be used for other queries until all genes are read, so the stream holds a connection of
+        the pool of its own: query from another thread, or use a pool_size of 2 or more. Querying
+        from the thread that reads the stream with a pool_size of 1 raises a RuntimeError.
+
+        Args:
+            chromosome (str, optional): only the genes on this chromosome.
+
+        Yields (dict): per gene, as query_transcripts, with the HGNC_symbol added.
+        """
+
+        base_query = TRANSCRIPTS_QUERY.replace('g.description,', 'g.description, x.display_label AS HGNC_symbol,')
+        cond_values = []
+        if chromosome:
+            base_query += " AND sr.name = %s"
+            cond_values.append(chromosome)
+        base_query += " ORDER BY g.gene_id, t.transcript_id"
+
+        conn = self.pool.get()
+        try:
+            conn.ping(reconnect=True)
+            cur = conn.cursor(pymysql.cursors.SSDictCursor)
+            try:
+                cur.execute(base_query, cond_values)
+                for line in process_transcripts(iter(cur.fetchone, None)):
+                    yield line
+            finally:
+                cur.close()
+        except:
+            self.pool.discard(conn)
+            raise
+        else:
+            self.pool.put(conn)
@@ -6,6 +6,46 @@ import requests
 import requests_cache
 import time
 
+from ..utils.singleflight import SingleFlight
+
+def parse_symbol(data, key):
+    """Parses a value out of a JSON result set of rest.genenames.org/fetch/symbol/%s
+
+    Args:
+        data (json): the result set.
+        key (str): e.g. alias_symbol, uniprotids, refseqids
+
+    Returns: the value of the key of the first symbol, None if not there.
+
+    """
+    try:
+        info = data['response']['docs'][0][key]
+    except (KeyError, IndexError):
+        return None
+
+    return info
+
+def parse_official(data, omim_morbid=None):
+    """Parses the official HGNC symbol out of a JSON result set
+    fetched from genenames.org.
+    On missing OMIM morbid number, the first HGNC symbol is returned
+
+    Args:
+        data (json): result set from querying rest.genenames.org/fetch/symbol/%s
+        omim_morbid (str, opt): an option omim morbid number
+
+    Returns (str): the official HGNC identifier
+
+    """
+    if omim_morbid == None:
+        return data['response']['docs'][0]['symbol']
+
+    for symbols in data['response']['docs']:
+        if str(symbols['omim_id'][0]) == str(omim_morbid):
+            return symbols['symbol']
+
+    return None
+
 class Genenames(object):
     """Basic interface to the public genenames API.
 
@@ -13,6 +53,8 @@ class Genenames(object):
         response_format (str): format for response (xml, json, etc.)
     """
 
+    flights = SingleFlight() # identical requests in flight, of all instances
+
     def __init__(self, response_format='application/json'):
         super(Genenames, self).__init__()
         self.base_url = 'http://rest.genenames.org/'
@@ -33,11 +75,15 @@ class Genenames(object):
             'Accept': self.format
         }
 
-        res = requests.get(url, headers=headers)
+        def request():
+            res = requests.get(url, headers=headers)
 
-        if not res.from_cache:
-            time.sleep(0.25) # wait for 250ms, play nice
+            if not res.from_cache:
+                time.sleep(0.25) # wait for 250ms, play nice
+            return res
 
+        # concurrent callers of the same url share one request
+        res = self.flights.do((url, self.format), request)
         return res.json()
 
     def fetch_symbol(self, hgnc_symbol, key):
@@ -51,12 +97,7 @@ class Genenames(object):
 
         """
         data = self.get("fetch/symbol/%s" % hgnc_symbol)
-        try:
-            info = data['response']['docs'][0][key]
-        except (KeyError, IndexError):
-            return None
-
-        return info
+        return parse_symbol(data, key)
 
     def omim(self, hgnc_symbol):
         """Fetches the OMIM morbid id.
@@ -103,25 +144,8 @@ class Genenames(object):
         return self.fetch_symbol(hgnc_symbol, 'refseq_accession')
 
     def _parse_official(self, data, omim_morbid=None):
-        """Parses the official HGNC symbol out of a JSON result set
-        fetched from genenames.org.
-        On missing OMIM morbid number, the first HGNC symbol is returned
-
-        Args:
-            data (json): result set from querying rest.genenames.org/fetch/symbol/%s
-            omim_morbid (str, opt): an option omim morbid number
-
-        Returns (str): the official HGNC identifier
-
-        """
-        if omim_morbid == None:
-            return data['response']['docs'][0]['symbol']
-
-        for symbols in data['response']['docs']:
-            if str(symbols['omim_id'][0]) == str(omim_morbid):
-                return symbols['symbol']
-
-        return None
+        """See parse_official."""
+        return parse_official(data, omim_morbid)
 
     def official(self, hgnc_symbol, omim_morbid=None):
         """Fetches the HGNC official symbol for this HGNC symbol. On multiple matches,
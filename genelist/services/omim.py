@@ -7,6 +7,8 @@ import time
 import requests
 import requests_cache
 
+from ..utils.singleflight import SingleFlight
+
 def format_entry(json_entry):
   """Extract interesting information from a single OMIM entry."""
   # extract nested titles section
@@ -48,6 +50,26 @@ def format_entry(json_entry):
 
   return data
 
+def pick_entry(entries):
+  """Picks the first entry with phenotypes out of the entries of an OMIM search.
+
+  Args:
+    entries (list): the entryList of an OMIM search response.
+
+  Returns (dict): the formatted entry, see format_entry.
+  """
+  # don't check further if we don't have anything
+  if not entries:
+    return format_entry({})
+
+  for entry in entries:
+    if 'geneMap' in entry['entry']:
+      if 'phenotypeMapList' in entry['entry']['geneMap']:
+        return format_entry(entry['entry'])
+
+  # no phenotypes found, return something
+  return format_entry(entries[0]['entry'])
+
 
 class OMIM(object):
 
@@ -61,6 +83,8 @@ class OMIM(object):
     response_format (str): format for response (xml, json, etc.)
   """
 
+  flights = SingleFlight() # identical searches in flight, of all instances
+
   def __init__(self, api_key, response_format='json'):
     super(OMIM, self).__init__()
     self.base_url = 'http://api.omim.org/api'
@@ -217,18 +241,7 @@ class OMIM(object):
 
   def gene(self, hgnc_symbol=None, mim_number=None):
     entries = self.search_gene(hgnc_symbol=hgnc_symbol, mim_number=mim_number)
-
-    # don't check further if we don't have anything
-    if not entries:
-      return format_entry({})
-
-    for entry in entries:
-      if 'geneMap' in entry['entry']:
-        if 'phenotypeMapList' in entry['entry']['geneMap']:
-          return format_entry(entry['entry'])
-
-    # no phenotypes found, return something
-    return format_entry(entries[0]['entry'])
+    return pick_entry(entries)
 
   def search_gene(self, hgnc_symbol=None, mim_number=None, include=('geneMap', 'dates')):
     """Search for MIM number for a HGNC approved symbol.
@@ -251,15 +264,20 @@ class OMIM(object):
         params['search'] = "approved_gene_symbol:%s" % hgnc_symbol
     params['include'] = include
 
+    def request():
+      res = requests.get(url, params=params)
+      if not res.from_cache:
+          time.sleep(0.25) # wait for 250ms as according to OMIM specs
+      return res
+
     res = False
     sleep = 0
     retry = True # Execute the first
     while retry or res.status_code == requests.codes.conflict:
         try:
           retry = False
-          res = requests.get(url, params=params)
-          if not res.from_cache:
-              time.sleep(0.25) # wait for 250ms as according to OMIM specs
+          # concurrent searches for the same gene share one request
+          res = self.flights.do((url, params['search'], tuple(include)), request)
         except TypeError:
             retry = True
         except ProtocolError:
@@ -1,13 +1,106 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import io
 import sys
 import requests
 import requests_cache
 import time
 import xmltodict
+from xml.etree import ElementTree
+from requests.utils import parse_header_links
 
 from ..utils import cleanup_description
+from ..utils.singleflight import SingleFlight
+
+def parse_description(data):
+    """Parses the recommended full name out of a parsed UniProt XML entry.
+
+    Args:
+        data (dict): a UniProt entry, parsed with xmltodict.
+
+    Returns (str): descriptive text, None if not there
+
+    """
+    try:
+        info = data['uniprot']['entry']['protein']['recommendedName']['fullName']
+        if '#text' in info:
+            info = info['#text']
+    except (KeyError, IndexError):
+        return None
+
+    return cleanup_description(info)
+
+SEARCH_URL = 'https://rest.uniprot.org/uniprotkb/search'
+SEARCH_FIELDS = 'accession,sec_acc,protein_name'
+SEARCH_SIZE = 500 # results per page, the rest is on the next pages
+
+def search_params(accessions, reviewed_only=False):
+    """Returns (dict): the parameters of a search for the protein names of accessions."""
+    query = '(' + ' OR '.join('accession:%s' % accession for accession in accessions) + ')'
+    if reviewed_only:
+        query += ' AND reviewed:true'
+    return {'query': query, 'fields': SEARCH_FIELDS, 'format': 'json', 'size': SEARCH_SIZE}
+
+def next_link(link):
+    """Returns (str): the URL of the next page of search results, out of the Link header of a
+    page, None on the last page."""
+    for link in parse_header_links(link or ''):
+        if link.get('rel') == 'next':
+            return link['url']
+    return None
+
+def parse_entries(data, accessions):
+    """Parses the entries out of a JSON result set of a search, see search_params.
+
+    Args:
+        data (json): the result set.
+        accessions (list): the accessions searched for, primary or secondary.
+
+    Returns (dict): accession: {'accession': the primary accession, 'reviewed': bool, 'description':
+                    the recommended full name as fetch_description, None if not there}
+                    for each accession found
+    """
+    accessions = set(accessions)
+    entries = {}
+    for result in data.get('results', []):
+        try:
+            description = cleanup_description(result['proteinDescription']['recommendedName']['fullName']['value'])
+        except KeyError:
+            description = None
+        entry = {
+            'accession': result['primaryAccession'],
+            'reviewed': result.get('entryType', '').startswith('UniProtKB reviewed'),
+            'description': description,
+        }
+        for accession in [result['primaryAccession']] + result.get('secondaryAccessions', []):
+            if accession in accessions and (accession not in entries or accession == entry['accession']):
+                entries[accession] = entry
+    return entries
+
+FULL_NAME_PATH = ['uniprot', 'entry', 'protein', 'recommendedName', 'fullName']
+
+def parse_description_xml(source):
+    """Parses the recommended full name out of a UniProt XML entry incrementally, as
+    parse_description does out of the whole tree. Stops at the end of the full name, that
+    is near the top of an entry, and frees the elements that were read.
+
+    Args:
+        source (file): the XML, a binary file object, e.g. io.BytesIO(content).
+
+    Returns (str): descriptive text, None if not there
+
+    """
+    path = []
+    for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            path.append(element.tag.rpartition('}')[2])
+            continue
+        if path == FULL_NAME_PATH:
+            return cleanup_description(element.text) if element.text else None
+        path.pop()
+        element.clear()
+    return None
 
 class Uniprot(object):
     """Basic interface to the public UniProt API.
@@ -16,6 +109,8 @@ class Uniprot(object):
         response_format (str): format for response (xml, json, etc.)
     """
 
+    flights = SingleFlight() # identical requests in flight, of all instances
+
     def __init__(self, response_format='application/xml'):
         super(Uniprot, self).__init__()
         self.base_url = 'http://www.uniprot.org/uniprot'
@@ -36,11 +131,15 @@ class Uniprot(object):
             'Accept': self.format
         }
 
-        res = requests.get(url, headers=headers)
+        def request():
+            res = requests.get(url, headers=headers)
 
-        if not res.from_cache:
-            time.sleep(0.25) # wait for 250ms, play nice
+            if not res.from_cache:
+                time.sleep(0.25) # wait for 250ms, play nice
+            return res
 
+        # concurrent callers of the same url share one request
+        res = self.flights.do((url, self.format), request)
         return xmltodict.parse(res.text)
 
     def fetch_description(self, uniprot_id):
@@ -52,12 +151,50 @@ class Uniprot(object):
         Returns (str): descriptive text
 
         """
-        data = self.get("%s.xml" % uniprot_id)
-        try:
-            info = data['uniprot']['entry']['protein']['recommendedName']['fullName']
-            if '#text' in info:
-                info = info['#text']
-        except (KeyError, IndexError):
-            return None
+        url = "%s/%s.xml" % (self.base_url, uniprot_id)
+        headers = {
+            'Accept': self.format
+        }
 
-        return cleanup_description(info)
+        def request():
+            res = requests.get(url, headers=headers)
+
+            if not res.from_cache:
+                time.sleep(0.25) # wait for 250ms, play nice
+            return res
+
+        # parse up to the full name, rather than the whole entry as get does
+        res = self.flights.do((url, self.format), request)
+        return parse_description_xml(io.BytesIO(res.content))
+
+    def fetch_entries(self, accessions, reviewed_only=False):
+        """Fetches the recommended names of many accessions in one search, page by page, instead of an
+        entry per accession as fetch_description does.
+
+        Args:
+            accessions (list): UniProt IDs, at most a few hundred.
+            reviewed_only (bool, False): only the reviewed (Swiss-Prot) entries.
+
+        Returns (dict): see parse_entries
+
+        """
+        accessions = sorted(set(accessions))
+        if not accessions:
+            return {}
+
+        def request(url, params):
+            res = requests.get(url, params=params)
+
+            if not res.from_cache:
+                time.sleep(0.25) # wait for 250ms, play nice
+            return res
+
+        # follow the pages of the search, an accession can match more than one entry
+        results = []
+        url, params = SEARCH_URL, search_params(accessions, reviewed_only)
+        while url:
+            res = self.flights.do((url, params and params['query']), request, url, params)
+            res.raise_for_status()
+            results.extend(res.json().get('results', []))
+            url, params = next_link(res.headers.get('Link')), None
+        return parse_entries({'results': results}, accessions)
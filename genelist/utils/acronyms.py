@@ -4,55 +4,140 @@
 # TODO load the acronyms from a folder provided through a config file
 
 from __future__ import print_function
+import os
 import re
 import sys
 import glob
+import json
 
-class Acronyms(object):
+INDEX_FILE = '.genelist-panels.json'
 
-    def __init__(self, base_dir):
-        """Reads in the LISTS files from the git repo's to get gene list and panel descriptions.
-        Reads in all gene lists to gather all the panels for each gene list. Will fail silently
-        when no panels are found or on faulty lines in the gene list.
+def read_panels(gl):
+    """Reads the panels of a gene list. Will fail silently on faulty lines.
 
-        Args:
-            base_dir (str): full path to the basedir of the repo's
-        """
+    Args:
+        gl (str): path to a gene list
 
-        self.acronyms = {} # acro: long text
-        self.panels   = {} # acro: list of panels (acro)
+    Returns (list): the panels (acronyms) of the gene list
+    """
+    panels = {}
+    with open(gl, 'r') as f:
+        for line in f:
+            line = line.strip()
 
-        #for cust in glob.glob(base_dir + '/cust*'):
-        for list_file in glob.glob(base_dir + '/*/LISTS'):
-            f = open(list_file)
-            for line in f.readlines():
-                acro, sep, full_name = line.strip().partition(': ')
-                self.acronyms[acro] = full_name
+            # skip comments
+            if line.startswith('#'):
+                continue
 
-        re_gl_name = re.compile(r'cust...-(.*).txt')
-        for gl in glob.glob(base_dir + '/*/cust*txt'):
-            gl_name = re.search(re_gl_name, gl).group(1)
+            l = line.split('\t')
 
-            with open(gl, 'r') as f:
-                lines = (line.strip() for line in f.readlines())
-                panels = {}
+            if len(l) < 18: # skip faulty lines silently
+                continue
 
-                for line in lines:
-                    # skip comments
-                    if line.startswith('#'):
-                        continue
+            for cur_panel in l[17].split(','):
+                panels[cur_panel.strip()] = 1
 
-                    l = line.split('\t')
+    return list(panels.keys())
 
-                    if len(l) < 18: # skip faulty lines silently
-                        continue
+class Acronyms(object):
 
-                    cur_panels = l[17].split(',')
-                    cur_panels = ( panel.strip() for panel in cur_panels )
-                    for cur_panel in cur_panels:
-                        panels[cur_panel] = 1
+    def __init__(self, base_dir, index_file=INDEX_FILE):
+        """Looks up gene list and panel descriptions in the LISTS files of the git repo's and
+        the panels of each gene list. Both are read on first use. The panels of each gene list
+        are kept in an index file in base_dir, a gene list is only read again when its
+        modification time or size changed. Will fail silently when no panels are found, on
+        faulty lines in the gene list or when the index can't be written.
+
+        Args:
+            base_dir (str): full path to the basedir of the repo's
+            index_file (str, optional): name of the index file in base_dir, None to not keep one
+        """
 
-                self.panels[gl_name] = panels.keys()
+        self.base_dir = base_dir
+        self.index_file = os.path.join(base_dir, index_file) if index_file else None
+
+        self._acronyms = None # acro: long text
+        self._panels   = {} # acro: list of panels (acro)
+        self._gene_lists = None # [(acro, path), ]
+        self._index = None # path relative to base_dir: {'mtime': s, 'size': bytes, 'panels': list of panels}
+        self._index_changed = False
+
+    @property
+    def acronyms(self):
+        """dict: acro: long text, read from all LISTS files"""
+        if self._acronyms is None:
+            self._acronyms = {}
+            for list_file in glob.glob(self.base_dir + '/*/LISTS'):
+                with open(list_file) as f:
+                    for line in f:
+                        acro, sep, full_name = line.strip().partition(': ')
+                        self._acronyms[acro] = full_name
+        return self._acronyms
+
+    @property
+    def panels(self):
+        """dict: acro: list of panels (acro), for all gene lists. The index is written once."""
+        missing = set(acronym for acronym, gl in self.gene_lists if acronym not in self._panels)
+        for acronym, gl in self.gene_lists:
+            if acronym in missing:
+                self._panels[acronym] = self._read_panels(gl)
+        self._save_index()
+        return self._panels
+
+    @property
+    def gene_lists(self):
+        """list: (acro, path) of all gene lists"""
+        if self._gene_lists is None:
+            re_gl_name = re.compile(r'cust...-(.*).txt')
+            self._gene_lists = [(re.search(re_gl_name, gl).group(1), gl)
+                                for gl in glob.glob(self.base_dir + '/*/cust*txt')]
+        return self._gene_lists
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            if self.index_file:
+                try:
+                    with open(self.index_file) as f:
+                        self._index = json.load(f)
+                except (IOError, OSError, ValueError):
+                    pass
+        return self._index
+
+    def _save_index(self):
+        """Writes the index when it changed. Gene lists that are gone are left out."""
+        if not self.index_file:
+            return
+        index = self._load_index()
+        gene_lists = set(os.path.relpath(gl, self.base_dir) for acronym, gl in self.gene_lists)
+        for key in set(index) - gene_lists:
+            del index[key]
+            self._index_changed = True
+        if not self._index_changed:
+            return
+        tmp_file = self.index_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self._index, f, indent=1, sort_keys=True)
+            os.rename(tmp_file, self.index_file)
+            self._index_changed = False
+        except (IOError, OSError):
+            pass
+
+    def _read_panels(self, gl):
+        """Returns (list): the panels of a gene list from the index, reads the gene list
+        when it is not in the index or changed since."""
+        index = self._load_index()
+        key = os.path.relpath(gl, self.base_dir)
+        stat = os.stat(gl)
+        entry = index.get(key)
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return entry['panels']
+
+        panels = read_panels(gl)
+        index[key] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'panels': panels}
+        self._index_changed = True
+        return panels
 
     def __getitem__(self,  acronym, cust=None):
         """Retrieve the acronym description
@@ -75,7 +160,12 @@ class Acronyms(object):
 
         Returns: a list of panels (acronyms)
         """
-        return self.panels.get(acronym, [])
+        if acronym not in self._panels:
+            for gl_name, gl in self.gene_lists:
+                if gl_name == acronym:
+                    self._panels[acronym] = self._read_panels(gl)
+            self._save_index()
+        return self._panels.get(acronym, [])
 
 def main(args):
     acrs = Acronyms(args[0])
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+""" Blocked gzip (BGZF) gene lists with a sidecar index of block offsets per contig and bin """
+
+import json
+import zlib
+import struct
+
+from .sort import chromosome_key, sorted_runs, merge_runs
+
+BLOCK_SIZE = 0xff00 # max uncompressed bytes per block, as htslib
+BIN_SIZE = 1 << 14 # 16kb windows of the linear index
+INDEX_SUFFIX = '.gli.json'
+INDEX_COLUMNS = ('Chromosome', 'Gene_start', 'Gene_stop') # write_indexed needs these columns
+
+BLOCK_HEADER = struct.Struct('<4BI2BH2BHH') # gzip header with the BC extra subfield
+BLOCK_TRAILER = struct.Struct('<II') # CRC32, ISIZE
+EOF_BLOCK = bytes(bytearray.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000'))
+
+def is_gzipped(path):
+    """Returns (bool): whether the file starts with the gzip magic."""
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+class BgzfWriter(object):
+    """Writes BGZF: gzip members of at most 64kb each, so a reader can seek to any block.
+    A position in the file is a virtual offset: the offset of the block << 16 | the offset
+    in the uncompressed block.
+
+    Args:
+        fileobj (file): a file opened in binary mode.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.block_offset = 0
+        self.buffer = b''
+
+    def tell(self):
+        """Returns (int): the virtual offset of the next byte written."""
+        return self.block_offset << 16 | len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._write_block(self.buffer[:BLOCK_SIZE])
+            self.buffer = self.buffer[BLOCK_SIZE:]
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = BLOCK_HEADER.size + len(compressed) + BLOCK_TRAILER.size
+        self.fileobj.write(BLOCK_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1))
+        self.fileobj.write(compressed)
+        self.fileobj.write(BLOCK_TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data)))
+        self.block_offset += block_size
+
+    def close(self):
+        if self.buffer:
+            self._write_block(self.buffer)
+            self.buffer = b''
+        self.fileobj.write(EOF_BLOCK)
+        self.fileobj.close()
+
+class BgzfReader(object):
+    """Reads the lines of a BGZF file from a virtual offset, see BgzfWriter.
+
+    Args:
+        fileobj (file): a file opened in binary mode.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.block = b''
+        self.position = 0
+
+    def seek(self, virtual_offset):
+        self.fileobj.seek(virtual_offset >> 16)
+        self.block = self._read_block()
+        self.position = virtual_offset & 0xffff
+
+    def _read_block(self):
+        header = self.fileobj.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return b''
+        block_size = BLOCK_HEADER.unpack(header)[-1] + 1
+        rest = self.fileobj.read(block_size - BLOCK_HEADER.size)
+        return zlib.decompress(header + rest, 31)
+
+    def __iter__(self):
+        pending = b''
+        while self.block:
+            end = self.block.find(b'\n', self.position)
+            if end == -1:
+                pending += self.block[self.position:]
+                self.block, self.position = self._read_block(), 0
+                continue
+            yield (pending + self.block[self.position:end + 1]).decode('utf-8')
+            pending = b''
+            self.position = end + 1
+        if pending:
+            yield pending.decode('utf-8')
+
+    def close(self):
+        self.fileobj.close()
+
+def write_indexed(lines, path, max_lines=100000):
+    """Writes a gene list sorted on contig and start as BGZF, with an index in path + INDEX_SUFFIX.
+    The leading # lines are kept in front. The data lines are sorted in runs of max_lines that
+    are spilled to disk, as merge_panels_sorted.
+
+    The index is JSON with the virtual offset of the first data line and, per contig in file
+    order, the virtual offset of its first line and for each BIN_SIZE window the virtual offset
+    of the first line that overlaps the window, as the linear index of tabix.
+
+    Args:
+        lines (iterable): the lines of a gene list, without line ends.
+        path (str): the path to write to.
+        max_lines (int, 100000): the maximum nr of lines to sort in memory.
+    """
+    lines = iter(lines)
+    header_lines = []
+    for line in lines:
+        header_lines.append(line)
+        if not line.startswith('##'):
+            break
+    header = header_lines[-1].lstrip('#').split('\t') if header_lines else []
+    missing = [column for column in INDEX_COLUMNS if column not in header]
+    if missing:
+        raise ValueError('Can only index gene lists with the {} columns, missing {}'.\
+                         format(', '.join(INDEX_COLUMNS), ', '.join(missing)))
+    chromosome_i, start_i, stop_i = [header.index(column) for column in INDEX_COLUMNS]
+
+    def to_int(value):
+        return int(value) if value.strip().isdigit() else 0
+
+    def key_lines():
+        for line_nr, line in enumerate(lines):
+            fields = line.split('\t')
+            yield [chromosome_key(fields[chromosome_i].strip()), to_int(fields[start_i]), line_nr], line
+    data_lines = merge_runs(sorted_runs(key_lines(), max_lines))
+
+    writer = BgzfWriter(open(path, 'wb'))
+    for line in header_lines:
+        writer.write((line + '\n').encode('utf-8'))
+
+    index = {'bin_size': BIN_SIZE, 'data_offset': writer.tell(), 'contigs': []}
+    contig = None
+    for key, line in data_lines:
+        fields = line.split('\t')
+        chromosome = fields[chromosome_i].strip()
+        if contig is None or contig['name'] != chromosome:
+            contig = {'name': chromosome, 'offset': writer.tell(), 'bins': []}
+            index['contigs'].append(contig)
+
+        start = to_int(fields[start_i])
+        stop = max(to_int(fields[stop_i]), start)
+        bins = contig['bins']
+        if len(bins) <= stop // BIN_SIZE:
+            bins.extend([None] * (stop // BIN_SIZE + 1 - len(bins)))
+        for i in range(start // BIN_SIZE, stop // BIN_SIZE + 1):
+            if bins[i] is None:
+                bins[i] = writer.tell()
+
+        writer.write((line + '\n').encode('utf-8'))
+    writer.close()
+
+    with open(path + INDEX_SUFFIX, 'w') as f:
+        json.dump(index, f)
+
+def read_region(path, chromosome, start=None, stop=None):
+    """Reads the lines of a contig, or of a region of it, with the index of write_indexed.
+    Seeks to the first line that can overlap the region and stops at the first line after it.
+
+    Args:
+        path (str): path to a gene list written by write_indexed.
+        chromosome (str): the contig.
+        start (int, optional): 1-based start of the region.
+        stop (int, optional): inclusive stop of the region.
+
+    Returns (tuple): (header lines, data lines) with the # lines and the data lines in the region.
+    """
+    with open(path + INDEX_SUFFIX) as f:
+        index = json.load(f)
+
+    reader = BgzfReader(open(path, 'rb'))
+    reader.seek(0)
+    header_lines = []
+    for line in reader:
+        header_lines.append(line)
+        if not line.startswith('##'):
+            break
+    header = header_lines[-1].rstrip('\r\n').lstrip('#').split('\t')
+    chromosome_i, start_i, stop_i = [header.index(column) for column in ('Chromosome', 'Gene_start', 'Gene_stop')]
+
+    contig = next((contig for contig in index['contigs'] if contig['name'] == chromosome), None)
+
+    def region_lines():
+        try:
+            offset = contig['offset'] if contig else None
+            if contig and start is not None:
+                bins = contig['bins'][start // index['bin_size']:]
+                offset = next((offset for offset in bins if offset is not None), None)
+            if offset is None:
+                return
+            reader.seek(offset)
+            for line in reader:
+                fields = line.rstrip('\r\n').split('\t')
+                if fields[chromosome_i].strip() != chromosome:
+                    break
+                line_start = int(fields[start_i]) if fields[start_i].strip().isdigit() else 0
+                line_stop = int(fields[stop_i]) if fields[stop_i].strip().isdigit() else line_start
+                if stop is not None and line_start > stop:
+                    break
+                if start is not None and line_stop < start:
+                    continue
+                yield line
+        finally:
+            reader.close()
+
+    return header_lines, region_lines()
@@ -3,7 +3,9 @@
 
 from __future__ import absolute_import, unicode_literals
 from datetime import datetime
+import heapq
 import subprocess
+import threading
 import os
 
 def getgittag(filename, date=None, full_tag=False):
@@ -18,20 +20,17 @@ def getgittag(filename, date=None, full_tag=False):
     Returns (str): a version (tag) of the gene list
 
     """
-    cwd = os.getcwd()
-    os.chdir(os.path.dirname(os.path.abspath(filename)))
+    git = ['git', '-C', os.path.dirname(os.path.abspath(filename))]
 
     try:
-        command = ['git', 'describe']
+        command = git + ['describe']
         if date:
-            commit_sha1 = subprocess.check_output(['git', 'rev-list', '-n', '1', '--before=%s' % date, 'master']).decode('utf-8').strip()
+            commit_sha1 = subprocess.check_output(git + ['rev-list', '-n', '1', '--before=%s' % date, 'master']).decode('utf-8').strip()
             command.extend( ('--tags', commit_sha1) )
         tag = subprocess.check_output(command).decode('utf-8').strip()
     except subprocess.CalledProcessError:
         return None
 
-    os.chdir(cwd)
-
     if not full_tag and '-' in tag:
         return tag.split('-', 1)[-1] # split ony the first occurence of '-'
     return tag
@@ -45,10 +44,8 @@ def getgitlastmoddate(filename, date_format='%Y%m%d'):
     Returns (str|bool): return date (e.g. 20150225) or False no date
 
     """
-    cwd = os.getcwd()
-    os.chdir(os.path.dirname(os.path.abspath(filename)))
-    full_str_date = subprocess.check_output(['git', 'log', '-1', '--format=%cd', '--', filename]).decode('utf-8').strip()
-    os.chdir(cwd)
+    filename = os.path.abspath(filename)
+    full_str_date = subprocess.check_output(['git', '-C', os.path.dirname(filename), 'log', '-1', '--format=%cd', '--', filename]).decode('utf-8').strip()
 
     if not full_str_date:
         return False
@@ -58,6 +55,351 @@ def getgitlastmoddate(filename, date_format='%Y%m%d'):
 
     return full_date.strftime(date_format)
 
+def parse_commit_date(full_str_date):
+    """Parses a git commit date as getgitlastmoddate does: the timezone is dropped.
+
+    Args:
+        full_str_date (str): e.g. Mon Feb 9 14:19:16 2015 +0100
+
+    Returns (datetime): the commit date
+    """
+    return datetime.strptime(full_str_date.partition('+')[0], '%a %b %d %H:%M:%S %Y ')
+
+def shorten_tag(tag, full_tag=False):
+    """Strips the list name from a tag, e.g. CMMS-2.1 becomes 2.1, see getgittag."""
+    if tag and not full_tag and '-' in tag:
+        return tag.split('-', 1)[-1] # split ony the first occurence of '-'
+    return tag
+
+class GitIndex(object):
+    """Commits and tags of one repository, read with one walk through the history and one
+    listing of the refs. Answers the last commit of a file, the branch commit on or before a
+    date and git describe from memory. Safe to share between threads.
+
+    The walk lists the files each commit changed, for a merge against each of its parents.
+    With merges in the history of HEAD, the last commit of a file is found as git log -- <file>
+    finds it: a merge is followed to the first parent it took the file from, and is itself the
+    last commit when it took the file from none of them. Git is only asked per file, as
+    getgitlastmoddate does, when the changes of a merge on the way are not known.
+
+    Args:
+        repo (str): the toplevel dir of the repository
+        branch (str, 'master'): branch to look for the commit on or before a date.
+    """
+
+    def __init__(self, repo, branch='master'):
+        self.repo = repo
+        self.branch = branch
+        self.lock = threading.RLock()
+        self.loaded = False
+
+        self.files = {} # path relative to repo: (sha1, timestamp, commit date) of the last commit
+        self.linear = True # no merges in the history of HEAD, files holds the last commits
+        self.simplified = {} # path relative to repo: last commit as git log -1 -- <file>
+        self.parents = {} # sha1: [parent sha1, ]
+        self.commits = {} # sha1: (timestamp, commit date)
+        self.trees = {} # sha1: tree sha1
+        self.changes = {} # sha1: [set of paths changed against each parent], None if not known
+        self.abbrevs = {} # sha1: abbreviated sha1
+        self.head = None # sha1 of HEAD
+        self.walk = [] # (sha1, timestamp) of the branch, in git log order
+        self.tag_map = {} # commit sha1: [(tag, annotated), ]
+        self.before = {} # timestamp: sha1
+        self.described = {} # (sha1, tags): tag
+
+    def git(self, *args):
+        """Runs a git command in the repository.
+
+        Returns (str): the output of the command
+        """
+        command = ['git', '-C', self.repo, '-c', 'core.quotepath=off'] + list(args)
+        with open(os.devnull, 'wb') as devnull: # subprocess.DEVNULL is python 3 only
+            return subprocess.check_output(command, stderr=devnull).decode('utf-8')
+
+    def load(self):
+        """Reads the history of HEAD with the changed files per commit and the tags.
+        The branch is walked separately only when it is not checked out."""
+        with self.lock:
+            if self.loaded:
+                return
+
+            walk = self._read_log('-m', '--name-only', '--no-renames', 'HEAD')
+            if walk:
+                self.head = walk[0][0]
+            self.linear = all(len(self.parents[sha1]) <= 1 for sha1, timestamp in walk)
+
+            branch_sha1 = None
+            try:
+                refs = self.git('for-each-ref', '--format=%(objecttype) %(objectname) %(*objectname) %(refname)',
+                                'refs/tags', 'refs/heads/' + self.branch)
+            except subprocess.CalledProcessError:
+                refs = ''
+            for line in refs.splitlines():
+                objecttype, sha1, peeled, refname = line.split(' ', 3)
+                if refname.startswith('refs/heads/'):
+                    branch_sha1 = sha1
+                    continue
+                annotated = objecttype == 'tag'
+                commit = peeled if annotated else sha1
+                self.tag_map.setdefault(commit, []).append((refname[len('refs/tags/'):], annotated))
+
+            if branch_sha1 and branch_sha1 != self.head:
+                walk = self._read_log(self.branch)
+            elif not branch_sha1:
+                walk = []
+            self.walk = walk
+
+            self.loaded = True
+
+    def _read_log(self, *args):
+        """Reads the commits of git log into parents, abbrevs and, with -m --name-only, files
+        and changes.
+
+        Returns (list): (sha1, timestamp) of the commits in git log order
+        """
+        try:
+            log = self.git('log', '--format=%x00%H%x09%T%x09%P%x09%h%x09%ct%x09%cd', *args)
+        except subprocess.CalledProcessError: # no commits yet
+            return []
+
+        walk = []
+        changes = {} # sha1: [set of paths of each diff git log -m printed]
+        for entry in log.split('\0')[1:]:
+            commit, _, names = entry.partition('\n')
+            sha1, tree, parents, abbrev, timestamp, date = commit.split('\t')
+            names = set(name for name in names.split('\n') if name)
+            if sha1 in changes: # the diff against a next parent of a merge
+                changes[sha1].append(names)
+                continue
+            changes[sha1] = [names]
+
+            timestamp = int(timestamp)
+            self.parents[sha1] = parents.split()
+            self.abbrevs[sha1] = abbrev
+            self.commits[sha1] = (timestamp, date)
+            self.trees[sha1] = tree
+            walk.append((sha1, timestamp))
+            for name in names:
+                if name not in self.files:
+                    self.files[name] = (sha1, timestamp, date)
+
+        if '--name-only' in args:
+            for sha1, diffs in changes.items():
+                self.changes[sha1] = self._align_changes(sha1, diffs)
+        return walk
+
+    def _align_changes(self, sha1, diffs):
+        """Returns (list): the paths a commit changed against each of its parents, None if
+        that is not known. git log -m leaves out the empty diff against a parent with the
+        same tree as the merge, the others are printed in the order of the parents."""
+        parents = self.parents[sha1]
+        if len(parents) <= 1:
+            return diffs[:1]
+        if len(diffs) == len(parents):
+            return diffs
+
+        diffs = iter([diff for diff in diffs if diff])
+        changes = []
+        for parent in parents:
+            if parent not in self.trees:
+                return None
+            changes.append(set() if self.trees[parent] == self.trees[sha1] else next(diffs, None))
+        if None in changes or next(diffs, None) is not None:
+            return None
+        return changes
+
+    def last_commit(self, path):
+        """Returns (tuple): (sha1, timestamp, commit date) of the last commit of a file
+        relative to the repository, None if it is not committed."""
+        self.load()
+        if self.linear:
+            return self.files.get(path)
+
+        with self.lock:
+            if path not in self.simplified:
+                try:
+                    sha1 = self._simplify(path)
+                    self.simplified[path] = (sha1, ) + self.commits[sha1] if sha1 else None
+                except KeyError: # the changes of a merge are not known, ask git
+                    log = self.git('log', '-1', '--format=%H%x09%ct%x09%cd', '--', path).strip()
+                    if log:
+                        sha1, timestamp, date = log.split('\t')
+                        self.simplified[path] = (sha1, int(timestamp), date)
+                    else:
+                        self.simplified[path] = None
+            return self.simplified[path]
+
+    def _simplify(self, path):
+        """Walks the history of HEAD newest commit first, as git log -- <path> does, following
+        a merge only to the first parent with the same path (TREESAME).
+
+        Returns (str): the sha1 of the first commit that changed the path, None if there is none
+        Raises (KeyError): when the walk reaches a commit whose changes are not known
+        """
+        if self.head is None:
+            return None
+        heap = [(-self.commits[self.head][0], 0, self.head)]
+        seen = set([self.head])
+        while heap:
+            timestamp, order, sha1 = heapq.heappop(heap)
+            changes = self.changes[sha1]
+            if changes is None:
+                raise KeyError(sha1)
+            parents = self.parents[sha1]
+            if not parents: # the root commit, changed against the empty tree
+                if path in changes[0]:
+                    return sha1
+                continue
+            same = [parent for parent, changed in zip(parents, changes) if path not in changed]
+            if not same:
+                return sha1
+            if same[0] not in seen:
+                seen.add(same[0])
+                heapq.heappush(heap, (-self.commits[same[0]][0], len(seen), same[0]))
+        return None
+
+    def commit_before(self, timestamp):
+        """Returns (str): the first commit of the branch on or before a timestamp,
+        as git rev-list -n 1 --before, None if there is none."""
+        self.load()
+        with self.lock:
+            if timestamp not in self.before:
+                self.before[timestamp] = next(
+                    (sha1 for sha1, commit_timestamp in self.walk if commit_timestamp <= timestamp), None)
+            return self.before[timestamp]
+
+    def describe(self, sha1=None, tags=True):
+        """Describes a commit as git describe [--tags] does: the nearest tag, followed by the
+        number of commits since and the abbreviated sha1 when the commit is not tagged itself.
+        Git is asked when the history up to the tag is not linear or a commit has more tags.
+
+        Args:
+            sha1 (str, optional): the commit, defaults to HEAD.
+            tags (bool, True): also use lightweight tags.
+
+        Returns (str): the description, None if no tag describes the commit
+        """
+        self.load()
+        sha1 = sha1 or self.head
+        if sha1 is None:
+            return None
+        with self.lock:
+            if (sha1, tags) not in self.described:
+                self.described[(sha1, tags)] = self._describe(sha1, tags)
+            return self.described[(sha1, tags)]
+
+    def _describe(self, sha1, tags):
+        commit, count = sha1, 0
+        while commit in self.parents:
+            names = [name for name, annotated in self.tag_map.get(commit, []) if tags or annotated]
+            if len(names) == 1 and sha1 in self.abbrevs:
+                if count == 0:
+                    return names[0]
+                return '{}-{}-g{}'.format(names[0], count, self.abbrevs[sha1])
+            parents = self.parents[commit]
+            if names or len(parents) > 1:
+                break
+            if not parents: # reached the root without a tag
+                return None
+            commit, count = parents[0], count + 1
+
+        args = ['--tags', sha1] if tags else [sha1]
+        try:
+            return self.git('describe', *args).strip()
+        except subprocess.CalledProcessError:
+            return None
+
+class GitMetadata(object):
+    """Last modification date and tag of gene lists. Keeps a GitIndex per repository,
+    so each repository is read once for the run. Safe to share between threads.
+
+    Args:
+        branch (str, 'master'): branch to look for the commit on the last modification date.
+    """
+
+    def __init__(self, branch='master'):
+        self.branch = branch
+        self.lock = threading.Lock()
+        self.repos = {} # dir: repo toplevel
+        self.indexes = {} # repo toplevel: GitIndex
+
+    def get_repo(self, filename):
+        """Returns the toplevel dir of the repo of filename, None if not in a repo."""
+        dirname = os.path.dirname(os.path.realpath(filename))
+        with self.lock:
+            if dirname not in self.repos:
+                try:
+                    command = ['git', '-C', dirname, 'rev-parse', '--show-toplevel']
+                    with open(os.devnull, 'wb') as devnull:
+                        self.repos[dirname] = subprocess.check_output(command, stderr=devnull).decode('utf-8').strip()
+                except subprocess.CalledProcessError:
+                    self.repos[dirname] = None
+            return self.repos[dirname]
+
+    def get_index(self, filename):
+        """Returns (GitIndex): the index of the repo of filename, None if not in a repo."""
+        repo = self.get_repo(filename)
+        if repo is None:
+            return None
+        with self.lock:
+            if repo not in self.indexes:
+                self.indexes[repo] = GitIndex(repo, self.branch)
+            index = self.indexes[repo]
+        index.load()
+        return index
+
+    def prefetch(self, filenames):
+        """Reads the repositories of all filenames.
+
+        Args:
+            filenames (list): paths to gene lists
+        """
+        for filename in filenames:
+            self.get_index(filename)
+
+    def last_commit(self, filename):
+        """Returns (tuple): (index, (sha1, timestamp, commit date)) of the last commit of filename,
+        the commit is None if filename is not committed."""
+        index = self.get_index(filename)
+        if index is None:
+            return None, None
+        path = os.path.relpath(os.path.realpath(filename), index.repo)
+        return index, index.last_commit(path)
+
+    def lastmoddate(self, filename, date_format='%Y%m%d'):
+        """Gets the last modification date of a gene list, as getgitlastmoddate.
+
+        Returns (str|bool): return date (e.g. 20150225) or False no date
+        """
+        index, commit = self.last_commit(filename)
+        if not commit:
+            return False
+        return parse_commit_date(commit[2]).strftime(date_format)
+
+    def tag(self, filename, full_tag=False):
+        """Gets the version of a gene list on its last modification date. When the gene list
+        is not committed, the current version of its repository.
+
+        Returns (str): a version (tag) of the gene list, None if there is none
+        """
+        index, commit = self.last_commit(filename)
+        if index is None:
+            return None
+        if not commit:
+            return self.head_tag(filename, full_tag)
+        sha1 = index.commit_before(commit[1])
+        return shorten_tag(index.describe(sha1) if sha1 else None, full_tag)
+
+    def head_tag(self, filename, full_tag=False):
+        """Gets the current version of the repository of a gene list, as getgittag without a date.
+
+        Returns (str): a version (tag) of the gene list, None if there is none
+        """
+        index = self.get_index(filename)
+        if index is None:
+            return None
+        return shorten_tag(index.describe(tags=False), full_tag)
+
 def main(args):
     print(getgitlastmoddate(__file__, '%c'))
 
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import heapq
+from itertools import groupby
+
+def find_overlaps(intervals):
+    """Finds all pairs of intervals that overlap, per chromosome. The intervals of a chromosome
+    are sorted on their start and swept once, keeping the intervals that are still open in a
+    heap on their stop, so this takes O(n log n + k) for k pairs. Intervals with the same
+    coordinates overlap as well.
+
+    Args:
+        intervals (iterable of tuples): (chromosome, start, stop, line_nr).
+                                        start and stop are int and inclusive.
+
+    Yields (tuple): (interval, other), the overlapping intervals as given. other comes before
+                    interval in the sweep.
+    """
+    for chromosome, chromosome_intervals in groupby(sorted(intervals), key=lambda i: i[0]):
+        active = [] # (stop, order, interval) of the intervals that may overlap the next ones
+        for order, interval in enumerate(chromosome_intervals):
+            while active and active[0][0] < interval[1]:
+                heapq.heappop(active)
+            for stop, other_order, other in active:
+                yield (interval, other)
+            heapq.heappush(active, (interval[2], order, interval))
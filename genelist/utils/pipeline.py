@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import sys
+import threading
+
+try:
+    import queue
+except ImportError: # python 2
+    import Queue as queue
+
+DONE = object() # end of the items of a stage
+
+class Failed(object):
+    """ An exception of a stage, passed on downstream and raised at the sink """
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+class Pipeline(object):
+    """Runs generator stages, each in a thread of its own, connected by bounded queues.
+    A stage takes an iterable of items and yields items, as the stages of Fetch.annotate.
+    Each stage handles its items in order, so the order of the items is kept at the sink.
+    A full queue blocks the stage that feeds it.
+
+    Each item carries the context of the thread that yielded it, e.g. the line nr to log
+    with. The context is set in the thread of the next stage before the stage gets the item,
+    and in the thread of the sink before the item is yielded.
+
+    Args:
+        stages (list): callables that take an iterable and return an iterable.
+        maxsize (int, 16): the maximum nr of items in a queue.
+        get_context (callable, optional): returns the context of the current thread.
+        set_context (callable, optional): sets the context of the current thread.
+    """
+
+    def __init__(self, stages, maxsize=16, get_context=None, set_context=None):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.get_context = get_context or (lambda: None)
+        self.set_context = set_context or (lambda context: None)
+        self.stopped = threading.Event()
+
+    def _put(self, q, item):
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        """Yields: the items of a queue, setting their context. Stops when the pipeline stops."""
+        while not self.stopped.is_set():
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is DONE:
+                return
+            if isinstance(item, Failed):
+                # on python 3 the exception keeps the traceback of the stage that raised it
+                raise item.exc_info[1]
+            context, item = item
+            self.set_context(context)
+            yield item
+
+    def _work(self, stage, context, inq, outq):
+        self.set_context(context)
+        try:
+            for item in stage(self._get(inq) if inq is not None else None):
+                if self.stopped.is_set():
+                    return
+                self._put(outq, (self.get_context(), item))
+            self._put(outq, DONE)
+        except BaseException:
+            self._put(outq, Failed(sys.exc_info()))
+
+    def run(self, items):
+        """Runs the stages on the items, the items are read in a thread as well.
+
+        Args:
+            items (iterable): the input of the first stage.
+
+        Yields: the output of the last stage, in order
+        """
+        context = self.get_context()
+        stages = [lambda ignored: items] + list(self.stages)
+        queues = [queue.Queue(self.maxsize) for stage in stages]
+        threads = []
+        for i, stage in enumerate(stages):
+            thread = threading.Thread(target=self._work,
+                                      args=(stage, context, queues[i - 1] if i else None, queues[i]))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for item in self._get(queues[-1]):
+                yield item
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+""" Coalesce identical calls that are in flight at the same time """
+
+import threading
+
+class Call(object):
+    """ A call in flight of SingleFlight """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """Coalesces concurrent calls of threads: the first caller of a key makes the call, the
+    callers of the same key that come in while it is in flight wait for its result or exception.
+    A call that comes in after is made again, caching is up to the function.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {} # key: Call
+        self.shared = 0 # nr of callers that got the result of another caller
+
+    def do(self, key, function, *args, **kwargs):
+        """Returns: the result of function(*args, **kwargs), of this call or of the one in
+        flight for key."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
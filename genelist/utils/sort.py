@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import json
+import heapq
+import tempfile
+from operator import itemgetter
+
+def chromosome_key(chromosome):
+    """ Returns (list): sorts chromosomes in karyotype order: 1-22, X, Y, MT, then the others """
+    chromosome = chromosome[3:] if chromosome.lower().startswith('chr') else chromosome
+    if chromosome.isdigit():
+        return [0, int(chromosome), '']
+    if chromosome in ('X', 'Y', 'M', 'MT'):
+        return [1, ('X', 'Y', 'M', 'MT').index(chromosome), '']
+    return [2, 0, chromosome]
+
+def sorted_runs(lines, max_lines, keep_last=True):
+    """ Sorts (key, line) pairs in runs of max_lines. All but the last run are spilled to disk.
+
+    Args:
+        lines (iterable): (key, line) pairs.
+        max_lines (int): the maximum nr of lines to keep in memory.
+        keep_last (bool, True): keep the last run in memory. When the runs of several inputs
+                                are merged, spill the last runs of all but one input.
+
+    Returns (list): the runs, iterables of sorted (key, line) pairs.
+    """
+    def spill(run):
+        spill_file = tempfile.TemporaryFile('w+')
+        for key_line in run:
+            spill_file.write(json.dumps(key_line) + '\n')
+        spill_file.seek(0)
+        return (json.loads(key_line) for key_line in spill_file)
+
+    runs = []
+    run = []
+    for key_line in lines:
+        run.append(key_line)
+        if len(run) >= max_lines:
+            run.sort(key=itemgetter(0))
+            runs.append(spill(run))
+            run = []
+    run.sort(key=itemgetter(0))
+    runs.append(run if keep_last else spill(run))
+    return runs
+
+def merge_runs(runs):
+    """ Merges sorted runs on their keys, as heapq.merge(*runs, key=itemgetter(0)) does on
+    python 3.5 and later. Ties are taken in run order, the lines are never compared.
+
+    Args:
+        runs (list): iterables of sorted (key, line) pairs, e.g. of sorted_runs.
+
+    Yields (tuple): the (key, line) pairs of all runs
+    """
+    def decorate(run_nr, run):
+        for seq, (key, line) in enumerate(run):
+            yield key, run_nr, seq, line
+
+    for key, run_nr, seq, line in heapq.merge(*[decorate(run_nr, run) for run_nr, run in enumerate(runs)]):
+        yield key, line
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Usage:
+#   bench_sanity.py <gene-list> [--rows 200000] [--repeat 3]
+#
+# Grows the rows of a gene list into a research sized list with unique identifiers and coordinates
+# and times Sanity.check with the chained generators against the fused validator.
+from __future__ import print_function
+import sys
+import os
+import io
+import argparse
+import tempfile
+import contextlib
+from timeit import default_timer as timer
+
+from genelist.modules.sanity import Sanity
+
+def grow_list(genelist, outfile, nr_rows):
+    """Writes the header and comments of the gene list followed by nr_rows data rows.
+    The data rows are copies of the rows in the gene list with a unique HGNC symbol,
+    EnsEMBL gene id and coordinates.
+
+    Args:
+        genelist (str): path to the gene list.
+        outfile (file): file handle to write to.
+        nr_rows (int): number of data rows to write.
+
+    """
+    header = None
+    rows = []
+    for line in open(genelist):
+        line = line.rstrip('\n')
+        if header is None:
+            outfile.write(line + '\n')
+            if line.startswith('#') and not line.startswith('##'):
+                header = line.lstrip('#').split('\t')
+            continue
+        rows.append(line.split('\t'))
+
+    positions = dict((column, i) for i, column in enumerate(header))
+    for i in range(nr_rows):
+        row = list(rows[i % len(rows)])
+        row[positions['HGNC_symbol']] = 'GENE{}'.format(i)
+        row[positions['Ensembl_gene_id']] = 'ENSG{:011d}'.format(i)
+        row[positions['Gene_start']] = str(i * 10 + 1)
+        row[positions['Gene_stop']] = str(i * 10 + 5)
+        outfile.write('\t'.join(row) + '\n')
+
+def time_check(genelist, fused, repeat):
+    """Returns the best wall clock time of Sanity.check over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = timer()
+            Sanity().check(genelist, fused=fused)
+            elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the fused Sanity validator against the chained generators.')
+    parser.add_argument('genelist', help='a gene list to grow the benchmark list from')
+    parser.add_argument('--rows', type=int, default=200000, help='number of rows of the benchmark list')
+    parser.add_argument('--repeat', type=int, default=3, help='take the best of this many runs')
+    args = parser.parse_args(argv)
+
+    handle, benchlist = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(handle, 'w') as outfile:
+            grow_list(args.genelist, outfile, args.rows)
+
+        chained = time_check(benchlist, False, args.repeat)
+        fused = time_check(benchlist, True, args.repeat)
+    finally:
+        os.remove(benchlist)
+
+    print('rows\tchained (s)\tfused (s)\tspeedup')
+    print('{}\t{:.3f}\t{:.3f}\t{:.1f}x'.format(args.rows, chained, fused, chained / fused))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
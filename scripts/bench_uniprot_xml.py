@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Usage:
+#   bench_uniprot_xml.py <uniprot-entry.xml> [--entries 200] [--features 2000] [--repeat 3]
+#
+# Grows a UniProt XML entry into a corpus of large entries, as a hot cache would hold them, and
+# times and measures the peak memory of fetching the recommended full name with the whole tree
+# parsed by xmltodict against the incremental parse that stops at the full name.
+from __future__ import print_function
+import io
+import sys
+import argparse
+import tracemalloc
+from timeit import default_timer as timer
+
+import xmltodict
+
+from genelist.services.uniprot import parse_description, parse_description_xml
+
+FEATURE = (b'<feature type="sequence variant" description="In dbSNP." id="VAR_{:06d}">'
+           b'<original>A</original><variation>V</variation>'
+           b'<location><position position="{}"/></location></feature>\n')
+
+def grow_entry(content, nr_features):
+    """Returns (bytes): the entry with nr_features extra features before its sequence, as the
+    variants of a large protein."""
+    features = b''.join(FEATURE.replace(b'{:06d}', b'%06d' % i).replace(b'{}', b'%d' % (i + 1))
+                        for i in range(nr_features))
+    return content.replace(b'<sequence ', features + b'<sequence ', 1)
+
+def measure(parse, corpus, repeat):
+    """Returns (tuple): the best wall clock time of parsing the corpus and the peak memory of one run."""
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        for content in corpus:
+            parse(content)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    for content in corpus:
+        parse(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the incremental UniProt XML parse against xmltodict.')
+    parser.add_argument('entry', help='a UniProt XML entry to grow the corpus from')
+    parser.add_argument('--entries', type=int, default=200, help='number of entries in the corpus')
+    parser.add_argument('--features', type=int, default=2000, help='number of features added to each entry')
+    parser.add_argument('--repeat', type=int, default=3, help='take the best of this many runs')
+    args = parser.parse_args(argv)
+
+    content = grow_entry(open(args.entry, 'rb').read(), args.features)
+    corpus = [content] * args.entries
+
+    def full(content):
+        return parse_description(xmltodict.parse(content))
+
+    def incremental(content):
+        return parse_description_xml(io.BytesIO(content))
+
+    assert full(content) == incremental(content)
+    full_time, full_peak = measure(full, corpus, args.repeat)
+    incremental_time, incremental_peak = measure(incremental, corpus, args.repeat)
+
+    print('entries\tentry (KB)\txmltodict (s)\tincremental (s)\tspeedup\txmltodict peak (KB)\tincremental peak (KB)')
+    print('{}\t{}\t{:.3f}\t{:.3f}\t{:.1f}x\t{}\t{}'.format(
+        args.entries, len(content) // 1024, full_time, incremental_time, full_time / incremental_time,
+        full_peak // 1024, incremental_peak // 1024))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -9,7 +9,7 @@ import os
 import re
 from datetime import datetime
 
-from genelist.utils.git import getgitlastmoddate, getgittag
+from genelist.utils.git import GitMetadata
 from genelist.utils.acronyms import Acronyms
 
 def panels_2_html(panels, acronyms):
@@ -43,6 +43,9 @@ def main(argv):
     acronyms = Acronyms(os.path.dirname(os.path.dirname(os.path.realpath(args.infiles[0].name))))
     re_gl_name = re.compile(r'cust...-(.*).txt')
 
+    git_metadata = GitMetadata()
+    git_metadata.prefetch([infile.name for infile in args.infiles])
+
     versions = {} # Database => { 'Version': Version, 'Datum': Date, 'Beskrivning': description, 'Databas': database acronym}
     for infile in args.infiles:
 
@@ -51,11 +54,11 @@ def main(argv):
         database = match.group(1)
 
         # fill versions dict
-        mod_date = getgitlastmoddate(infile.name, '%Y-%m-%d %H:%M:%S')
+        mod_date = git_metadata.lastmoddate(infile.name, '%Y-%m-%d %H:%M:%S')
         if not mod_date:
             print('WARNING: {} not committed!'.format(infile.name))
             continue
-        version = getgittag(infile.name, date=mod_date) # get version on that date
+        version = git_metadata.tag(infile.name) # get version on that date
         full_name = acronyms[database]
         panels = acronyms.get_panels_of(database)
         panels = full_name if len(panels) == 1 else panels_2_html(panels, acronyms)
@@ -56,6 +56,10 @@ setup(
     zip_safe=False,
 
     install_requires=required,
+    extras_require={
+        # genelist overlap and api.IntervalIndex
+        'intervals': ['numpy'],
+    },
     cmdclass=dict(test=PyTest),
 
     # To provide executable scripts, use entry points in preference to the
@@ -1,4 +1,26 @@
-from genelist.modules.fetch import Fetch
+import threading
+
+import pytest
+
+from genelist.modules import fetch as fetch_module
+from genelist.modules.fetch import Fetch, ResolutionStats
+
+@pytest.fixture
+def bare_fetch():
+    """ Builds a Fetch without services: a config, the line context and no-op loggers.
+    The services a test needs are passed as attributes. """
+    def build(config=None, **attributes):
+        fetch = Fetch.__new__(Fetch)
+        fetch.config = config or {}
+        fetch.line_context = threading.local()
+        fetch.delimiter = '|'
+        fetch.resolution_stats = ResolutionStats()
+        fetch.info = fetch.warn = fetch.error = lambda *args, **kwargs: None
+        fetch.merge_line = lambda new_line, line: dict(line, **new_line)
+        for name, value in attributes.items():
+            setattr(fetch, name, value)
+        return fetch
+    return build
 
 def test_query_ensembl():
     pass
@@ -19,3 +41,145 @@ def test_annotate(config_stream):
     #pprint(lines_out)
 
     assert cmms_complete_lines == lines_out
+
+def test_resolution_stats():
+    stats = ResolutionStats()
+    assert stats.mean_seconds('cascade') == 0.0
+    stats.add('cascade', 'E!+OMIM', 1, 0.2)
+    stats.add('cascade', 'HGNC', 4, 0.4)
+    stats.add('cascade', None, 4, 0.3)
+    stats.add('combined', 'HGNC', 1, 0.1)
+
+    assert stats.lines == {'cascade': 3, 'combined': 1}
+    assert stats.queries == {'cascade': 9, 'combined': 1}
+    assert abs(stats.mean_seconds('cascade') - 0.3) < 1e-9
+    assert list(stats.report()) == [
+        'cascade: 3 lines, 3.00 queries and 300.0ms per line',
+        'cascade: E!+OMIM 1 (33%)',
+        'cascade: HGNC 1 (33%)',
+        'cascade: not found 1 (33%)',
+        'combined: 1 lines, 1.00 queries and 100.0ms per line',
+        'combined: HGNC 1 (100%)',
+    ]
+
+class Clock(object):
+    """ Stands in for the time module, only moves when told """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+class Ensembldb(object):
+    """ Stands in for Ensembl: each query takes the given seconds on the clock """
+
+    gene = {'Gene_start': 1, 'Gene_stop': 2, 'Ensembl_gene_id': 'ENSG00000000001', 'Chromosome': '1'}
+
+    def __init__(self, clock, query_seconds, candidates_seconds):
+        self.clock = clock
+        self.query_seconds = query_seconds
+        self.candidates_seconds = candidates_seconds
+
+    def query(self, omim_morbid=None, ensembl_gene_id=None, hgnc_symbol=None, chromosome=None):
+        self.clock.now += self.query_seconds
+        return [dict(self.gene)] if hgnc_symbol == 'A' and not omim_morbid else []
+
+    def query_candidates(self, **identifiers):
+        self.clock.now += self.candidates_seconds
+        return [dict(self.gene, HGNC_symbol='A', OMIM_morbid=None)]
+
+def test_pick_resolver(bare_fetch, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fetch_module, 'time', clock)
+    line = {'HGNC_symbol': 'A', 'OMIM_morbid': '100100', 'Chromosome': '1'}
+
+    # the cascade takes two queries for the line: OMIM, then HGNC
+    for query_seconds, candidates_seconds, fastest in ((0.01, 0.05, 'cascade'), (0.01, 0.005, 'combined')):
+        fetch = bare_fetch(ensembl_resolver='adaptive', ensembldb=Ensembldb(clock, query_seconds, candidates_seconds),
+                           ADAPTIVE_WARMUP=3)
+        picks = []
+        pick_resolver = fetch.pick_resolver
+        def recording_pick_resolver():
+            picks.append(pick_resolver())
+            return picks[-1]
+        fetch.pick_resolver = recording_pick_resolver
+
+        lines = list(fetch.fill_from_ensembl(dict(line) for i in range(10)))
+        assert all(line['Ensembl_gene_id'] == 'ENSG00000000001' for line in lines)
+
+        # both are timed on the warm-up lines, then the fastest is kept
+        assert picks == ['cascade', 'combined'] * 3 + [fastest] * 4
+        stats = fetch.resolution_stats
+        assert stats.branches[('cascade', 'HGNC')] == stats.lines['cascade']
+        assert stats.branches[('combined', 'HGNC')] == stats.lines['combined']
+        assert stats.queries['cascade'] == 2 * stats.lines['cascade']
+        assert stats.queries['combined'] == stats.lines['combined']
+        assert abs(stats.mean_seconds('cascade') - 2 * query_seconds) < 1e-9
+        assert abs(stats.mean_seconds('combined') - candidates_seconds) < 1e-9
+
+    # a configured resolver is always picked
+    fetch = bare_fetch(ensembl_resolver='combined', ensembldb=None)
+    fetch.resolution_stats.add('cascade', 'HGNC', 1, 0.0)
+    assert fetch.pick_resolver() == 'combined'
+
+class Genenames(object):
+    """ Stands in for the Genenames client: the UniProt IDs of a symbol """
+
+    def __init__(self, uniprot_ids, lookups):
+        self.uniprot_ids = uniprot_ids
+        self.lookups = lookups
+
+    def uniprot(self, hgnc_symbol):
+        self.lookups.append(hgnc_symbol)
+        return self.uniprot_ids.get(hgnc_symbol)
+
+class Uniprot(object):
+    """ Stands in for the UniProt client: a search per batch """
+
+    searches = []
+    entries = {
+        'O95363': {'accession': 'O95363', 'reviewed': True, 'description': 'FARS2'},
+        'Q5JWF2': {'accession': 'Q5JWF2', 'reviewed': False, 'description': None},
+        'Q5TBU3': {'accession': 'P63092', 'reviewed': True, 'description': 'GNAS'}, # secondary accession
+    }
+
+    def fetch_entries(self, accessions, reviewed_only=False):
+        self.searches.append((list(accessions), reviewed_only))
+        return dict((accession, entry) for accession, entry in self.entries.items()
+                    if accession in accessions and (entry['reviewed'] or not reviewed_only))
+
+def test_add_uniprot(bare_fetch, monkeypatch):
+    monkeypatch.setattr(fetch_module, 'Uniprot', Uniprot)
+    uniprot_ids = {'FARS2': ['O95363'], 'GNAS': ['Q5JWF2', 'Q5TBU3'], 'XXX': None}
+    symbols = ['FARS2', 'GNAS', 'XXX', 'FARS2', 'GNAS']
+
+    for reviewed_only in (False, True):
+        lookups = []
+        del Uniprot.searches[:]
+        fetch = bare_fetch({'uniprot': {'batch_size': 2, 'reviewed_only': reviewed_only}},
+                           genenames=Genenames(uniprot_ids, lookups))
+
+        def lines():
+            for line_nr, symbol in enumerate(symbols, 1):
+                fetch.line_nr = line_nr
+                yield {'HGNC_symbol': symbol, 'line_nr': line_nr}
+
+        out = []
+        for line in fetch.add_uniprot(lines()):
+            # no more than a batch is read ahead, and each line comes with its own context
+            assert len(lookups) <= 2 * ((line['line_nr'] + 1) // 2)
+            assert fetch.line_nr == line['line_nr']
+            out.append(line)
+
+        assert lookups == symbols
+        assert Uniprot.searches == [(['O95363', 'Q5JWF2', 'Q5TBU3'], reviewed_only), (['O95363'], reviewed_only),
+                                    (['Q5JWF2', 'Q5TBU3'], reviewed_only)]
+        names = [(line['UniProt_id'], line['Uniprot_protein_name']) for line in out]
+        if reviewed_only:
+            # the primary accession of the first reviewed ID
+            assert names == [('O95363', 'FARS2'), ('P63092', 'GNAS'), ('', ''), ('O95363', 'FARS2'), ('P63092', 'GNAS')]
+        else:
+            # all IDs, with the name of the last
+            assert names == [('O95363', 'FARS2'), ('Q5JWF2|Q5TBU3', 'GNAS'), ('', ''),
+                             ('O95363', 'FARS2'), ('Q5JWF2|Q5TBU3', 'GNAS')]
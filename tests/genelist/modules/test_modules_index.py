@@ -0,0 +1,41 @@
+import shutil
+
+from genelist.modules import index as index_module
+from genelist.modules.index import GeneIndex, read_genes
+
+def test_read_genes():
+    genes = list(read_genes('tests/fixtures/cmms.txt'))
+    assert genes[:3] == [('RNASEH1', 'ENSG00000231458', 'IEM', 2),
+                         ('RNASEH1', 'ENSG00000231458', 'MIT', 2),
+                         ('KMT2A', 'ENSG00000118058', 'EP', 3)]
+
+def test_gene_index(tmpdir, monkeypatch):
+    cust = tmpdir.mkdir('cust000')
+    shutil.copy('tests/fixtures/cust000-Clinical_master_list.txt', str(cust.join('cust000-FullList.txt')))
+    shutil.copy('tests/fixtures/cmms.txt', str(cust.join('cust000-CMMS.txt')))
+
+    read = []
+    read_genes_ = index_module.read_genes
+    def counting_read_genes(genelist):
+        read.append(genelist)
+        return read_genes_(genelist)
+    monkeypatch.setattr(index_module, 'read_genes', counting_read_genes)
+
+    with GeneIndex(str(tmpdir)) as gene_index:
+        assert gene_index.update() == {'indexed': 2, 'unchanged': 0, 'removed': 0}
+
+        genes = list(gene_index.gene('DAG1'))
+        assert [(gene['customer'], gene['name'], gene['panel']) for gene in genes] == \
+            [('cust000', 'FullList', 'FullList'), ('cust000', 'FullList', 'OMIM'),
+             ('cust000', 'FullList', 'PIDCAD')]
+        assert genes[0]['line_nr'] == 22
+        assert [gene['hgnc_symbol'] for gene in gene_index.panel('EP')][:3] == ['KMT2A', 'PRDM8', 'SLC2A1']
+
+    # only changed lists are read again
+    cust.join('cust000-CMMS.txt').remove()
+    shutil.copy('tests/fixtures/merge-1.txt', str(cust.join('cust000-Merge.txt')))
+    with GeneIndex(str(tmpdir)) as gene_index:
+        assert gene_index.update() == {'indexed': 1, 'unchanged': 1, 'removed': 1}
+        assert set(gene['name'] for gene in gene_index.panel('EP')) == {'FullList'}
+        assert list(gene_index.genelist('Merge', 'cust000'))
+    assert len(read) == 3
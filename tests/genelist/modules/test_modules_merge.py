@@ -1,4 +1,4 @@
-from genelist.modules.merge import merge_panels
+from genelist.modules.merge import merge_panels, merge_panels_sorted
 
 def test_annotate():
     merge_file_1 = open('tests/fixtures/merge-1.txt', 'r')
@@ -20,3 +20,33 @@ def test_annotate():
     merge_panels_out = merge_panels_out[1:]
 
     assert merged_file_lines == merge_panels_out
+
+def test_merge_sorted():
+    def merge(merge_panels, **kwargs):
+        infiles = [open('tests/fixtures/merge-1.txt'), open('tests/fixtures/merge-2.txt')]
+        return list(merge_panels(infiles, ('ID', 'OMIM'), **kwargs))
+
+    expected = merge(merge_panels)
+    for max_lines in (1, 100000):
+        merged = merge(merge_panels_sorted, max_lines=max_lines)
+
+        assert merged[:2] == expected[:2] # the database and column header lines
+        assert sorted(merged[2:]) == sorted(expected[2:])
+        assert [line.split('\t')[0] for line in merged[2:5]] == ['7', '16', 'X']
+
+def test_merge_sorted_spills(monkeypatch):
+    from genelist.modules import merge as merge_module
+    from genelist.utils.sort import sorted_runs
+
+    resident = []
+    def counting_sorted_runs(lines, max_lines, keep_last=True):
+        runs = sorted_runs(lines, max_lines, keep_last)
+        resident.extend(len(run) for run in runs if isinstance(run, list))
+        return runs
+    monkeypatch.setattr(merge_module, 'sorted_runs', counting_sorted_runs)
+
+    infiles = [open('tests/fixtures/merge-1.txt'), open('tests/fixtures/merge-2.txt')]
+    list(merge_panels_sorted(infiles, ('ID', 'OMIM'), max_lines=100000))
+
+    # only the run of the last gene list is kept in memory
+    assert len(resident) == 1
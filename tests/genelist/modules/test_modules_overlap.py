@@ -0,0 +1,15 @@
+import pytest
+
+def test_overlap():
+    pytest.importorskip('numpy')
+    from genelist.modules.overlap import overlap
+
+    vcf = ['##fileformat=VCFv4.1\n', '#CHROM\tPOS\tID\tREF\tALT\n',
+           'chr17\t16586752\trs1\tA\tG\n', '11\t118307000\trs2\tACGT\tA\n', '11\t1\trs3\tA\tG\n']
+    lines = list(overlap(open('tests/fixtures/cmms.txt'), vcf, 'vcf'))
+    assert lines == ['#Chromosome\tStart\tStop\tID\tHGNC_symbol\tClinical_db_gene_annotation',
+                     'chr17\t16586752\t16586752\trs1\tRNASEH1\tIEM,MIT']
+
+    bed = ['track name=test\n', '11\t118307204\t118307205\tfirst\n', '11\t0\t1\n']
+    lines = list(overlap(open('tests/fixtures/cmms.txt'), bed, 'bed', batch_size=1, report_all=True))
+    assert lines[1:] == ['11\t118307205\t118307205\tfirst\tKMT2A\tEP', '11\t1\t1\t.\t\t']
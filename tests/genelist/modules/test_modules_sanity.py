@@ -0,0 +1,111 @@
+from genelist.modules.sanity import Sanity, expand_genelists, validate_lists
+
+def check(genelist, capsys, fused):
+    """ Return the exit code or raised exception and the printed messages of Sanity.check """
+    try:
+        result = Sanity().check(genelist, fused=fused)
+    except Exception as e:
+        result = repr(e)
+    out, err = capsys.readouterr()
+    return result, out
+
+def test_check_fused(capsys):
+    genelists = ['tests/fixtures/cmms.txt', 'tests/fixtures/cmms-complete.txt',
+                 'tests/fixtures/cust000-Clinical_master_list.txt',
+                 'tests/fixtures/cust000-Clinical_master_list-verbose.txt',
+                 'tests/fixtures/merge-2.txt', 'tests/fixtures/merged.txt']
+
+    for genelist in genelists:
+        assert check(genelist, capsys, fused=True) == check(genelist, capsys, fused=False)
+
+def test_check_fused_warnings(tmpdir, capsys):
+    lines = [line.rstrip('\n').split('\t') for line in open('tests/fixtures/cmms-complete.txt')
+             if not line.startswith('##')]
+    header, rows = lines[0], lines[1:6]
+
+    rows[0][3] = ' ' + rows[0][3] # not trimmed
+    rows[1][4] = 'a, b' # forbidden delimiter
+    rows[2] = rows[2][:25] # missing fields
+    rows[3][11] = 'False' # forbidden chars
+    rows[4] = list(rows[3]) # duplicate
+
+    genelist = tmpdir.join('warnings.txt')
+    genelist.write('\n'.join('\t'.join(row) for row in [header] + rows) + '\n')
+
+    result, out = check(str(genelist), capsys, fused=True)
+    assert result == 1
+    assert "#2: HGNC_symbol (' RNASEH1') is not trimmed!" in out
+    assert (result, out) == check(str(genelist), capsys, fused=False)
+
+def test_validate_lists():
+    genelists = expand_genelists(['tests/fixtures'])
+    assert 'tests/fixtures/cmms.txt' in genelists
+
+    results = list(validate_lists(genelists, jobs=2))
+    assert [result['genelist'] for result in results] == genelists
+
+    results = dict((result['genelist'], result) for result in results)
+    assert results['tests/fixtures/merge-1.txt']['exit_code'] == 0
+    assert results['tests/fixtures/cmms.txt']['exit_code'] == 1
+    assert results['tests/fixtures/cmms.txt']['messages'][0] == \
+        {'line_nr': 2, 'message': "Chromosome '17' differs from gene locus '2p25.3'"}
+    assert results['tests/fixtures/merged.txt']['error'] == "KeyError: 'Gene_start'"
+
+def test_check_chunked(capsys):
+    for genelist in ['tests/fixtures/cmms.txt', 'tests/fixtures/cmms-complete.txt',
+                     'tests/fixtures/merged.txt']:
+        expected = check(genelist, capsys, fused=True)
+
+        try:
+            result = Sanity().check_chunked(genelist, jobs=3, min_chunk_size=100)
+        except Exception as e:
+            result = repr(e)
+        out, err = capsys.readouterr()
+
+        assert (result, out) == expected
+
+def test_check_coordinates(tmpdir, capsys):
+    lines = [line.rstrip('\n').split('\t') for line in open('tests/fixtures/cmms-complete.txt')
+             if not line.startswith('##')]
+    header, rows = lines[0], lines[1:4]
+    for i, row in enumerate(rows):
+        row[0], row[3], row[12], row[14] = '1', 'GENE{}'.format(i), '1p1', 'ENSG{:011d}'.format(i)
+    rows[0][1:3] = ['100', '200']
+    rows[1][1:3] = ['300', '400']
+    rows[2][1:3] = ['100', '400'] # start of the first gene, stop of the second
+
+    genelist = tmpdir.join('coordinates.txt')
+    genelist.write('\n'.join('\t'.join(row) for row in [header] + rows) + '\n')
+
+    assert Sanity().check(str(genelist)) == 0
+    assert Sanity(check_overlaps=True).check(str(genelist)) == 1
+    out, err = capsys.readouterr()
+    assert out == "#4: '1:100-400' overlaps '1:100-200' listed at #2\n" \
+                  "#4: '1:100-400' overlaps '1:300-400' listed at #3\n"
+
+def test_check_duplicate_coordinates_order(tmpdir, capsys):
+    lines = [line.rstrip('\n').split('\t') for line in open('tests/fixtures/cmms-complete.txt')
+             if not line.startswith('##')]
+    header, rows = lines[0], lines[1:4]
+    for i, row in enumerate(rows):
+        row[0], row[3], row[12], row[14] = '1', 'GENE{}'.format(i), '1p1', 'ENSG{:011d}'.format(i)
+        row[1:3] = ['100', '200']
+    rows[1][3] = 'GENE0'
+    rows[2][12] = '2p1'
+
+    genelist = tmpdir.join('duplicates.txt')
+    genelist.write('\n'.join('\t'.join(row) for row in [header] + rows) + '\n')
+
+    # the coordinates are reported with the other duplicates of their line
+    expected = "#3: 'GENE0' already listed at #2\n" \
+               "#3: '100-200' already listed at #2\n" \
+               "#4: Chromosome '1' differs from gene locus '2p1'\n" \
+               "#4: '100-200' already listed at #3\n"
+    for fused in (True, False):
+        assert Sanity().check(str(genelist), fused=fused) == 1
+        out, err = capsys.readouterr()
+        assert out == expected
+
+    assert Sanity().check_chunked(str(genelist), jobs=2, min_chunk_size=1) == 1
+    out, err = capsys.readouterr()
+    assert out == expected
@@ -0,0 +1,43 @@
+import pytest
+
+from genelist import api
+from genelist.modules.setop import PanelSets, parse_expression, setop_report
+
+def panel(genelist, name):
+    """ The HGNC symbols of a panel, read the plain way """
+    comments, lines = api.readlist(open(genelist))
+    return set(line['HGNC_symbol'] for line in lines
+               if name in [panel.strip() for panel in line['Clinical_db_gene_annotation'].split(',')])
+
+def test_evaluate():
+    cmms, cml = 'tests/fixtures/cmms.txt', 'tests/fixtures/cust000-Clinical_master_list.txt'
+    panel_sets = PanelSets()
+    panel_sets.add(cmms)
+    panel_sets.add(cml)
+
+    def evaluate(expression):
+        return set(panel_sets.to_genes(panel_sets.evaluate(expression)))
+
+    ep, iem, omim = panel(cmms, 'EP'), panel(cmms, 'IEM'), panel(cml, 'OMIM')
+    assert ep and iem and omim
+    assert evaluate('cmms:EP') == ep
+    assert evaluate('cmms:EP | cmms:IEM') == ep | iem
+    assert evaluate('cmms:EP & cmms:IEM') == ep & iem
+    assert evaluate('cmms:EP - cust000-Clinical_master_list:OMIM') == ep - omim
+    assert evaluate('Clinical_master_list:OMIM | cmms:EP - cmms:IEM') == omim | (ep - iem)
+    assert evaluate('(Clinical_master_list:OMIM | cmms:EP) - cmms:IEM') == (omim | ep) - iem
+    assert evaluate('cmms:XXX') == set()
+
+    for expression in ['cmms:EP -', 'cmms:EP | (cmms:IEM', 'unknown:EP', 'cmms:EP cmms:IEM']:
+        with pytest.raises(ValueError):
+            panel_sets.evaluate(expression)
+
+def test_setop_report():
+    assert parse_expression('MISSING=cmms:EP - cmms:IEM') == ('MISSING', 'cmms:EP - cmms:IEM', ['cmms:EP', 'cmms:IEM'])
+    assert parse_expression('cmms:EP - cmms:IEM')[0] == 'EP'
+
+    panel_sets, report = setop_report(['tests/fixtures/cmms.txt'], ['cmms:EP - cmms:IEM', 'ALL=cmms'])
+    assert list(report) == ['EP', 'ALL']
+    assert set(report['EP']['genes']) == panel('tests/fixtures/cmms.txt', 'EP') - panel('tests/fixtures/cmms.txt', 'IEM')
+    assert sorted(report['EP']) == ['customer', 'date', 'display', 'genes', 'version']
+    assert panel_sets.members(report['EP']['genes'][0], ['cmms:EP', 'cmms:IEM']) == ['cmms:EP']
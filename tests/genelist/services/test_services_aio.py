@@ -0,0 +1,254 @@
+import json
+import asyncio
+import threading
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+import pytest
+import requests
+import requests_cache
+
+pytest.importorskip('xmltodict')
+from genelist.services.aio import (AsyncGenenames, AsyncUniprot, AsyncOMIM, AsyncSingleFlight, Blocking,
+                                   LoopThread, http_get)
+
+UNIPROT_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<uniprot><entry><protein><recommendedName>
+<fullName evidence="1">Phenylalanine--tRNA ligase, mitochondrial</fullName>
+</recommendedName></protein></entry></uniprot>'''
+
+UNIPROT_RESULTS = [
+    {'entryType': 'UniProtKB reviewed (Swiss-Prot)', 'primaryAccession': 'O95363',
+     'proteinDescription': {'recommendedName': {'fullName': {'value': 'Phenylalanine--tRNA ligase, mitochondrial'}}}},
+    {'entryType': 'UniProtKB reviewed (Swiss-Prot)', 'primaryAccession': 'P63092',
+     'proteinDescription': {'recommendedName': {'fullName': {'value': 'GNAS'}}}},
+]
+
+class StandIn(object):
+    """ Stands in for genenames.org, UniProt and OMIM on a local port """
+
+    def __init__(self, loop_thread):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.conflicts = 1
+        self.server = loop_thread.run(self.start())
+        self.url = 'http://127.0.0.1:%d' % self.server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        return await asyncio.start_server(self.handle, '127.0.0.1', 0)
+
+    def route(self, path, query):
+        docs = {
+            '/fetch/symbol/FARS2': [{'symbol': 'FARS2', 'omim_id': ['611592'], 'uniprot_ids': ['O95363']}],
+            '/fetch/prev_symbol/DIBD1': [{'symbol': 'ALG9', 'omim_id': ['606941']}],
+        }
+        if path.startswith('/fetch/'):
+            return 200, {}, json.dumps({'response': {'docs': docs.get(path, [])}}).encode()
+        if path == '/moved':
+            return 302, {'Location': '/fetch/symbol/FARS2'}, b''
+        if path == '/uniprot/O95363.xml':
+            return 200, {'Transfer-Encoding': 'chunked'}, UNIPROT_XML
+        if path == '/uniprotkb/search':
+            if 'accession:BROKEN' in query['query'][0]:
+                return 500, {}, b''
+            results = [result for result in UNIPROT_RESULTS
+                       if 'accession:%s' % result['primaryAccession'] in query['query'][0]]
+            size, cursor = int(query['size'][0]), int(query.get('cursor', [0])[0])
+            headers = {}
+            if cursor + size < len(results):
+                headers['Link'] = '<%s%s?%s>; rel="next"' % (self.url, path, urlencode(
+                    {'query': query['query'][0], 'size': size, 'cursor': cursor + size}))
+            return 200, headers, json.dumps({'results': results[cursor:cursor + size]}).encode()
+        if path == '/api/entry/search':
+            if self.conflicts:
+                self.conflicts -= 1
+                return 409, {}, b''
+            entry = {'mimNumber': 611592, 'geneMap': {'geneSymbols': 'FARS2', 'phenotypeMapList': [{'phenotypeMap': {
+                'phenotypeMimNumber': 614946, 'phenotype': 'Combined oxidative phosphorylation deficiency 14',
+                'phenotypeInheritance': 'Autosomal recessive'}}]}}
+            entries = [{'entry': entry}] if query['search'] == ['number:611592'] else []
+            return 200, {}, json.dumps({'omim': {'searchResponse': {'entryList': entries}}}).encode()
+        return 404, {}, b''
+
+    async def handle(self, reader, writer):
+        request = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            request.append(line.decode().rstrip('\r\n'))
+        url = urlsplit(request[0].split()[1])
+        self.requests.append(request[0].split()[1])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+        status, headers, body = self.route(url.path, parse_qs(url.query))
+        writer.write('HTTP/1.1 {} X\r\n'.format(status).encode())
+        for key, value in headers.items():
+            writer.write('{}: {}\r\n'.format(key, value).encode())
+        if 'Transfer-Encoding' in headers:
+            writer.write(b'\r\n')
+            for i in range(0, len(body), 40):
+                writer.write(b'%x\r\n%s\r\n' % (len(body[i:i + 40]), body[i:i + 40]))
+            writer.write(b'0\r\n\r\n')
+        else:
+            writer.write('Content-Length: {}\r\n\r\n'.format(len(body)).encode() + body)
+        await writer.drain()
+        writer.close()
+
+@pytest.fixture(scope='module')
+def stand_in():
+    loop_thread = LoopThread()
+    stand_in = StandIn(loop_thread)
+    stand_in.loop_thread = loop_thread
+    yield stand_in
+    stand_in.server.close()
+
+def test_http_get(stand_in):
+    status, headers, body = stand_in.loop_thread.run(http_get(stand_in.url + '/moved'))
+    assert status == 200 and json.loads(body.decode())['response']['docs'][0]['symbol'] == 'FARS2'
+
+def test_async_clients(stand_in):
+    genenames = Blocking(AsyncGenenames(base_url=stand_in.url, delay=0, cache_name=None), stand_in.loop_thread)
+    assert genenames.uniprot('FARS2') == ['O95363']
+    assert genenames.official('FARS2', '611592') == 'FARS2'
+    assert genenames.official('DIBD1') == 'ALG9' # previous symbol
+    assert genenames.aliases('FARS2') is None
+
+    uniprot = Blocking(AsyncUniprot(base_url=stand_in.url + '/uniprot', search_url=stand_in.url + '/uniprotkb/search',
+                                    delay=0, cache_name=None), stand_in.loop_thread)
+    assert uniprot.fetch_description('O95363') == 'Phenylalanine--tRNA_ligase__mitochondrial'
+    assert uniprot.fetch_entries(['O95363', 'P00000', 'O95363']) == {
+        'O95363': {'accession': 'O95363', 'reviewed': True, 'description': 'Phenylalanine--tRNA_ligase__mitochondrial'}}
+    assert uniprot.fetch_entries([]) == {}
+
+    omim = Blocking(AsyncOMIM('key', base_url=stand_in.url + '/api', delay=0, max_backoff=0, cache_name=None), stand_in.loop_thread)
+    entry = omim.gene(mim_number='611592') # after a 409
+    assert entry['mim_number'] == 611592
+    assert omim.parse_phenotypic_disease_models(entry['phenotypes']) == {614946: ['AR']}
+    assert omim.gene(hgnc_symbol='XXX')['mim_number'] is False
+    assert '/api/entry/search?apiKey=key&format=json&include=geneMap&include=dates&search=number%3A611592' in stand_in.requests
+
+def test_search_pages(stand_in, monkeypatch):
+    from genelist.services import uniprot as uniprot_module
+
+    monkeypatch.setattr(uniprot_module, 'SEARCH_SIZE', 1)
+    uniprot = Blocking(AsyncUniprot(search_url=stand_in.url + '/uniprotkb/search', delay=0, cache_name=None),
+                       stand_in.loop_thread)
+    del stand_in.requests[:]
+    entries = uniprot.fetch_entries(['P63092', 'O95363'])
+    assert sorted(entries) == ['O95363', 'P63092'] and entries['P63092']['description'] == 'GNAS'
+    assert len(stand_in.requests) == 2 and 'cursor=1' in stand_in.requests[1]
+
+    with pytest.raises(IOError):
+        uniprot.fetch_entries(['BROKEN'])
+
+def test_limit_per_host(stand_in):
+    genenames = Blocking(AsyncGenenames(base_url=stand_in.url, limit_per_host=2, delay=0, cache_name=None), stand_in.loop_thread)
+    stand_in.max_in_flight = 0
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(genenames.refseq('GENE%d' % i))) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [None] * 10
+    assert stand_in.max_in_flight == 2
+
+def test_coalesce(stand_in):
+    genenames = Blocking(AsyncGenenames(base_url=stand_in.url, delay=0.1, cache_name=None), stand_in.loop_thread)
+    del stand_in.requests[:]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(genenames.uniprot('FARS2'))) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [['O95363']] * 10
+    assert stand_in.requests == ['/fetch/symbol/FARS2']
+    assert genenames.flights.shared == 9
+
+def test_max_conflicts(stand_in):
+    omim = Blocking(AsyncOMIM('key', base_url=stand_in.url + '/api', delay=0, max_backoff=0, max_conflicts=2,
+                              cache_name=None), stand_in.loop_thread)
+    stand_in.conflicts = 3
+    with pytest.raises(IOError):
+        omim.gene(mim_number='611592')
+    assert stand_in.conflicts == 0
+
+    stand_in.conflicts = 2
+    assert omim.gene(mim_number='611592')['mim_number'] == 611592
+
+class Canned(requests.adapters.BaseAdapter):
+    """ Answers the requests of a CachedSession with a canned response """
+
+    def __init__(self, body):
+        super(Canned, self).__init__()
+        self.body = body
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(request.url)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response._content = self.body
+        return response
+
+    def close(self):
+        pass
+
+def test_shared_cache(stand_in, tmpdir):
+    cache_name = str(tmpdir.join('genenames_cache'))
+    body = json.dumps({'response': {'docs': [{'symbol': 'ALG9', 'uniprot_ids': ['Q9H6U8']}]}}).encode()
+
+    # a response cached by the blocking client is read by the asyncio client
+    session = requests_cache.CachedSession(cache_name, backend='sqlite', expire_after=8460000)
+    session.mount('http://', Canned(body))
+    session.get('http://rest.genenames.org//fetch/symbol/ALG9', headers={'Accept': 'application/json'})
+    genenames = Blocking(AsyncGenenames(delay=0, cache_name=cache_name), stand_in.loop_thread)
+    assert genenames.uniprot('ALG9') == ['Q9H6U8']
+
+    # and the other way around, with the query string keyed as requests_cache does
+    del stand_in.requests[:]
+    omim = Blocking(AsyncOMIM('key', base_url=stand_in.url + '/api', delay=0, cache_name=cache_name),
+                    stand_in.loop_thread)
+    stand_in.conflicts = 0
+    assert omim.gene(mim_number='611592')['mim_number'] == 611592
+    assert omim.gene(mim_number='611592')['mim_number'] == 611592
+    assert len(stand_in.requests) == 1
+
+    canned = Canned(b'')
+    session.mount('http://', canned)
+    response = session.get(stand_in.url + '/api/entry/search', params={
+        'apiKey': 'key', 'format': 'json', 'include': ['geneMap', 'dates'], 'search': 'number:611592'})
+    assert response.from_cache and canned.sent == []
+    assert response.json()['omim']['searchResponse']['entryList'][0]['entry']['mimNumber'] == 611592
+
+def test_async_singleflight():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def lookup(symbol):
+        calls.append(symbol)
+        await asyncio.sleep(0.01)
+        return [symbol]
+
+    async def main():
+        results = await asyncio.gather(*[flights.do(symbol, lookup, symbol)
+                                         for symbol in ['FARS2', 'ALG9', 'FARS2', 'FARS2']])
+        # a cancelled caller does not cancel the others
+        first = asyncio.ensure_future(flights.do('GNAS', lookup, 'GNAS'))
+        second = asyncio.ensure_future(flights.do('GNAS', lookup, 'GNAS'))
+        await asyncio.sleep(0)
+        first.cancel()
+        return results, await second
+
+    results, gnas = asyncio.new_event_loop().run_until_complete(main())
+    assert results == [['FARS2'], ['ALG9'], ['FARS2'], ['FARS2']]
+    assert gnas == ['GNAS']
+    assert calls == ['FARS2', 'ALG9', 'GNAS']
+    assert flights.shared == 3 and flights.calls == {}
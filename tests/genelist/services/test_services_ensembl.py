@@ -1,6 +1,11 @@
-from genelist.services.ensembl import Ensembl
+import threading
+
+import pytest
+import pymysql
 import yaml
 
+from genelist.services.ensembl import Ensembl, ConnectionPool, QueryCache, filter_candidates, process_transcripts
+
 def init(config_stream):
     config = yaml.load(config_stream)
     return Ensembl(
@@ -63,3 +68,178 @@ def test_query_transcripts(config_stream):
         'Gene_start': 95679119,
         'Gene_stop': 96079599
     }
+
+def test_process_transcripts():
+    def rows():
+        gene = {'Gene_start': 1, 'Gene_stop': 10, 'Chromosome': '4', 'description': 'a gene'}
+        yield dict(gene, Ensembl_gene_id='ENSG1', HGNC_symbol='A', Transcript_ID='ENST2', RefSeq_ID='NM_2')
+        yield dict(gene, Ensembl_gene_id='ENSG1', HGNC_symbol='A', Transcript_ID='ENST1', RefSeq_ID=None)
+        yield dict(gene, Ensembl_gene_id='ENSG1', HGNC_symbol='A', Transcript_ID='ENST2', RefSeq_ID='NM_1')
+        yield dict(gene, Ensembl_gene_id='ENSG2', HGNC_symbol='B', Transcript_ID='ENST3', RefSeq_ID=None)
+
+    genes = process_transcripts(rows())
+    assert next(genes) == {'Gene_description': 'a_gene', 'Gene_start': 1, 'Gene_stop': 10, 'Chromosome': '4',
+                           'Ensembl_gene_id': 'ENSG1', 'HGNC_symbol': 'A',
+                           'Ensembl_transcript_to_refseq_transcript': 'ENST1|ENST2>NM_1/NM_2'}
+    assert [gene['HGNC_symbol'] for gene in genes] == ['B']
+    assert list(process_transcripts(iter([]))) == []
+
+class Connection(object):
+    """ Stands in for a pymysql connection """
+
+    def __init__(self, nr):
+        self.nr = nr
+        self.pings = 0
+        self.closed = False
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+
+    def close(self):
+        self.closed = True
+
+def test_connection_pool():
+    connections = []
+    def connect():
+        connections.append(Connection(len(connections)))
+        return connections[-1]
+    pool = ConnectionPool(connect, size=2, timeout=0.1)
+
+    # a thread gets the same connection when it checks out again
+    with pool.connection() as conn:
+        with pool.connection() as again:
+            assert again is conn
+        assert conn.pings == 1
+
+        # another thread gets another one
+        others = []
+        def check_out():
+            with pool.connection() as other:
+                others.append(other)
+        thread = threading.Thread(target=check_out)
+        thread.start()
+        thread.join()
+        assert others[0] is not conn and len(connections) == 2
+
+        # the pool is full
+        with pool.connection() as again:
+            assert again is conn
+        thread = threading.Thread(target=check_out)
+        thread.start()
+        thread.join()
+        assert others[1] is connections[1]
+
+    # a lost connection is replaced
+    try:
+        with pool.connection() as conn:
+            raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+    except pymysql.err.OperationalError:
+        pass
+    assert conn.closed
+    lost = conn
+    with pool.connection() as conn:
+        assert conn is not lost
+        thread = threading.Thread(target=check_out)
+        thread.start()
+        thread.join()
+    assert len(connections) == 3
+
+    pool.close()
+    assert all(conn.closed for conn in connections)
+
+class Cursor(object):
+    """ Stands in for a pymysql cursor, yields one row of a gene per transcript """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def execute(self, query, values=None):
+        pass
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+class StreamConnection(Connection):
+    def cursor(self, cursor_class=None):
+        gene = {'Gene_start': 1, 'Gene_stop': 10, 'Chromosome': '4', 'description': 'a gene', 'RefSeq_ID': None}
+        return Cursor(dict(gene, Ensembl_gene_id='ENSG{}'.format(i), HGNC_symbol='G{}'.format(i),
+                           Transcript_ID='ENST{}'.format(i)) for i in range(3))
+
+def test_query_while_streaming():
+    for pool_size in (1, 2):
+        ensembl = Ensembl(pool_size=pool_size, cache_size=0)
+        connections = []
+        def connect():
+            connections.append(StreamConnection(len(connections)))
+            return connections[-1]
+        ensembl.pool = ConnectionPool(connect, size=pool_size)
+
+        genes = ensembl.stream_transcripts()
+        assert next(genes)['HGNC_symbol'] == 'G0'
+
+        # the stream holds the only connection, this thread would wait for itself
+        if pool_size == 1:
+            with pytest.raises(RuntimeError):
+                ensembl.execute('SELECT 1')
+        else:
+            assert len(ensembl.execute('SELECT 1')) == 3
+            assert len(connections) == 2
+
+        assert [gene['HGNC_symbol'] for gene in genes] == ['G1', 'G2']
+
+        # the connection is back in the pool when the stream is done
+        assert len(ensembl.execute('SELECT 1')) == 3
+        assert len(connections) == pool_size
+
+def test_query_cache(tmpdir):
+    path = str(tmpdir.join('ensembl.sqlite'))
+    cache = QueryCache(maxsize=2, path=path)
+    rows = [{'Chromosome': '4', 'Ensembl_gene_id': 'ENSG00000145331', 'Gene_start': 100467866, 'Gene_stop': 100485189}]
+
+    assert cache.get(('db', None, None, 'TRMT10A', None)) == (False, None)
+    cache.set(('db', None, None, 'TRMT10A', None), rows)
+    cache.set(('db', '616013', None, None, None), []) # empty results are cached too
+
+    hit, cached = cache.get(('db', None, None, 'TRMT10A', None))
+    assert hit and cached == rows
+    cached[0]['Chromosome'] = 'X' # a copy
+    assert cache.get(('db', None, None, 'TRMT10A', None))[1] == rows
+    assert cache.get(('db', '616013', None, None, None)) == (True, [])
+
+    # least recently used goes first
+    cache.set(('db', None, None, 'PIK3R2', None), [])
+    assert list(cache.memory) == ['["db", "616013", null, null, null]', '["db", null, null, "PIK3R2", null]']
+    assert cache.stats() == {'hits': 3, 'disk_hits': 0, 'misses': 1, 'hit_rate': 0.75}
+    cache.close()
+
+    # kept on disk in between runs
+    cache = QueryCache(path=path)
+    assert cache.get(('db', '616013', None, None, None)) == (True, [])
+    assert cache.get(('other_db', '616013', None, None, None)) == (False, None)
+    assert cache.stats()['disk_hits'] == 1
+    cache.close()
+
+def test_filter_candidates():
+    def row(ensembl_gene_id, hgnc_symbol, omim_morbid, start=18263968):
+        return {'Gene_start': start, 'Gene_stop': 18288927, 'Chromosome': '19',
+                'Ensembl_gene_id': ensembl_gene_id, 'HGNC_symbol': hgnc_symbol, 'OMIM_morbid': omim_morbid}
+    candidates = [row('ENSG00000268173', 'PIK3R2', '603157'), row('ENSG00000268173', 'PIK3R2', '615937'),
+                  row('ENSG00000105647', 'PIK3R2', '603157', 18263928), row('ENSG00000105646', 'OTHER', None)]
+
+    def ids(**identifiers):
+        return [line['Ensembl_gene_id'] for line in filter_candidates(candidates, **identifiers)]
+
+    assert ids(omim_morbid='603157') == ['ENSG00000268173', 'ENSG00000105647']
+    assert ids(omim_morbid=615937, hgnc_symbol='pik3r2') == ['ENSG00000268173']
+    assert ids(ensembl_gene_id='ENSG00000105647', omim_morbid='615937') == []
+    assert ids(hgnc_symbol='OTHER', chromosome='19') == ['ENSG00000105646']
+    assert ids(hgnc_symbol='OTHER', chromosome='X') == []
+    assert filter_candidates(candidates, ensembl_gene_id='ENSG00000105647') == [
+        {'Gene_start': 18263928, 'Gene_stop': 18288927, 'Chromosome': '19', 'Ensembl_gene_id': 'ENSG00000105647'}]
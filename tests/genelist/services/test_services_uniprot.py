@@ -1,7 +1,85 @@
-from genelist.services.uniprot import Uniprot
+import io
+import json
+
+import requests
+import xmltodict
+import pytest
+
+from genelist.services.uniprot import Uniprot, parse_entries, search_params, parse_description, \
+    parse_description_xml
 from genelist.utils import cleanup_description
 
 uniprot = Uniprot()
 
 def test_resolve_gene():
     assert uniprot.fetch_description('O95363') == cleanup_description('Phenylalanine--tRNA ligase, mitochondrial')
+
+def test_parse_entries():
+    assert search_params(['O95363', 'Q5JWF2'], reviewed_only=True)['query'] == \
+        '(accession:O95363 OR accession:Q5JWF2) AND reviewed:true'
+
+    data = {'results': [
+        {'entryType': 'UniProtKB reviewed (Swiss-Prot)', 'primaryAccession': 'O95363',
+         'secondaryAccessions': ['Q5TBU3'],
+         'proteinDescription': {'recommendedName': {'fullName': {'value': 'Phenylalanine--tRNA ligase, mitochondrial'}}}},
+        {'entryType': 'UniProtKB unreviewed (TrEMBL)', 'primaryAccession': 'Q5JWF2',
+         'proteinDescription': {'submissionNames': [{'fullName': {'value': 'GNAS'}}]}},
+    ]}
+    entries = parse_entries(data, ['Q5TBU3', 'Q5JWF2', 'P00000'])
+    assert entries == {
+        'Q5TBU3': {'accession': 'O95363', 'reviewed': True,
+                   'description': cleanup_description('Phenylalanine--tRNA ligase, mitochondrial')},
+        'Q5JWF2': {'accession': 'Q5JWF2', 'reviewed': False, 'description': None},
+    }
+
+def test_parse_description_xml():
+    content = open('tests/fixtures/uniprot-O95363.xml', 'rb').read()
+    description = parse_description(xmltodict.parse(content))
+    assert description == cleanup_description('Phenylalanine--tRNA ligase, mitochondrial')
+    assert parse_description_xml(io.BytesIO(content)) == description
+
+    # the parse stops at the full name, the rest of the entry is not read
+    end = content.index(b'</fullName>') + len(b'</fullName>')
+    assert parse_description_xml(io.BytesIO(content[:end] + b' ' * (1 << 16) + b'<not xml')) == description
+
+    # the alternative name is not the recommended one
+    content = content.replace(b'<fullName evidence="1">Phenylalanine--tRNA ligase, mitochondrial</fullName>', b'')
+    assert parse_description(xmltodict.parse(content)) is None
+    assert parse_description_xml(io.BytesIO(content)) is None
+
+class Search(object):
+    """ Stands in for requests on the search of UniProt: one result per page """
+
+    def __init__(self, results):
+        self.results = results
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append((url, params))
+        cursor = int(url.split('cursor=')[1]) if 'cursor=' in url else 0
+        res = requests.Response()
+        res.status_code = 500 if 'BROKEN' in str(params) else 200
+        res.url = url
+        res.from_cache = True
+        res._content = json.dumps({'results': self.results[cursor:cursor + 1]}).encode()
+        if cursor + 1 < len(self.results):
+            res.headers['Link'] = '<https://rest.uniprot.org/uniprotkb/search?cursor=%d>; rel="next"' % (cursor + 1)
+        return res
+
+def test_fetch_entries(monkeypatch):
+    from genelist.services import uniprot as uniprot_module
+
+    results = [{'entryType': 'UniProtKB unreviewed (TrEMBL)', 'primaryAccession': accession,
+                'proteinDescription': {'recommendedName': {'fullName': {'value': accession}}}}
+               for accession in ('O95363', 'Q5JWF2', 'Q5TBU3')]
+    search = Search(results)
+    monkeypatch.setattr(uniprot_module, 'requests', search)
+
+    # the pages past the first are followed
+    entries = uniprot.fetch_entries(['Q5TBU3', 'O95363', 'Q5JWF2'])
+    assert sorted(entries) == ['O95363', 'Q5JWF2', 'Q5TBU3']
+    assert [params is None for url, params in search.requests] == [False, True, True]
+    assert search.requests[2][0].endswith('cursor=2')
+
+    with pytest.raises(requests.HTTPError):
+        uniprot.fetch_entries(['BROKEN'])
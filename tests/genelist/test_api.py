@@ -0,0 +1,85 @@
+import pytest
+
+from genelist.api import readlist, readcolumns
+
+def test_readcolumns():
+    columns = ['HGNC_symbol', 'Clinical_db_gene_annotation', 'Not_a_column']
+    for genelist in ['tests/fixtures/cmms.txt', 'tests/fixtures/cust000-Clinical_master_list.txt']:
+        comments, lines = readlist(open(genelist))
+        expected = [tuple(line.get(column, '') for column in columns) for line in lines]
+
+        projected_comments, header, rows = readcolumns(open(genelist), columns)
+        assert projected_comments == comments
+        assert header[:3] == ['Chromosome', 'Gene_start', 'Gene_stop']
+        assert list(rows) == expected
+
+    comments, header, rows = readcolumns(['#A\tB\n', '1\t2\n', '3\n', '4\t5\t6\n'], ['B'])
+    assert list(rows) == [('2', ), ('', ), ('5', )]
+
+def test_readcolumnar(tmpdir):
+    from genelist.modules.export import write_columnar
+    from genelist.api import readcolumnar
+
+    for genelist in ['tests/fixtures/cmms.txt', 'tests/fixtures/cust000-Clinical_master_list.txt']:
+        columnar = tmpdir.join('list.glc')
+        with open(str(columnar), 'wb') as outfile:
+            write_columnar(open(genelist), outfile)
+
+        comments, header, rows = readcolumns(open(genelist), None)
+        rows = list(rows)
+        with readcolumnar(str(columnar)) as columnar_list:
+            assert columnar_list.comments == comments
+            assert columnar_list.header == header
+            assert len(columnar_list) == len(rows)
+            assert list(columnar_list.rows()) == rows
+            assert [str(value) for value in columnar_list.column('Gene_start')] == [row[1] for row in rows]
+            assert columnar_list.column('HGNC_symbol') == [row[3] for row in rows]
+            assert len(columnar_list.values('Chromosome')) < len(rows)
+
+    # coordinates are int arrays when all of them are ints, codes are fixed width
+    with readcolumnar(str(columnar)) as columnar_list:
+        gene_start = columnar_list.column('Gene_start')
+        assert gene_start.format == 'q' and gene_start.itemsize == 8
+        assert columnar_list.codes('Chromosome').itemsize == 1
+        assert columnar_list._meta['Gene_start']['dtype'] == '<i8'
+        assert columnar_list._meta['Chromosome']['dtype'] == '<u1'
+
+    # closing unmaps the file and releases the arrays
+    assert columnar_list.mmap.closed
+    with pytest.raises(ValueError):
+        gene_start[0]
+
+def test_array_typecode():
+    from genelist.api import array_typecode
+    import array
+
+    for dtype, itemsize in (('<u1', 1), ('<u2', 2), ('<u4', 4), ('<u8', 8), ('<i8', 8)):
+        typecode = array_typecode(dtype)
+        assert array.array(typecode).itemsize == itemsize
+        assert typecode.isupper() == (dtype[1] == 'u')
+    with pytest.raises(ValueError):
+        array_typecode('<u3')
+
+def test_interval_index():
+    np = pytest.importorskip('numpy')
+    from genelist.api import IntervalIndex
+
+    rows = [('1', '100', '200'), ('1', '150', '1000'), ('chr2', '100', '200'), ('1', 'NA', '10'), ('X', '5', '5')]
+    index = IntervalIndex(rows)
+
+    chromosomes = ['1', '1', 'chr1', '2', '3', 'X', '1']
+    starts = [50, 150, 250, 200, 100, 5, 1]
+    stops = [99, 150, 250, 300, 100, 5, 100]
+    query_ids, row_ids = index.query(chromosomes, starts, stops)
+    assert list(zip(query_ids.tolist(), row_ids.tolist())) == [(1, 0), (1, 1), (2, 1), (3, 2), (5, 4), (6, 0)]
+
+    # against a scan of all pairs
+    random = np.random.RandomState(1)
+    genes = [(str(c), s, s + l) for c, s, l in zip(random.randint(1, 3, 200), random.randint(1, 10000, 200),
+                                                   random.randint(0, 2000, 200))]
+    index = IntervalIndex(genes)
+    chromosomes, starts = random.randint(1, 4, 1000).astype(str), random.randint(1, 12000, 1000)
+    query_ids, row_ids = index.query(chromosomes, starts)
+    expected = [(i, j) for i, (c, p) in enumerate(zip(chromosomes, starts))
+                for j, (gc, gs, ge) in enumerate(genes) if gc == c and gs <= p <= ge]
+    assert list(zip(query_ids.tolist(), row_ids.tolist())) == expected
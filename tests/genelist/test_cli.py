@@ -0,0 +1,33 @@
+import gzip
+
+from click.testing import CliRunner
+
+from genelist.cli import run
+from genelist.api import readregion
+
+def test_merge_bgzip(tmpdir):
+    infiles = ['tests/fixtures/merge-1.txt', 'tests/fixtures/merge-2.txt']
+    runner = CliRunner()
+    merged = runner.invoke(run, ['merge', '-d', 'ID', '-d', 'OMIM'] + infiles)
+    assert merged.exit_code == 0, merged.output
+
+    for sort in ([], ['--sort']):
+        path = str(tmpdir.join('merged{}.txt.gz'.format(len(sort))))
+        result = runner.invoke(run, ['merge', '-d', 'ID', '-d', 'OMIM', '--bgzip', path] + sort + infiles)
+        assert result.exit_code == 0, result.output
+
+        # the merged list with the coordinates after the chromosome
+        written = gzip.open(path, 'rt').read().splitlines()
+        header = written[1].lstrip('#').split('\t')
+        assert header[:3] == ['Chromosome', 'Gene_start', 'Gene_stop']
+        assert sorted(line.split('\t')[:1] + line.split('\t')[3:] for line in written[2:]) == \
+            sorted(line.split('\t') for line in merged.output.splitlines()[2:])
+
+        comments, lines = readregion(path, '16', 70286198, 70286198)
+        assert [line['HGNC_symbol'] for line in lines] == ['AARS']
+
+def test_query_without_index(tmpdir):
+    result = CliRunner().invoke(run, ['query', str(tmpdir), 'gene', 'FARS2'])
+    assert result.exit_code == 2
+    assert 'run genelist index first' in result.output
+    assert tmpdir.listdir() == []
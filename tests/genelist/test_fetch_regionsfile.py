@@ -0,0 +1,39 @@
+from genelist import fetch_regionsfile
+from genelist.fetch_regionsfile import query_sharded, CHROMOSOMES
+
+def test_query_sharded(tmpdir, monkeypatch):
+    calls = tmpdir.join('omim-calls.txt')
+
+    def query_ensembl(chromosome=None):
+        for i in range(3):
+            yield {'Chromosome': chromosome, 'Gene_start': i * 10 + 1, 'Gene_stop': i * 10 + 5,
+                   'HGNC_symbol': 'GENE{}-{}'.format(chromosome, i), 'Gene_description': ''}
+
+    class OMIM(object):
+        """ Records the time of each call, from any worker """
+        def __init__(self, api_key):
+            pass
+
+        def gene(self, hgnc_symbol):
+            with open(str(calls), 'a') as f:
+                f.write('{!r}\n'.format(fetch_regionsfile.monotonic()))
+            return {'phenotypes': [], 'mim_number': 1}
+
+        def parse_phenotypic_disease_model(self, phenotypes):
+            return None
+
+    monkeypatch.setattr(fetch_regionsfile, 'query_ensembl', query_ensembl)
+    monkeypatch.setattr(fetch_regionsfile, 'OMIM', OMIM)
+    monkeypatch.setattr(fetch_regionsfile, 'OMIM_INTERVAL', 0.05)
+
+    chromosomes = ['X', '1', '2', '10']
+    lines = list(query_sharded(chromosomes, jobs=4))
+    assert [line.split('\t')[0] for line in lines] == [chromosome for chromosome in chromosomes for i in range(3)]
+    assert lines[0].split('\t')[4:7] == ['GENEX-0', '', 'GENEX-0:1']
+
+    # the workers together keep the interval between OMIM calls, the calls are timed after the
+    # throttle lets them through, so allow for the scheduling of the workers
+    times = sorted(float(line) for line in calls.readlines())
+    assert len(times) == 12
+    assert min(b - a for a, b in zip(times, times[1:])) >= 0.05 * 0.5
+    assert times[-1] - times[0] >= 11 * 0.05 * 0.9
@@ -0,0 +1,53 @@
+import os
+import json
+
+from genelist.utils import acronyms as acronyms_module
+from genelist.utils.acronyms import Acronyms
+
+def write_list(path, panels):
+    rows = ['\t'.join(['1', '1', '2'] + ['x'] * 14 + [panel]) for panel in panels]
+    path.write('#Chromosome\n' + '\n'.join(rows) + '\n')
+
+def test_acronyms(tmpdir, monkeypatch):
+    cust = tmpdir.mkdir('cust000')
+    cust.join('LISTS').write('CMMS: Cerebellar malformations\nNMD: Neuromuscular disorders\n')
+    write_list(cust.join('cust000-CMMS.txt'), ['CMMS', 'CMMS', 'ATX, CMMS'])
+    write_list(cust.join('cust000-NMD.txt'), ['NMD'])
+
+    read = []
+    read_panels = acronyms_module.read_panels
+    def counting_read_panels(gl):
+        read.append(os.path.basename(gl))
+        return read_panels(gl)
+    monkeypatch.setattr(acronyms_module, 'read_panels', counting_read_panels)
+
+    acronyms = Acronyms(str(tmpdir))
+    assert acronyms['NMD'] == 'Neuromuscular disorders'
+    assert acronyms['XXX'] == ''
+    assert read == []
+
+    assert acronyms.get_panels_of('CMMS') == ['CMMS', 'ATX']
+    assert read == ['cust000-CMMS.txt']
+    assert tmpdir.join('.genelist-panels.json').check()
+
+    # the index is reused by the next run, until the gene list changes
+    saved = []
+    save_index = Acronyms._save_index
+    def counting_save_index(self):
+        saved.append(self._index_changed)
+        return save_index(self)
+    monkeypatch.setattr(Acronyms, '_save_index', counting_save_index)
+
+    assert Acronyms(str(tmpdir)).panels == {'CMMS': ['CMMS', 'ATX'], 'NMD': ['NMD']}
+    assert read == ['cust000-CMMS.txt', 'cust000-NMD.txt']
+    assert saved == [True]
+
+    write_list(cust.join('cust000-CMMS.txt'), ['CMMS', 'OMIM'])
+    assert Acronyms(str(tmpdir)).get_panels_of('CMMS') == ['CMMS', 'OMIM']
+    assert Acronyms(str(tmpdir)).get_panels_of('NMD') == ['NMD']
+    assert read == ['cust000-CMMS.txt', 'cust000-NMD.txt', 'cust000-CMMS.txt']
+
+    # a gene list that is gone is dropped from the index
+    cust.join('cust000-NMD.txt').remove()
+    assert Acronyms(str(tmpdir)).panels == {'CMMS': ['CMMS', 'OMIM']}
+    assert list(json.load(tmpdir.join('.genelist-panels.json').open())) == ['cust000/cust000-CMMS.txt']
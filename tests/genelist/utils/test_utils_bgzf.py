@@ -0,0 +1,40 @@
+import gzip
+import random
+
+from genelist import api
+from genelist.utils.bgzf import write_indexed, read_region
+
+def test_write_indexed(tmpdir):
+    rng = random.Random(1)
+    header = ['Chromosome', 'Gene_start', 'Gene_stop', 'HGNC_symbol', 'Comments']
+    rows = []
+    for i in range(5000):
+        start = rng.randint(1, 5000000)
+        rows.append([rng.choice(['1', '2', '10', 'X']), str(start), str(start + rng.randint(0, 100000)),
+                     'GENE{}'.format(i), 'x' * rng.randint(0, 40)])
+    lines = ['##Database=<ID=test.txt>', '#' + '\t'.join(header)] + ['\t'.join(row) for row in rows]
+
+    path = str(tmpdir.join('list.txt.gz'))
+    write_indexed(iter(lines), path, max_lines=1000)
+
+    # plain gzip readers see the sorted list
+    written = gzip.open(path, 'rt').read().splitlines()
+    order = {'1': 0, '2': 1, '10': 2, 'X': 3}
+    assert written[:2] == lines[:2]
+    assert written[2:] == ['\t'.join(row) for row in sorted(rows, key=lambda row: (order[row[0]], int(row[1])))]
+
+    comments, lines = api.readlist(path)
+    assert comments == [['##Database=<ID=test.txt>']]
+    assert len(list(lines)) == len(rows)
+
+    for chromosome, start, stop in [('2', 1000000, 1200000), ('X', 1, 20), ('10', None, None), ('Y', 1, 10),
+                                    ('1', 4900000, 6000000)]:
+        header_lines, region = read_region(path, chromosome, start, stop)
+        expected = [row for row in written[2:] if row.split('\t')[0] == chromosome and
+                    (start is None or (int(row.split('\t')[2]) >= start and int(row.split('\t')[1]) <= stop))]
+        assert [line.rstrip('\n') for line in region] == expected
+
+    comments, lines = api.readregion(path, '2', 1000000, 1200000)
+    assert [line['HGNC_symbol'] for line in lines] == \
+        [row.split('\t')[3] for row in written[2:] if row.startswith('2\t') and
+         int(row.split('\t')[2]) >= 1000000 and int(row.split('\t')[1]) <= 1200000]
@@ -0,0 +1,141 @@
+import os
+import subprocess
+
+import pytest
+
+from genelist.utils import git
+from genelist.utils.git import GitIndex, GitMetadata, getgittag, getgitlastmoddate
+
+def run_git(repo, *args, **kwargs):
+    env = dict(os.environ, GIT_AUTHOR_NAME='test', GIT_AUTHOR_EMAIL='test@example.com',
+               GIT_COMMITTER_NAME='test', GIT_COMMITTER_EMAIL='test@example.com')
+    if 'date' in kwargs:
+        env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = kwargs['date']
+    subprocess.check_call(['git', '-C', repo] + list(args), env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+@pytest.fixture
+def repo(tmpdir):
+    """ A gene list repo with tagged and untagged commits and an uncommitted list """
+    repo = str(tmpdir.mkdir('cust000'))
+    run_git(repo, 'init', '-b', 'master')
+
+    def commit(filename, date, tag=None):
+        with open(os.path.join(repo, filename), 'a') as f:
+            f.write(date + '\n')
+        run_git(repo, 'add', filename)
+        run_git(repo, 'commit', '-m', filename, date=date)
+        if tag:
+            run_git(repo, 'tag', '-a', tag, '-m', tag, date=date)
+
+    commit('cust000-A.txt', '2015-02-09T14:19:16 +0000', 'A-1.0')
+    commit('cust000-B.txt', '2015-03-09T14:19:16 +0000', 'B-2.0')
+    commit('cust000-A.txt', '2015-04-09T14:19:16 +0000')
+    commit('cust000-C.txt', '2015-05-09T14:19:16 +0000')
+    commit('cust000-B.txt', '2015-06-09T14:19:16 +0000', 'B-2.1')
+    open(os.path.join(repo, 'cust000-D.txt'), 'w').close()
+
+    return repo
+
+def test_git_metadata(repo, monkeypatch):
+    monkeypatch.setenv('TZ', 'UTC')
+    filenames = [os.path.join(repo, 'cust000-{}.txt'.format(name)) for name in 'ABCD']
+
+    cwd = os.getcwd()
+    expected = []
+    for filename in filenames:
+        full_mod_date = getgitlastmoddate(filename, '%c') if filename[-5] != 'D' else False
+        expected.append((full_mod_date, getgittag(filename, full_mod_date)))
+    assert os.getcwd() == cwd
+    assert expected[0][0] == 'Thu Apr  9 14:19:16 2015'
+    assert expected[0][1].startswith('2.0-1-g')
+    assert expected[1][1] == '2.1'
+    head_tag = getgittag(filenames[0])
+
+    # count the git calls
+    calls = []
+    check_output = subprocess.check_output
+    def counting_check_output(command, **kwargs):
+        calls.append(command)
+        return check_output(command, **kwargs)
+    monkeypatch.setattr(git.subprocess, 'check_output', counting_check_output)
+
+    git_metadata = GitMetadata()
+    git_metadata.prefetch(filenames)
+    assert len(calls) == 3 # rev-parse, log, for-each-ref
+
+    assert [(git_metadata.lastmoddate(filename, '%c'), git_metadata.tag(filename))
+            for filename in filenames] == expected
+    assert git_metadata.head_tag(filenames[0]) == head_tag == '2.1'
+    assert len(calls) == 3
+
+def test_git_index_describe(repo):
+    run_git(repo, 'checkout', '-b', 'topic', 'A-1.0')
+    with open(os.path.join(repo, 'cust000-E.txt'), 'w') as f:
+        f.write('E\n')
+    run_git(repo, 'add', 'cust000-E.txt')
+    run_git(repo, 'commit', '-m', 'E', date='2015-07-09T14:19:16 +0000')
+    run_git(repo, 'tag', 'E-0.1') # lightweight
+    run_git(repo, 'checkout', 'master')
+    run_git(repo, 'merge', '--no-ff', '-m', 'merge topic', 'topic', date='2015-08-09T14:19:16 +0000')
+
+    index = GitIndex(repo)
+    index.load()
+    assert len(index.parents) == 7
+    for sha1 in list(index.parents) + [None]:
+        for tags in (True, False):
+            command = ['git', '-C', repo, 'describe'] + (['--tags'] if tags else []) + [sha1 or 'HEAD']
+            try:
+                expected = subprocess.check_output(command, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+            except subprocess.CalledProcessError:
+                expected = None
+            assert index.describe(sha1, tags) == expected
+
+def test_git_index_last_commit_merges(repo):
+    # the topic changes A and C, the merge keeps A of master and changes B itself
+    run_git(repo, 'checkout', '-b', 'topic', 'B-2.1~1')
+    for filename in ('cust000-A.txt', 'cust000-C.txt'):
+        with open(os.path.join(repo, filename), 'a') as f:
+            f.write('topic\n')
+    run_git(repo, 'commit', '-a', '-m', 'topic', date='2015-07-09T14:19:16 +0000')
+    run_git(repo, 'checkout', 'master')
+    run_git(repo, 'merge', '--no-ff', '--no-commit', '-m', 'merge topic', 'topic')
+    run_git(repo, 'checkout', 'master', '--', 'cust000-A.txt')
+    with open(os.path.join(repo, 'cust000-B.txt'), 'a') as f:
+        f.write('merge\n')
+    run_git(repo, 'commit', '-a', '-m', 'merge topic', date='2015-08-09T14:19:16 +0000')
+
+    # a merge that keeps the tree of master: git log -m leaves out its empty diff to master
+    run_git(repo, 'checkout', '-b', 'ours', 'master~1')
+    with open(os.path.join(repo, 'cust000-C.txt'), 'a') as f:
+        f.write('ours\n')
+    run_git(repo, 'commit', '-a', '-m', 'ours', date='2015-09-09T14:19:16 +0000')
+    run_git(repo, 'checkout', 'master')
+    run_git(repo, 'merge', '--no-ff', '-s', 'ours', '-m', 'merge ours', 'ours', date='2015-10-09T14:19:16 +0000')
+
+    # and one that takes the tree of the side branch, its empty diff to that parent is left out
+    run_git(repo, 'checkout', '-b', 'theirs', 'master')
+    with open(os.path.join(repo, 'cust000-A.txt'), 'a') as f:
+        f.write('theirs\n')
+    run_git(repo, 'commit', '-a', '-m', 'theirs', date='2015-11-09T14:19:16 +0000')
+    run_git(repo, 'checkout', 'master')
+    run_git(repo, 'merge', '--no-ff', '-m', 'merge theirs', 'theirs', date='2015-12-09T14:19:16 +0000')
+
+    index = GitIndex(repo)
+    index.load()
+    assert not index.linear
+
+    # the history is simplified in memory, without asking git per file
+    calls = []
+    def git_call(*args):
+        calls.append(args)
+    index.git = git_call
+    for name in 'ABCD':
+        path = 'cust000-{}.txt'.format(name)
+        expected = subprocess.check_output(['git', '-C', repo, 'log', '-1', '--format=%H%x09%ct%x09%cd', '--', path])
+        expected = expected.decode('utf-8').strip().split('\t')
+        commit = index.last_commit(path)
+        assert (commit[0] if commit else '') == expected[0]
+        if commit:
+            assert commit[1:] == (int(expected[1]), expected[2])
+    assert calls == []
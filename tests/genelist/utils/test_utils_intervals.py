@@ -0,0 +1,33 @@
+from genelist.utils.intervals import find_overlaps
+
+def pairs(intervals):
+    """ The line nrs of the overlapping pairs, in line order """
+    return sorted(tuple(sorted((interval[3], other[3]))) for interval, other in find_overlaps(intervals))
+
+def test_find_overlaps():
+    intervals = [
+        ('1', 100, 200, 1),
+        ('1', 150, 300, 2), # overlaps 1
+        ('1', 100, 200, 3), # same as 1
+        ('1', 400, 500, 4),
+        ('1', 250, 260, 5), # within 2
+        ('2', 100, 200, 6), # other chromosome
+        ('2', 300, 200000, 7),
+        ('1', 500, 600, 8), # touches 4
+    ]
+
+    assert pairs(intervals) == [(1, 2), (1, 3), (2, 3), (2, 5), (4, 8)]
+    for interval, other in find_overlaps(intervals):
+        assert other < interval
+
+def test_find_overlaps_within_a_long_interval():
+    # B and C overlap each other, not only the long A
+    intervals = [('1', 1, 100, 1), ('1', 10, 20, 2), ('1', 15, 30, 3), ('1', 40, 50, 4)]
+
+    assert pairs(intervals) == [(1, 2), (1, 3), (1, 4), (2, 3)]
+
+def test_find_overlaps_start_stop_of_other_genes():
+    # the start of one gene and the stop of another
+    intervals = [('1', 100, 200, 1), ('1', 300, 400, 2), ('1', 100, 400, 3)]
+
+    assert pairs(intervals) == [(1, 3), (2, 3)]
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from genelist.utils.pipeline import Pipeline
+
+def test_pipeline():
+    local = threading.local()
+    seen = []
+
+    def number(items):
+        for i, item in enumerate(items):
+            local.nr = i
+            yield item
+
+    def double(items):
+        for item in items:
+            seen.append((threading.current_thread().name, local.nr, item))
+            yield item
+            if item % 3 == 0:
+                yield -item
+
+    def drop_odd(items):
+        for item in items:
+            if item % 2 == 0:
+                yield item
+
+    pipeline = Pipeline([number, double, drop_odd], maxsize=2,
+                        get_context=lambda: getattr(local, 'nr', None),
+                        set_context=lambda context: setattr(local, 'nr', context))
+    out = []
+    for item in pipeline.run(range(10)):
+        out.append((item, local.nr))
+    assert out == [(0, 0), (0, 0), (2, 2), (4, 4), (6, 6), (-6, 6), (8, 8)]
+
+    # the stages ran in their own threads, with the context of the item
+    assert [(nr, item) for name, nr, item in seen] == [(i, i) for i in range(10)]
+    assert threading.current_thread().name not in set(name for name, nr, item in seen)
+
+def test_pipeline_stops():
+    def fail(items):
+        for item in items:
+            if item == 5:
+                raise ValueError(item)
+            yield item
+
+    with pytest.raises(ValueError) as excinfo:
+        list(Pipeline([fail, lambda items: (item for item in items)]).run(range(10)))
+    assert excinfo.traceback[-1].name == 'fail' # raised with the traceback of the stage
+
+    # a closed pipeline stops its threads
+    before = threading.active_count()
+    items = Pipeline([lambda items: (item for item in items)], maxsize=1).run(iter(range(1000)))
+    assert next(items) == 0
+    items.close()
+    assert threading.active_count() == before
@@ -0,0 +1,50 @@
+import time
+import threading
+
+import pytest
+
+from genelist.utils.singleflight import SingleFlight
+
+def test_singleflight():
+    flights = SingleFlight()
+    calls = []
+    started, release = threading.Event(), threading.Event()
+
+    def lookup(symbol):
+        calls.append(symbol)
+        started.set()
+        release.wait()
+        if symbol == 'BAD':
+            raise KeyError(symbol)
+        return [symbol]
+
+    results = []
+    def call(symbol):
+        try:
+            results.append(flights.do(symbol, lookup, symbol))
+        except KeyError as error:
+            results.append(error)
+
+    for i, symbol in enumerate(('FARS2', 'BAD')):
+        started.clear()
+        release.clear()
+        threads = [threading.Thread(target=call, args=(symbol,)) for i in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while flights.shared < 4 * (i + 1): # wait for the others to join the call in flight
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert calls == ['FARS2', 'BAD']
+    assert results[:5] == [['FARS2']] * 5
+    assert all(isinstance(result, KeyError) for result in results[5:])
+    assert flights.shared == 8 and flights.calls == {}
+
+    # a call after is made again
+    release.set()
+    assert flights.do('FARS2', lookup, 'FARS2') == ['FARS2']
+    assert calls == ['FARS2', 'BAD', 'FARS2']